@@ -1,7 +1,8 @@
 from django.contrib import admin
 from .models import (
     Prefecture, Municipality, Country, UserInfo, Criteria,
-    EvaluationSurvey, MunicipalityScore
+    EvaluationSurvey, MunicipalityBaseScore, MunicipalityScore, MunicipalityProfile,
+    ScoreImportLedger
 )
 
 # Inlines để quản lý dữ liệu liên quan ngay trong trang cha
@@ -41,17 +42,34 @@ class UserInfoAdmin(admin.ModelAdmin):
 
 @admin.register(Criteria)
 class CriteriaAdmin(admin.ModelAdmin):
-    list_display = ('name', 'slug',)
+    list_display = ('name', 'slug', 'is_reverse', 'normalization',)
     search_fields = ('name', 'slug',)
 
 @admin.register(EvaluationSurvey)
 class EvaluationSurveyAdmin(admin.ModelAdmin):
-    list_display = ('user', 'municipality', 'criteria', 'score',)
-    list_filter = ('municipality', 'criteria', 'user__country',)
+    list_display = ('user', 'municipality', 'criteria', 'country', 'score',)
+    list_filter = ('municipality', 'criteria', 'country',)
     search_fields = ('user__name',)
 
+@admin.register(MunicipalityBaseScore)
+class MunicipalityBaseScoreAdmin(admin.ModelAdmin):
+    list_display = ('municipality', 'criteria', 'base_score',)
+    list_filter = ('criteria',)
+    search_fields = ('municipality__name',)
+
 @admin.register(MunicipalityScore)
 class MunicipalityScoreAdmin(admin.ModelAdmin):
     list_display = ('municipality', 'country', 'criteria', 'base_score', 'avg_score', 'final_score',)
     list_filter = ('municipality', 'country', 'criteria',)
-    search_fields = ('municipality__name', 'country__name',)
\ No newline at end of file
+    search_fields = ('municipality__name', 'country__name',)
+
+@admin.register(MunicipalityProfile)
+class MunicipalityProfileAdmin(admin.ModelAdmin):
+    list_display = ('municipality', 'status', 'fetched_at',)
+    list_filter = ('status',)
+    search_fields = ('municipality__name',)
+
+@admin.register(ScoreImportLedger)
+class ScoreImportLedgerAdmin(admin.ModelAdmin):
+    list_display = ('file_name', 'criteria', 'content_hash', 'row_count', 'imported_at',)
+    search_fields = ('file_name',)
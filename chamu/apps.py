@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class ChamuConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chamu'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .score_store import get_score_store
+        from .snapshot import get_score_snapshot
+
+        # Mở (memory-map) snapshot / score store ngay khi process khởi động, nếu được cấu hình
+        get_score_snapshot()
+        store = get_score_store()
+        if store is not None:
+            store.refresh()
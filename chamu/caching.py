@@ -0,0 +1,100 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from .versions import aget_versions, get_versions
+
+# Thời gian sống của các mục trong cache dùng chung. Khóa đã chứa phiên bản dữ liệu,
+# nên TTL chỉ giới hạn thời gian các mục cũ (không còn ai đọc) chiếm bộ nhớ.
+API_CACHE_TIMEOUT = getattr(settings, 'API_CACHE_TIMEOUT', 3600)
+FRAGMENT_CACHE_TIMEOUT = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 3600)
+# Trình duyệt / reverse proxy dùng lại response API trong thời gian này, sau đó hỏi lại bằng ETag
+API_CLIENT_MAX_AGE = getattr(settings, 'API_CLIENT_MAX_AGE', 60)
+# Trang kết quả chia sẻ được (URL chứa toàn bộ hồ sơ), xem views.shared_results_view
+RESULTS_PAGE_MAX_AGE = getattr(settings, 'RESULTS_PAGE_MAX_AGE', 300)
+
+
+def versions_tag(versions):
+    """'name.version' of each data version the entry depends on, e.g. 'scores.17-reference.4'."""
+    values = get_versions(versions)
+    return '-'.join(f'{name}.{values[name]}' for name in versions)
+
+
+async def aversions_tag(versions):
+    values = await aget_versions(versions)
+    return '-'.join(f'{name}.{values[name]}' for name in versions)
+
+
+def cache_key(namespace, parts=(), versions=()):
+    """
+    Key of a shared cache entry: chamu:<namespace>:<versions>:<hash of parts>.
+    Bumping any of the versions (see chamu/versions.py) makes every key built with
+    the old value unreachable, so writers never have to find and delete entries.
+    """
+    return versioned_key(namespace, versions_tag(versions), parts)
+
+
+def versioned_key(namespace, tag, parts):
+    return f'chamu:{namespace}:{tag}:{parts_digest(parts)}'
+
+
+def parts_digest(parts):
+    return hashlib.md5(json.dumps([str(part) for part in parts]).encode('utf-8')).hexdigest()
+
+
+def get_or_set(namespace, parts, versions, compute, timeout=API_CACHE_TIMEOUT):
+    """Return the cached value of the key, computing and storing it on a miss."""
+    key = cache_key(namespace, parts, versions)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
+
+
+async def aget_or_set(namespace, parts, versions, compute, timeout=API_CACHE_TIMEOUT):
+    """get_or_set for async views: compute is a coroutine function."""
+    key = versioned_key(namespace, await aversions_tag(versions), parts)
+    value = await cache.aget(key)
+    if value is None:
+        value = await compute()
+        await cache.aset(key, value, timeout)
+    return value
+
+
+def cached_json_response(namespace, parts, versions, compute, timeout=API_CACHE_TIMEOUT):
+    """
+    JsonResponse for a read-only API endpoint. compute() returns (data, status);
+    error responses (404/400) are cached too, they only depend on the same data.
+    """
+    data, status = get_or_set(namespace, parts, versions, compute, timeout)
+    return JsonResponse(data, status=status, safe=False)
+
+
+def api_etag(namespace, versions, params=()):
+    """
+    etag_func for an API view: the data versions plus the query parameters the
+    response depends on. It reads only the version counters, never the data: from the
+    shared cache with Redis, so a 304 needs no query at all (see versions.versions_in_cache).
+    """
+    def etag(request, *args, **kwargs):
+        parts = [request.GET.get(name, '') for name in params]
+        return f'{namespace}-{versions_tag(versions)}-{parts_digest(parts)}'
+    return etag
+
+
+def conditional_api(namespace, versions, params=()):
+    """
+    Decorator for read-only JSON views: strong ETag from the data versions,
+    304 on a matching If-None-Match (the view is not called), and a public
+    Cache-Control so browsers and a reverse proxy can reuse the response.
+    """
+    def decorator(view):
+        view = condition(etag_func=api_etag(namespace, versions, params))(view)
+        return cache_control(public=True, max_age=API_CLIENT_MAX_AGE)(view)
+    return decorator
@@ -1,11 +1,68 @@
 from django import forms
+from django.core.exceptions import ValidationError
+from django.forms.models import ModelChoiceIterator
+
 from .models import UserInfo, Prefecture, Municipality, Country
+from .reference_cache import get_reference_data
+
+
+# --- Reference data fields ---
+class ReferenceChoiceIterator(ModelChoiceIterator):
+    """Choices from the cached reference rows instead of a queryset."""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in self.field.get_objects():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.get_objects()) + (1 if self.field.empty_label is not None else 0)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.get_objects())
+
+
+class ReferenceChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField backed by the reference data cache (chamu/reference_cache.py):
+    rendering and validation need no query. `reference` names the cached list
+    ('countries' or 'prefectures'); the queryset is only kept for introspection.
+    """
+    iterator = ReferenceChoiceIterator
+
+    def __init__(self, reference, queryset, **kwargs):
+        self.reference = reference
+        super().__init__(queryset=queryset, **kwargs)
+
+    def get_objects(self):
+        return getattr(get_reference_data(), self.reference)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, self.queryset.model):
+            value = value.pk
+        try:
+            pk = self.queryset.model._meta.pk.to_python(value)
+        except ValidationError:
+            pk = None
+        for obj in self.get_objects():
+            if obj.pk == pk:
+                return obj
+        raise ValidationError(
+            self.error_messages['invalid_choice'],
+            code='invalid_choice',
+            params={'value': value},
+        )
+
 
 # --- Base form ---
 # This form stores all basic user information.
 class BaseUserInfoForm(forms.ModelForm):
     # These fields are common for both Evaluate and Match forms.
-    current_prefecture = forms.ModelChoiceField(
+    current_prefecture = ReferenceChoiceField(
+        'prefectures',
         queryset=Prefecture.objects.all().order_by('name'), # type: ignore
         required=False,
         label='Prefecture you currently live in'
@@ -15,7 +72,8 @@ class BaseUserInfoForm(forms.ModelForm):
         required=False,
         label='Municipality you currently live in'
     )
-    country = forms.ModelChoiceField(
+    country = ReferenceChoiceField(
+        'countries',
         queryset=Country.objects.all().order_by('name'),    # type: ignore
         required=True,
         label='Country'
@@ -28,10 +86,6 @@ class BaseUserInfoForm(forms.ModelForm):
             'name': forms.TextInput(attrs={'class': 'form-control'}),
         }
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.fields['country'].queryset = Country.objects.all().order_by('name')
-
 
 # --- Form for Evaluate flow ---
 # Extends the base form.
@@ -57,12 +111,14 @@ class EvaluateInfoForm(BaseUserInfoForm):
 # --- Form for Match flow ---
 # Add target fields for matching.
 class MatchInfoForm(forms.ModelForm):
-    target_prefecture = forms.ModelChoiceField(
+    target_prefecture = ReferenceChoiceField(
+        'prefectures',
         queryset=Prefecture.objects.all().order_by('name'), # type: ignore
         required=True,
         label='Prefecture you want to move in'
     )
-    country = forms.ModelChoiceField(
+    country = ReferenceChoiceField(
+        'countries',
         queryset=Country.objects.all().order_by('name'),    # type: ignore
         required=True,
         label='Country'
@@ -75,10 +131,6 @@ class MatchInfoForm(forms.ModelForm):
             'name': forms.TextInput(attrs={'class': 'form-control'}),
         }
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.fields['country'].queryset = Country.objects.all().order_by('name')
-
 # --- Other base form ---
 class EvaluationSurveyBaseForm(forms.Form):
     pass
@@ -0,0 +1,151 @@
+import asyncio
+import contextlib
+import io
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from chamu import wiki
+from chamu.models import Municipality, MunicipalityProfile, UserInfo
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class SlowWikipediaHandler(BaseHTTPRequestHandler):
+    """Stand-in for the Wikipedia API that answers after `latency` seconds."""
+    latency = 0.2
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        params = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+        title = params.get('titles', '').split('|')[0]
+        if params.get('prop') == 'pageimages':
+            query = {'pages': {'1': {'title': title, 'thumbnail': {'source': 'https://img/benchmark.jpg'}}}}
+        else:
+            query = {'pages': {'1': {'title': title, 'extract': f'{title} (benchmark)', 'fullurl': ''}}}
+        body = json.dumps({'query': query}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = ('Compares municipality detail pages served by a WSGI worker (a pool of threads) and by one '
+            'ASGI event loop, while every page waits on a slow local Wikipedia stand-in.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Detail pages per mode (one municipality without a profile each).')
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads of the WSGI mode.')
+        parser.add_argument('--concurrency', type=int, default=200, help='Requests in flight in the ASGI mode.')
+        parser.add_argument('--latency', type=float, default=0.2, help='Seconds per fake Wikipedia response.')
+        parser.add_argument('--max-per-host', type=int, default=None,
+                            help='Wikipedia connections per event loop (default: WIKI_MAX_CONNECTIONS_PER_HOST). '
+                                 'One ASGI loop shares this cap across all its requests.')
+
+    def handle(self, *args, **options):
+        municipality_ids = list(
+            Municipality.objects.filter(profile__isnull=True).order_by('id')
+            .values_list('id', flat=True)[:options['requests']]
+        )
+        if not municipality_ids:
+            self.stderr.write(self.style.ERROR('No municipality without a Wikipedia profile: import locations first.'))
+            return
+
+        SlowWikipediaHandler.latency = options['latency']
+        server = ThreadingHTTPServer(('127.0.0.1', 0), SlowWikipediaHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        api_url = f'http://127.0.0.1:{server.server_port}/w/api.php'
+
+        user_info = UserInfo.objects.create(name='benchmark_async_views')
+        max_per_host = wiki.async_http_client.max_per_host
+        if options['max_per_host']:
+            wiki.async_http_client.max_per_host = options['max_per_host']
+        try:
+            session_client = Client()
+            session = session_client.session
+            session['user_info_id'] = user_info.id
+            session.save()
+            cookie = {settings.SESSION_COOKIE_NAME: session.session_key}
+            urls = [reverse('municipality_details', args=[mid]) for mid in municipality_ids]
+
+            modes = [
+                (f'wsgi x{options["threads"]}', lambda: self.run_wsgi(urls, cookie, options['threads'])),
+                (f'asgi c{options["concurrency"]}', lambda: asyncio.run(self.run_asgi(urls, cookie, options['concurrency']))),
+            ]
+            # View in lỗi/tiến trình ra stdout; bỏ qua khi đo
+            with override_settings(WIKIPEDIA_API_URL=api_url, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for label, run in modes:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        latencies, errors, elapsed = run()
+                    # Xóa profile vừa tạo để chế độ sau cũng phải gọi Wikipedia
+                    MunicipalityProfile.objects.filter(municipality_id__in=municipality_ids).delete()
+                    self.stdout.write(self.style.SUCCESS(
+                        f'{label:>10}: {len(latencies)} requests in {elapsed:.2f}s '
+                        f'({len(latencies) / elapsed:.0f} req/s) | '
+                        f'p50 {statistics.median(latencies) * 1000:.0f} ms, '
+                        f'p95 {percentile(latencies, 0.95) * 1000:.0f} ms | errors {errors}'
+                    ))
+        finally:
+            wiki.async_http_client.max_per_host = max_per_host
+            user_info.delete()
+            server.shutdown()
+            server.server_close()
+
+    def run_wsgi(self, urls, cookie, thread_count):
+        local = threading.local()
+
+        def fetch(url):
+            if not hasattr(local, 'client'):
+                local.client = Client(raise_request_exception=False)
+                local.client.cookies.load(cookie)
+            started = time.perf_counter()
+            try:
+                response = local.client.get(url)
+            finally:
+                close_old_connections()
+            return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            results = list(executor.map(fetch, urls))
+        return self.summarize(results, time.perf_counter() - started)
+
+    async def run_asgi(self, urls, cookie, concurrency):
+        client = AsyncClient(raise_request_exception=False)
+        client.cookies.load(cookie)
+        slots = asyncio.Semaphore(concurrency)
+
+        async def fetch(url):
+            async with slots:
+                started = time.perf_counter()
+                response = await client.get(url)
+                return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(fetch(url) for url in urls))
+        return self.summarize(results, time.perf_counter() - started)
+
+    def summarize(self, results, elapsed):
+        latencies = [latency for latency, _ in results]
+        errors = sum(1 for _, status in results if status != 200)
+        return latencies, errors, elapsed
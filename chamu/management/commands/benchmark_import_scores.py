@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from .import_scores import normalize_score, parse_score_files, read_score_file
+
+
+def write_synthetic_scores(source_dir, target_dir, scale):
+    """
+    Copy every criteria file of source_dir into target_dir with its rows repeated
+    `scale` times (municipality names get a '#k' suffix, raw scores a small shift).
+    """
+    for filename in sorted(os.listdir(source_dir)):
+        if not filename.endswith('.csv'):
+            continue
+        rows = read_score_file(os.path.join(source_dir, filename))
+        with open(os.path.join(target_dir, filename), 'w', encoding='utf-8') as file:
+            number = 0
+            for k in range(scale):
+                for prefecture_name, municipality_name, raw_score in rows:
+                    number += 1
+                    file.write(f'{number},{prefecture_name},{municipality_name}#{k},{raw_score + k * 0.001}\n')
+
+
+class Command(BaseCommand):
+    help = 'Compares serial and parallel parsing/normalization of score files on synthetic 10x/100x data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scores_dir', type=str, help='Directory with the shipped score CSV files.')
+        parser.add_argument('--scales', type=int, nargs='+', default=[10, 100], help='Size multipliers to test.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes for the parallel run.')
+
+    def handle(self, *args, **options):
+        scores_dir = options['scores_dir']
+        workers = options['workers']
+        if not os.path.isdir(scores_dir):
+            self.stderr.write(self.style.ERROR(f'Directory not found: {scores_dir}'))
+            return
+
+        self.stdout.write(f'CPU count: {os.cpu_count()}, parallel workers: {workers}')
+        for scale in options['scales']:
+            target_dir = tempfile.mkdtemp(prefix=f'scores_x{scale}_')
+            try:
+                write_synthetic_scores(scores_dir, target_dir, scale)
+                jobs = [
+                    (os.path.join(target_dir, filename), False)
+                    for filename in sorted(os.listdir(target_dir))
+                ]
+
+                # Cách cũ: csv.reader + normalize_score từng giá trị, từng file một
+                started = time.perf_counter()
+                row_count = 0
+                for file_path, is_reverse in jobs:
+                    rows = read_score_file(file_path)
+                    raw_scores = [raw for _, _, raw in rows]
+                    min_value, max_value = min(raw_scores), max(raw_scores)
+                    [normalize_score(raw, min_value, max_value, is_reverse) for raw in raw_scores]
+                    row_count += len(rows)
+                scalar_elapsed = time.perf_counter() - started
+
+                timings = {}
+                for label, worker_count in (('serial', 1), ('parallel', workers)):
+                    started = time.perf_counter()
+                    for _, parsed, error in parse_score_files(jobs, worker_count):
+                        if error is not None:
+                            raise error
+                    timings[label] = time.perf_counter() - started
+
+                self.stdout.write(self.style.SUCCESS(
+                    f'x{scale}: {len(jobs)} files, {row_count:,} rows | '
+                    f'scalar {scalar_elapsed:.2f}s | numpy serial {timings["serial"]:.2f}s | '
+                    f'numpy parallel ({workers} workers) {timings["parallel"]:.2f}s | '
+                    f'speedup {scalar_elapsed / timings["parallel"]:.2f}x'
+                ))
+            finally:
+                shutil.rmtree(target_dir, ignore_errors=True)
@@ -0,0 +1,91 @@
+import contextlib
+import io
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from chamu.models import Criteria, Prefecture, UserInfo
+
+ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cache': 'chamu.sessions.cache',
+    'signed_cookies': 'chamu.sessions.signed_cookies',
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ('Measures matching survey POST latency (a session write per request) with concurrent clients '
+            'for each session engine.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent clients (writers).')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per client.')
+        parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES),
+                            help='Session modes to compare.')
+
+    def handle(self, *args, **options):
+        criteria_ids = list(Criteria.objects.order_by('id').values_list('id', flat=True)[:5])
+        prefecture = Prefecture.objects.order_by('id').first()
+        if not criteria_ids or prefecture is None:
+            self.stderr.write(self.style.ERROR('Import criteria and locations first.'))
+            return
+
+        user_info = UserInfo.objects.create(name='benchmark_sessions')
+        try:
+            url = reverse('matching_survey', args=[user_info.id, prefecture.id])
+            form = {f'rank_{rank}': cid for rank, cid in enumerate(criteria_ids, start=1)}
+            for mode in options['engines']:
+                latencies, errors, elapsed = self.run_engine(
+                    ENGINES[mode], url, form, options['threads'], options['requests']
+                )
+                self.stdout.write(self.style.SUCCESS(
+                    f'{mode:>14}: {len(latencies)} requests in {elapsed:.2f}s '
+                    f'({len(latencies) / elapsed:.0f} req/s) | '
+                    f'p50 {statistics.median(latencies) * 1000:.1f} ms, '
+                    f'p95 {percentile(latencies, 0.95) * 1000:.1f} ms, '
+                    f'max {max(latencies) * 1000:.1f} ms | errors {errors}'
+                ))
+        finally:
+            user_info.delete()
+
+    def run_engine(self, engine, url, form, thread_count, request_count):
+        latencies = []
+        errors = [0]
+        lock = threading.Lock()
+
+        def client_loop():
+            client = Client(HTTP_HOST='localhost', raise_request_exception=False)
+            local = []
+            try:
+                for _ in range(request_count):
+                    started = time.perf_counter()
+                    response = client.post(url, form)
+                    local.append(time.perf_counter() - started)
+                    if response.status_code != 302:
+                        with lock:
+                            errors[0] += 1
+            finally:
+                close_old_connections()
+            with lock:
+                latencies.extend(local)
+
+        # View in ra stdout ở mỗi request; bỏ qua khi đo
+        with override_settings(SESSION_ENGINE=engine), contextlib.redirect_stdout(io.StringIO()):
+            threads = [threading.Thread(target=client_loop) for _ in range(thread_count)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        return latencies, errors[0], elapsed
@@ -0,0 +1,51 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chamu.score_store import publish_score_store
+from chamu.snapshot import ScoreSnapshot, load_score_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Writes the effective score tensor (country × municipality × criteria) to a memory-mappable snapshot.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', type=str, default=None,
+                            help='Snapshot directory (defaults to settings.SCORE_SNAPSHOT_PATH).')
+        parser.add_argument('--publish', action='store_true',
+                            help='Publish a new generation of the shared score store (SCORE_STORE_DIR) instead.')
+
+    def handle(self, *args, **options):
+        if options['publish']:
+            started = time.perf_counter()
+            generation = publish_score_store()
+            if generation is None:
+                self.stderr.write(self.style.ERROR('SCORE_STORE_DIR is not set.'))
+                return
+            self.stdout.write(self.style.SUCCESS(
+                f'Published score store generation {generation} in {time.perf_counter() - started:.2f}s.'
+            ))
+            return
+
+        output = options['output'] or getattr(settings, 'SCORE_SNAPSHOT_PATH', None)
+        if not output:
+            self.stderr.write(self.style.ERROR('No output path: pass --output or set SCORE_SNAPSHOT_PATH.'))
+            return
+
+        started = time.perf_counter()
+        snapshot = ScoreSnapshot.build()
+        built = time.perf_counter()
+        snapshot.save(output)
+        saved = time.perf_counter()
+
+        # Thử mở lại để báo thời gian khởi động của một worker
+        loaded = load_score_snapshot(output)
+        for country_id in loaded.country_ids.tolist():
+            loaded.matrix(country_id)
+        load_elapsed = time.perf_counter() - saved
+
+        countries, municipalities, criteria = snapshot.scores.shape
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {countries} × {municipalities} × {criteria} scores ({snapshot.scores.nbytes / 1e6:.1f} MB) '
+            f'to {output}: build {built - started:.2f}s, save {saved - built:.2f}s, '
+            f'mmap load {load_elapsed * 1000:.1f} ms.'
+        ))
@@ -1,6 +1,7 @@
-import csv
+import time
 from django.core.management.base import BaseCommand
 from chamu.models import Country # Đảm bảo tên model khớp
+from chamu.reference_data import bulk_load, read_reference_csv
 
 
 class Command(BaseCommand):
@@ -8,33 +9,27 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str, help='The path to the CSV file to import.')
+        parser.add_argument('--verify', action='store_true', help='Report added/changed/unchanged rows without writing.')
 
     def handle(self, *args, **options):
         csv_file_path = options['csv_file']
+        verify = options['verify']
 
         self.stdout.write("Bắt đầu nhập dữ liệu...")
+        started = time.perf_counter()
 
         try:
-            with open(csv_file_path, 'r', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                # Bỏ qua dòng tiêu đề
-                next(reader)
+            # Các cột: Number, Country
+            rows = read_reference_csv(
+                csv_file_path, 2, warn=lambda msg: self.stderr.write(self.style.ERROR(msg))
+            )
+            countries = bulk_load(Country, 'name', {row[1]: {} for row in rows}, verify=verify)
+            self.stdout.write(f'{"[verify] " if verify else ""}{countries}')
 
-                for row in reader:
-                    # Kiểm tra độ dài của hàng
-                    if len(row) < 2:
-                        self.stderr.write(self.style.ERROR(f'Hàng bị thiếu dữ liệu: {row}'))
-                        continue
-
-                    # Bỏ qua cột đầu tiên (Number)
-                    _, country_name = row
-
-                    # Bước 1: Tìm hoặc tạo đối tượng Country
-                    country, _ = Country.objects.get_or_create(name=country_name)
-
-            self.stdout.write(self.style.SUCCESS("Nhập dữ liệu thành công!"))
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(f"Nhập dữ liệu thành công! ({len(rows)} hàng trong {elapsed:.2f}s)"))
 
         except FileNotFoundError:
             self.stderr.write(self.style.ERROR(f'Không tìm thấy file: {csv_file_path}'))
         except Exception as e:
-            self.stderr.write(self.style.ERROR(f'Có lỗi xảy ra: {e}'))
\ No newline at end of file
+            self.stderr.write(self.style.ERROR(f'Có lỗi xảy ra: {e}'))
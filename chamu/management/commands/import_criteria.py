@@ -1,56 +1,68 @@
-import csv
+import time
 from django.core.management.base import BaseCommand
+from django.utils.text import slugify
 from chamu.models import Criteria # Đảm bảo tên model khớp
+from chamu.matching import invalidate_score_matrix
+from chamu.reference_data import bulk_load, read_reference_csv
+
+
+def criteria_slug(name, used_slugs):
+    """Unique slug for a new criteria (slug is unique, so it cannot stay empty)."""
+    base = slugify(name, allow_unicode=True) or 'criteria'
+    slug, suffix = base, 2
+    while slug in used_slugs:
+        slug, suffix = f'{base}-{suffix}', suffix + 1
+    used_slugs.add(slug)
+    return slug
+
 
 class Command(BaseCommand):
-    help = 'Imports country data from a CSV file.'
+    help = 'Imports criteria data from a CSV file.'
 
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str, help='The path to the CSV file to import.')
+        parser.add_argument('--verify', action='store_true', help='Report added/changed/unchanged rows without writing.')
 
     def handle(self, *args, **options):
         csv_file_path = options['csv_file']
+        verify = options['verify']
 
         self.stdout.write("Bắt đầu nhập dữ liệu...")
+        started = time.perf_counter()
 
         try:
-            with open(csv_file_path, 'r', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                # Bỏ qua dòng tiêu đề
-                next(reader)
-
-                for row in reader:
-                    # Ensure the row has at least 3 columns to avoid an error
-                    if len(row) >= 3:
-                        criteria_name, left_label, right_label = row[:3]
-
-                        # Check if the row has a fourth column for 'is_reverse'
-                        if len(row) >= 4:
-                            is_reverse_str = row[3]
-                            is_reverse_bool = (is_reverse_str.lower() == 'true')
-                        else:
-                            # If the fourth column is missing, default to False
-                            is_reverse_bool = False
-
-                        # Get the existing criteria or create a new one
-                        criteria, created = Criteria.objects.update_or_create(
-                            name=criteria_name,
-                            defaults={
-                                'left_label': left_label,
-                                'right_label': right_label,
-                                'is_reverse': is_reverse_bool  # Use the value from the CSV or the default
-                            }
-                        )
-
-                        # If the object already existed and the is_reverse value from the CSV is different, update it.
-                        # This handles cases where you update the value for an existing criteria.
-                        if not created and criteria.is_reverse != is_reverse_bool:
-                            criteria.is_reverse = is_reverse_bool
-                            criteria.save()
-
-            self.stdout.write(self.style.SUCCESS("Nhập dữ liệu thành công!"))
+            # Các cột: name, left_label, right_label, is_reverse (tùy chọn, mặc định False)
+            rows = read_reference_csv(csv_file_path, 3)
+
+            used_slugs = set(Criteria.objects.values_list('slug', flat=True))
+            records = {}
+            for row in rows:
+                criteria_name, left_label, right_label = row[:3]
+                records[criteria_name] = {
+                    'left_label': left_label,
+                    'right_label': right_label,
+                    'is_reverse': len(row) >= 4 and row[3].lower() == 'true',
+                }
+            existing_names = set(Criteria.objects.filter(name__in=records).values_list('name', flat=True))
+            for criteria_name, values in records.items():
+                # Slug chỉ được đặt khi tạo mới, không thay đổi slug đã có
+                if criteria_name not in existing_names:
+                    values['slug'] = criteria_slug(criteria_name, used_slugs)
+
+            criteria = bulk_load(
+                Criteria, 'name', records,
+                update_fields=['left_label', 'right_label', 'is_reverse'],
+                verify=verify,
+            )
+            self.stdout.write(f'{"[verify] " if verify else ""}{criteria}')
+
+            if not verify and criteria.has_changes:
+                invalidate_score_matrix()
+
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(f"Nhập dữ liệu thành công! ({len(rows)} hàng trong {elapsed:.2f}s)"))
 
         except FileNotFoundError:
             self.stderr.write(self.style.ERROR(f'Không tìm thấy file: {csv_file_path}'))
         except Exception as e:
-            self.stderr.write(self.style.ERROR(f'Có lỗi xảy ra: {e}'))
\ No newline at end of file
+            self.stderr.write(self.style.ERROR(f'Có lỗi xảy ra: {e}'))
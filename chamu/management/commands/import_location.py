@@ -1,6 +1,11 @@
-import csv
+import time
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from chamu.models import Prefecture, Municipality  # Đảm bảo tên model khớp
+from chamu.matching import invalidate_score_matrix
+from chamu.reference_data import bulk_load, read_reference_csv
+from chamu.spatial import COORDINATES_VERSION
+from chamu.versions import bump_version
 
 
 class Command(BaseCommand):
@@ -8,40 +13,52 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str, help='The path to the CSV file to import.')
+        parser.add_argument('--verify', action='store_true', help='Report added/changed/unchanged rows without writing.')
 
     def handle(self, *args, **options):
         csv_file_path = options['csv_file']
+        verify = options['verify']
 
         self.stdout.write("Bắt đầu nhập dữ liệu...")
+        started = time.perf_counter()
 
         try:
-            with open(csv_file_path, 'r', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                # Bỏ qua dòng tiêu đề
-                next(reader)
+            # Các cột: Number, Prefecture, Municipality
+            rows = read_reference_csv(
+                csv_file_path, 3, warn=lambda msg: self.stderr.write(self.style.ERROR(msg))
+            )
 
-                for row in reader:
-                    # Kiểm tra độ dài của hàng
-                    if len(row) < 3:
-                        self.stderr.write(self.style.ERROR(f'Hàng bị thiếu dữ liệu: {row}'))
-                        continue
+            with transaction.atomic():
+                # Bước 1: Tạo các Prefecture còn thiếu
+                prefectures = bulk_load(
+                    Prefecture, 'name', {row[1]: {} for row in rows}, verify=verify
+                )
 
-                    # Bỏ qua cột đầu tiên (Number)
-                    _, prefecture_name, municipality_name = row
+                # Bước 2: Tạo hoặc cập nhật các Municipality (hàng sau ghi đè hàng trước khi trùng tên)
+                prefecture_ids = dict(Prefecture.objects.values_list('name', 'id'))
+                municipalities = bulk_load(
+                    Municipality, 'name',
+                    {
+                        municipality_name: {'prefecture_id': prefecture_ids.get(prefecture_name)}
+                        for _, prefecture_name, municipality_name, *_ in rows
+                    },
+                    update_fields=['prefecture_id'],
+                    verify=verify,
+                )
 
-                    # Bước 1: Tìm hoặc tạo đối tượng Prefecture
-                    prefecture, _ = Prefecture.objects.get_or_create(name=prefecture_name)
+            for result in (prefectures, municipalities):
+                self.stdout.write(f'{"[verify] " if verify else ""}{result}')
 
-                    # Bước 2: Tạo hoặc cập nhật đối tượng Municipality,
-                    # và liên kết nó với Prefecture vừa tìm được.
-                    Municipality.objects.update_or_create(
-                        name=municipality_name,
-                        defaults={'prefecture': prefecture}
-                    )
+            if not verify and (prefectures.has_changes or municipalities.has_changes):
+                # bulk_create/bulk_update không gửi signal post_save
+                bump_version(COORDINATES_VERSION)
+                invalidate_score_matrix()
+                Prefecture.refresh_centroids()
 
-            self.stdout.write(self.style.SUCCESS("Nhập dữ liệu thành công!"))
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(f"Nhập dữ liệu thành công! ({len(rows)} hàng trong {elapsed:.2f}s)"))
 
         except FileNotFoundError:
             self.stderr.write(self.style.ERROR(f'Không tìm thấy file: {csv_file_path}'))
         except Exception as e:
-            self.stderr.write(self.style.ERROR(f'Có lỗi xảy ra: {e}'))
\ No newline at end of file
+            self.stderr.write(self.style.ERROR(f'Có lỗi xảy ra: {e}'))
@@ -1,8 +1,21 @@
 import os
 import csv
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from chamu.models import Municipality, Country, Criteria, MunicipalityScore
+from django.db.models import F
+from chamu.models import (
+    Prefecture, Municipality, Country, Criteria, MunicipalityBaseScore, MunicipalityScore, ScoreImportLedger
+)
+from chamu.matching import effective_base_expression, invalidate_score_matrix
+from chamu.normalization import MINMAX, normalize
+
+DEFAULT_BATCH_SIZE = 5000
 
 
 def normalize_score(raw_value, min_value, max_value, is_reverse=False):
@@ -17,14 +30,296 @@ def normalize_score(raw_value, min_value, max_value, is_reverse=False):
     return max(1.0, min(5.0, round(score, 2)))
 
 
+def read_score_file(file_path, warn=None):
+    """
+    Read one criteria file: columns (number, prefecture, municipality, raw score, ...).
+    Returns a list of (prefecture_name, municipality_name, raw_score).
+    Rows whose score is not a number (header rows) are skipped.
+    """
+    rows, _, _ = read_wide_score_file(file_path, warn=warn)
+    return rows
+
+
+def read_wide_score_file(file_path, country_names=(), warn=None):
+    """
+    Read a criteria file in one pass, including its per-country columns.
+
+    Columns after the raw score (index 4 and up) whose header is a name in
+    country_names are country columns. Returns (rows, countries, block):
+    rows as read_score_file returns them, the country name of each country
+    column, and a float array of shape (len(rows), len(countries)) with NaN
+    where a cell is empty or not a number.
+    """
+    country_names = set(country_names)
+    rows = []
+    countries = []
+    columns = []
+    values = []
+    with open(file_path, 'r', encoding='utf-8-sig') as file:
+        for line_number, row in enumerate(csv.reader(file), start=1):
+            if line_number == 1 and country_names:
+                # Dòng tiêu đề: tìm các cột mang tên quốc gia
+                for index, header in enumerate(row[4:], start=4):
+                    if header.strip() in country_names and header.strip() not in countries:
+                        countries.append(header.strip())
+                        columns.append(index)
+            if len(row) < 4:
+                if warn:
+                    warn(f'  Dòng bị bỏ qua do không đủ 4 cột: {row}')
+                continue
+            _, prefecture_name, municipality_name, raw_score_str = [val.strip() for val in row[:4]]
+            try:
+                raw_score = float(raw_score_str)
+            except ValueError:
+                if line_number > 1 and warn:
+                    warn(f'  Dòng bị bỏ qua do điểm không hợp lệ: {row}')
+                continue
+            rows.append((prefecture_name, municipality_name, raw_score))
+            if columns:
+                values.append([parse_cell(row[index]) if index < len(row) else np.nan for index in columns])
+    block = np.array(values, dtype=np.float64).reshape(len(rows) if columns else 0, len(columns))
+    return rows, countries, block
+
+
+def parse_cell(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def file_content_hash(file_path, chunk_size=1 << 16):
+    """SHA-256 of the file bytes, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_array(raw_scores, is_reverse=False, strategy=MINMAX):
+    """Vectorized normalization of a whole criteria column (see chamu.normalization)."""
+    return normalize(raw_scores, strategy, is_reverse)
+
+
+class ParsedScoreFile:
+    """
+    Result of parsing one criteria file in a worker: names as lists,
+    raw and normalized scores as float arrays (cheap to send between processes).
+    Wide files also carry country_scores: one normalized column per name in
+    countries, NaN where the file has no value.
+    """
+
+    def __init__(self, file_path, prefecture_names, municipality_names, raw_scores, normalized_scores, warnings,
+                 countries=(), country_scores=None):
+        self.file_path = file_path
+        self.prefecture_names = prefecture_names
+        self.municipality_names = municipality_names
+        self.raw_scores = raw_scores
+        self.normalized_scores = normalized_scores
+        self.warnings = warnings
+        self.countries = list(countries)
+        self.country_scores = country_scores if country_scores is not None else np.empty((len(raw_scores), 0))
+
+    def __len__(self):
+        return len(self.municipality_names)
+
+    @property
+    def rows(self):
+        """(prefecture_name, municipality_name, raw_score) tuples, as read_score_file returns."""
+        return list(zip(self.prefecture_names, self.municipality_names, self.raw_scores.tolist()))
+
+    def score_range(self):
+        if not len(self):
+            return None, None
+        return float(self.raw_scores.min()), float(self.raw_scores.max())
+
+
+def normalize_columns(block, is_reverse=False, strategy=MINMAX):
+    """Normalize each column of a (rows × countries) block on its own values, keeping NaN cells."""
+    normalized = np.full(block.shape, np.nan)
+    for col in range(block.shape[1]):
+        present = ~np.isnan(block[:, col])
+        normalized[present, col] = normalize_array(block[present, col], is_reverse, strategy)
+    return normalized
+
+
+def parse_score_file(file_path, is_reverse, strategy=MINMAX, country_names=()):
+    """Read and normalize one criteria file. Runs in a pool process: no database access here."""
+    warnings = []
+    rows, countries, block = read_wide_score_file(file_path, country_names, warn=warnings.append)
+
+    # Bỏ các cột quốc gia không có giá trị số nào
+    empty = np.isnan(block).all(axis=0) if len(rows) else np.ones(len(countries), dtype=bool)
+    for country_name in np.asarray(countries)[empty].tolist():
+        warnings.append(f'  Cột quốc gia "{country_name}" không có điểm hợp lệ, bỏ qua.')
+    countries = [name for name, is_empty in zip(countries, empty.tolist()) if not is_empty]
+    block = block[:, ~empty]
+
+    raw_scores = np.fromiter((raw for _, _, raw in rows), dtype=np.float64, count=len(rows))
+    return ParsedScoreFile(
+        file_path,
+        [prefecture_name for prefecture_name, _, _ in rows],
+        [municipality_name for _, municipality_name, _ in rows],
+        raw_scores,
+        normalize_array(raw_scores, is_reverse, strategy),
+        warnings,
+        countries,
+        normalize_columns(block, is_reverse, strategy),
+    )
+
+
+def parse_score_files(jobs, workers=1):
+    """
+    Parse (file_path, is_reverse[, strategy[, country_names]]) jobs, one file per worker process.
+    Yields (job, parsed, error) in job order, so a single writer can apply them as they finish.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            try:
+                yield job, parse_score_file(*job), None
+            except Exception as e:
+                yield job, None, e
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+        futures = [executor.submit(parse_score_file, *job) for job in jobs]
+        for job, future in zip(jobs, futures):
+            try:
+                yield job, future.result(), None
+            except Exception as e:
+                yield job, None, e
+
+
+def resolve_municipalities(rows):
+    """
+    Map municipality name -> id, creating missing prefectures and municipalities in bulk.
+    """
+    names = {municipality_name: prefecture_name for prefecture_name, municipality_name, _ in rows}
+    municipality_ids = dict(Municipality.objects.filter(name__in=names).values_list('name', 'id'))
+
+    missing = {name: prefecture for name, prefecture in names.items() if name not in municipality_ids}
+    if missing:
+        with transaction.atomic():
+            Prefecture.objects.bulk_create(
+                [Prefecture(name=name) for name in set(missing.values())], ignore_conflicts=True
+            )
+            prefecture_ids = dict(Prefecture.objects.filter(name__in=set(missing.values())).values_list('name', 'id'))
+            Municipality.objects.bulk_create(
+                [Municipality(name=name, prefecture_id=prefecture_ids[prefecture]) for name, prefecture in missing.items()],
+                ignore_conflicts=True
+            )
+        municipality_ids = dict(Municipality.objects.filter(name__in=names).values_list('name', 'id'))
+    return municipality_ids
+
+
+def iter_score_objects(rows, normalized_scores, municipality_ids, criteria_id, country_id=None):
+    """
+    Lazily yield one score object per municipality: a country-neutral
+    MunicipalityBaseScore, or a MunicipalityScore overlay when country_id is given.
+    Municipality names are unique in the database, so only the first row of a repeated name is used.
+    """
+    seen = set()
+    for (_, municipality_name, _), base_score in zip(rows, normalized_scores):
+        if municipality_name in seen:
+            continue
+        seen.add(municipality_name)
+        municipality_id = municipality_ids[municipality_name]
+        if country_id is None:
+            yield MunicipalityBaseScore(
+                municipality_id=municipality_id,
+                criteria_id=criteria_id,
+                base_score=base_score,
+            )
+        else:
+            yield MunicipalityScore(
+                municipality_id=municipality_id,
+                country_id=country_id,
+                criteria_id=criteria_id,
+                base_score=base_score,
+            )
+
+
+def iter_country_score_objects(parsed, municipality_ids, criteria_id, country_ids, block_size=DEFAULT_BATCH_SIZE):
+    """
+    Lazily yield one MunicipalityScore overlay per (municipality, country) cell of a wide file.
+    The country block is walked in row blocks, so only block_size rows of objects exist at a time.
+    """
+    column_country_ids = [country_ids[name] for name in parsed.countries]
+    seen = set()
+    for start in range(0, len(parsed), block_size):
+        block = parsed.country_scores[start:start + block_size]
+        for offset, municipality_name in enumerate(parsed.municipality_names[start:start + block_size]):
+            if municipality_name in seen:
+                continue
+            seen.add(municipality_name)
+            municipality_id = municipality_ids[municipality_name]
+            for country_id, base_score in zip(column_country_ids, block[offset].tolist()):
+                if base_score == base_score:  # NaN: ô trống, quốc gia dùng điểm trung lập
+                    yield MunicipalityScore(
+                        municipality_id=municipality_id,
+                        country_id=country_id,
+                        criteria_id=criteria_id,
+                        base_score=base_score,
+                    )
+
+
+def skip_unchanged(score_objects, existing_scores):
+    """Drop score objects whose base_score equals existing_scores[municipality_id]."""
+    for score_obj in score_objects:
+        if existing_scores.get(score_obj.municipality_id) != score_obj.base_score:
+            yield score_obj
+
+
+def write_score_batches(score_objects, batch_size=DEFAULT_BATCH_SIZE, overlay=False):
+    """
+    Upsert score rows batch by batch: new rows are inserted,
+    existing rows get the new base_score. Only one batch is held in memory.
+    """
+    if overlay:
+        model, unique_fields = MunicipalityScore, ['municipality', 'country', 'criteria']
+    else:
+        model, unique_fields = MunicipalityBaseScore, ['municipality', 'criteria']
+    written = 0
+    while True:
+        batch = list(islice(score_objects, batch_size))
+        if not batch:
+            return written
+        model.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=['base_score'],
+        )
+        written += len(batch)
+
+
+def refresh_final_scores(criteria_id, country_ids=None):
+    """
+    Re-blend final_score of the country overlays after a base score changed (avg_score is kept).
+    Overlays without their own base_score pick up the new neutral base.
+    """
+    scores = MunicipalityScore.objects.filter(criteria_id=criteria_id)
+    if country_ids is not None:
+        scores = scores.filter(country_id__in=country_ids)
+    scores.update(final_score=effective_base_expression() * 0.6 + F('avg_score') * 0.4)
+
+
 class Command(BaseCommand):
     help = 'Imports and normalizes base scores for municipalities from a directory of CSV files.'
 
     def add_arguments(self, parser):
         parser.add_argument('scores_dir', type=str, help='The path to the directory containing CSV files.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows per bulk upsert.')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-import every file and rewrite every row, ignoring the import ledger.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes used to parse and normalize files (1 = in this process).')
 
     def handle(self, *args, **options):
         scores_dir = options['scores_dir']
+        batch_size = options['batch_size']
+        force = options['force']
 
         if not os.path.isdir(scores_dir):
             self.stderr.write(self.style.ERROR(f'Không tìm thấy thư mục: {scores_dir}'))
@@ -32,96 +327,102 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.NOTICE(f'Bắt đầu nhập và chuẩn hóa điểm từ thư mục: {scores_dir}'))
 
-        criteria_is_reverse_map = {criteria.name: criteria.is_reverse for criteria in Criteria.objects.all()}
+        criteria_map = {c.name: c for c in Criteria.objects.all()}
+        ledgers = {ledger.file_name: ledger for ledger in ScoreImportLedger.objects.all()}
+        # Cột có tiêu đề là tên quốc gia được nhập thành điểm riêng của quốc gia đó
+        country_ids = dict(Country.objects.values_list('name', 'id'))
 
-        # Lấy tất cả các quốc gia đã tồn tại từ database
-        countries = list(Country.objects.all())
-        if not countries:
-            self.stderr.write(self.style.ERROR(
-                'Không tìm thấy quốc gia nào trong database. Vui lòng thêm quốc gia trước khi chạy lệnh này.'))
-            return
-
-        # --- BƯỚC 1: XỬ LÝ TOÀN BỘ DỮ LIỆU TỪ CÁC FILE CSV ---
-        all_data = []
-        unique_municipalities = set()
+        started = time.perf_counter()
+        total_written = 0
+        skipped_files = 0
 
-        for filename in os.listdir(scores_dir):
+        # --- BƯỚC 1: CHỌN CÁC FILE CẦN NHẬP ---
+        pending = {}
+        for filename in sorted(os.listdir(scores_dir)):
             if not filename.endswith('.csv'):
                 continue
 
             file_path = os.path.join(scores_dir, filename)
             criteria_name = os.path.splitext(filename)[0]
+            criteria = criteria_map.get(criteria_name)
+            if criteria is None:
+                self.stderr.write(self.style.ERROR(f'Không tìm thấy Tiêu chí "{criteria_name}" trong database. Bỏ qua file.'))
+                continue
 
-            self.stdout.write(self.style.SUCCESS(f'Đang xử lý file "{filename}" cho Tiêu chí "{criteria_name}"'))
-
-            try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    reader = csv.reader(file)
-                    next(reader)  # Bỏ qua tiêu đề
-                    for row in reader:
-                        if len(row) >= 4:
-                            _, _, municipality_name, raw_score_str = [val.strip() for val in row[:4]]
-
-                            unique_municipalities.add(municipality_name)
-
-                            all_data.append({
-                                'criteria_name': criteria_name,
-                                'municipality_name': municipality_name,
-                                'raw_score': float(raw_score_str)
-                            })
-                        else:
-                            self.stdout.write(self.style.WARNING(f'  Dòng bị bỏ qua do không đủ 4 cột: {row}'))
-            except Exception as e:
-                self.stderr.write(self.style.ERROR(f'  Có lỗi khi đọc file {filename}: {e}'))
+            # File không đổi (cùng hash, cùng tham số chuẩn hóa) thì bỏ qua hoàn toàn
+            content_hash = file_content_hash(file_path)
+            ledger = ledgers.get(filename)
+            if (not force and ledger is not None and ledger.content_hash == content_hash
+                    and ledger.criteria_id == criteria.id and ledger.is_reverse == criteria.is_reverse
+                    and ledger.normalization == criteria.normalization):
+                skipped_files += 1
+                self.stdout.write(f'Bỏ qua file "{filename}": không có thay đổi kể từ lần nhập trước.')
                 continue
+            pending[file_path] = (filename, criteria, content_hash)
 
-        # --- BƯỚC 2: TẠO VÀ LẤY TẤT CẢ OBJECT CẦN THIẾT TRONG BULK ---
-        with transaction.atomic():
-            # Tạo các Municipality chưa tồn tại
-            existing_municipalities = Municipality.objects.filter(name__in=unique_municipalities).values_list('name',
-                                                                                                              flat=True)
-            municipalities_to_create = [Municipality(name=name) for name in unique_municipalities if
-                                        name not in existing_municipalities]
-            if municipalities_to_create:
-                Municipality.objects.bulk_create(municipalities_to_create, ignore_conflicts=True)
-
-            municipality_map = {m.name: m for m in Municipality.objects.filter(name__in=unique_municipalities)}
-            criteria_map = {c.name: c for c in Criteria.objects.all()}
-
-        # --- BƯỚC 3: CHUẨN HÓA VÀ TẠO BẢN GHI CHO BULK UPDATE/CREATE ---
-        data_by_criteria = {}
-        for item in all_data:
-            criteria_name = item['criteria_name']
-            if criteria_name not in data_by_criteria:
-                data_by_criteria[criteria_name] = []
-            data_by_criteria[criteria_name].append(item)
-
-        all_score_objects = []
-        for criteria_name, items in data_by_criteria.items():
-            raw_scores = [item['raw_score'] for item in items]
-            if not raw_scores:
+        # --- BƯỚC 2: ĐỌC VÀ CHUẨN HÓA SONG SONG, GHI TUẦN TỰ TRONG PROCESS NÀY ---
+        jobs = [
+            (file_path, criteria.is_reverse, criteria.normalization, list(country_ids))
+            for file_path, (_, criteria, _) in pending.items()
+        ]
+        for (file_path, *_), parsed, error in parse_score_files(jobs, options['workers']):
+            filename, criteria, content_hash = pending[file_path]
+            self.stdout.write(self.style.SUCCESS(f'Đang xử lý file "{filename}" cho Tiêu chí "{criteria.name}"'))
+            if error is not None:
+                self.stderr.write(self.style.ERROR(f'  Có lỗi khi đọc file {filename}: {error}'))
                 continue
-            min_value = min(raw_scores)
-            max_value = max(raw_scores)
-            is_reverse = criteria_is_reverse_map.get(criteria_name, False)
-
-            for item in items:
-                normalized_score = normalize_score(item['raw_score'], min_value, max_value, is_reverse)
-
-                # Vòng lặp qua tất cả các quốc gia đã lấy từ database
-                for country in countries:
-                    all_score_objects.append(
-                        MunicipalityScore(
-                            municipality=municipality_map[item['municipality_name']],
-                            country=country,
-                            criteria=criteria_map[item['criteria_name']],
-                            base_score=normalized_score
-                        )
-                    )
+            for message in parsed.warnings:
+                self.stdout.write(self.style.WARNING(message))
+
+            file_started = time.perf_counter()
+            rows = parsed.rows
+            municipality_ids = resolve_municipalities(rows)
+            score_objects = iter_score_objects(
+                rows, parsed.normalized_scores.tolist(), municipality_ids, criteria.id
+            )
+            if not force:
+                # Chỉ ghi những dòng có điểm thay đổi
+                existing_scores = dict(MunicipalityBaseScore.objects.filter(
+                    criteria_id=criteria.id
+                ).values_list('municipality_id', 'base_score'))
+                score_objects = skip_unchanged(score_objects, existing_scores)
+            written = write_score_batches(score_objects, batch_size)
+            if written:
+                refresh_final_scores(criteria.id)
+
+            if parsed.countries:
+                country_written = write_score_batches(
+                    iter_country_score_objects(parsed, municipality_ids, criteria.id, country_ids, batch_size),
+                    batch_size,
+                    overlay=True,
+                )
+                refresh_final_scores(criteria.id, [country_ids[name] for name in parsed.countries])
+                self.stdout.write(f'  {country_written} điểm riêng cho {len(parsed.countries)} quốc gia')
+                written += country_written
+
+            min_value, max_value = parsed.score_range()
+            ScoreImportLedger.objects.update_or_create(file_name=filename, defaults={
+                'criteria': criteria,
+                'content_hash': content_hash,
+                'min_value': min_value,
+                'max_value': max_value,
+                'is_reverse': criteria.is_reverse,
+                'normalization': criteria.normalization,
+                'row_count': len(parsed),
+            })
 
-        if all_score_objects:
-            with transaction.atomic():
-                MunicipalityScore.objects.bulk_create(all_score_objects, ignore_conflicts=True)
-            self.stdout.write(self.style.SUCCESS(f'Đã tạo mới {len(all_score_objects)} bản ghi điểm số.'))
+            elapsed = time.perf_counter() - file_started
+            total_written += written
+            self.stdout.write(
+                f'  {written} bản ghi trong {elapsed:.2f}s ({written / elapsed if elapsed else written:,.0f} bản ghi/giây)'
+            )
 
-        self.stdout.write(self.style.SUCCESS('Hoàn thành việc nhập và chuẩn hóa điểm từ file.'))
\ No newline at end of file
+        if total_written:
+            invalidate_score_matrix()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Đã ghi {total_written} bản ghi điểm số trong {elapsed:.2f}s '
+            f'({total_written / elapsed if elapsed else total_written:,.0f} bản ghi/giây), '
+            f'bỏ qua {skipped_files} file không đổi.'
+        ))
+        self.stdout.write(self.style.SUCCESS('Hoàn thành việc nhập và chuẩn hóa điểm từ file.'))
@@ -1,9 +1,12 @@
 import os
-import csv
+import time
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from chamu.models import Municipality, Country, Criteria, MunicipalityScore
-from .import_scores import normalize_score
+from chamu.models import Country, Criteria, ScoreImportLedger
+from chamu.matching import invalidate_score_matrix
+from .import_scores import (
+    DEFAULT_BATCH_SIZE, parse_score_file, resolve_municipalities,
+    iter_score_objects, iter_country_score_objects, write_score_batches, refresh_final_scores,
+)
 
 
 class Command(BaseCommand):
@@ -14,9 +17,10 @@ class Command(BaseCommand):
         parser.add_argument(
             '--country',
             type=str,
-            help='(Tùy chọn) Tên quốc gia để chỉ định điểm số. Nếu không có, điểm sẽ được áp dụng cho tất cả các quốc gia.',
+            help='(Tùy chọn) Tên quốc gia để chỉ định điểm số. Nếu không có, điểm trung lập sẽ được dùng chung cho tất cả các quốc gia.',
             default=None
         )
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Số bản ghi mỗi lần ghi (upsert).')
 
     def handle(self, *args, **options):
         file_path = options['file_path']
@@ -37,88 +41,60 @@ class Command(BaseCommand):
             self.stderr.write(self.style.ERROR(f'Không tìm thấy Tiêu chí "{criteria_name}" trong database.'))
             return
 
-        # Lấy các đối tượng Country
+        # Có --country: ghi overlay riêng của quốc gia; không có: ghi điểm trung lập dùng chung
+        country = None
         if country_name:
             try:
-                countries = [Country.objects.get(name=country_name)]
+                country = Country.objects.get(name=country_name)
             except Country.DoesNotExist:
                 self.stderr.write(self.style.ERROR(f'Không tìm thấy quốc gia "{country_name}".'))
                 return
-        else:
-            countries = list(Country.objects.all())
-            if not countries:
-                self.stderr.write(self.style.ERROR(
-                    'Không tìm thấy quốc gia nào trong database. Vui lòng thêm quốc gia trước khi chạy lệnh này.'))
-                return
-
-        # --- BƯỚC 1: ĐỌC DỮ LIỆU TỪ FILE VÀ TÍNH MIN/MAX ĐỂ CHUẨN HÓA ---
-        all_data = []
-        unique_municipalities = set()
-        raw_scores = []
 
+        # --- BƯỚC 1: ĐỌC DỮ LIỆU TỪ FILE VÀ CHUẨN HÓA ---
+        # Không có --country: các cột mang tên quốc gia (file dạng rộng) cũng được nhập
+        country_ids = {} if country else dict(Country.objects.values_list('name', 'id'))
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                next(reader)  # Bỏ qua tiêu đề
-                for row in reader:
-                    if len(row) >= 4:
-                        _, _, municipality_name, raw_score_str = [val.strip() for val in row[:4]]
-
-                        raw_score = float(raw_score_str)
-                        unique_municipalities.add(municipality_name)
-                        raw_scores.append(raw_score)
-
-                        all_data.append({
-                            'municipality_name': municipality_name,
-                            'raw_score': raw_score
-                        })
-                    else:
-                        self.stdout.write(self.style.WARNING(f'  Dòng bị bỏ qua do không đủ 4 cột: {row}'))
+            parsed = parse_score_file(
+                file_path, criteria_obj.is_reverse, criteria_obj.normalization, list(country_ids)
+            )
         except Exception as e:
             self.stderr.write(self.style.ERROR(f'  Có lỗi khi đọc file {file_path}: {e}'))
             return
+        for message in parsed.warnings:
+            self.stdout.write(self.style.WARNING(message))
 
-        if not all_data:
+        if not len(parsed):
             self.stderr.write(self.style.ERROR(f'File "{file_path}" không có dữ liệu để nhập.'))
             return
 
-        min_value = min(raw_scores)
-        max_value = max(raw_scores)
-        is_reverse = criteria_obj.is_reverse
-
-        # --- BƯỚC 2: TẠO VÀ LẤY TẤT CẢ OBJECT CẦN THIẾT TRONG BULK ---
-        with transaction.atomic():
-            # Tạo các Municipality chưa tồn tại
-            existing_municipalities = Municipality.objects.filter(name__in=unique_municipalities).values_list('name',
-                                                                                                              flat=True)
-            municipalities_to_create = [Municipality(name=name) for name in unique_municipalities if
-                                        name not in existing_municipalities]
-            if municipalities_to_create:
-                Municipality.objects.bulk_create(municipalities_to_create, ignore_conflicts=True)
+        started = time.perf_counter()
+        rows = parsed.rows
 
-            municipality_map = {m.name: m for m in Municipality.objects.filter(name__in=unique_municipalities)}
-
-        # --- BƯỚC 3: CHUẨN HÓA VÀ TẠO BẢN GHI CHO BULK CREATE ---
-        all_score_objects = []
-        for item in all_data:
-            normalized_score = normalize_score(item['raw_score'], min_value, max_value, is_reverse)
-
-            # Vòng lặp qua danh sách quốc gia đã được lọc
-            for country in countries:
-                all_score_objects.append(
-                    MunicipalityScore(
-                        municipality=municipality_map[item['municipality_name']],
-                        country=country,
-                        criteria=criteria_obj,
-                        base_score=normalized_score
-                    )
-                )
-
-        if all_score_objects:
-            with transaction.atomic():
-                # Sử dụng bulk_create để tạo các bản ghi mới
-                MunicipalityScore.objects.bulk_create(all_score_objects, ignore_conflicts=True)
-            self.stdout.write(self.style.SUCCESS(
-                f'Đã tạo mới {len(all_score_objects)} bản ghi điểm số cho tiêu chí "{criteria_name}".'))
+        # --- BƯỚC 2: LẤY (HOẶC TẠO) CÁC MUNICIPALITY ---
+        municipality_ids = resolve_municipalities(rows)
 
+        # --- BƯỚC 3: GHI THEO LÔ (UPSERT) ---
+        country_id = country.id if country else None
+        written = write_score_batches(
+            iter_score_objects(rows, parsed.normalized_scores.tolist(), municipality_ids, criteria_obj.id, country_id),
+            options['batch_size'],
+            overlay=country is not None,
+        )
+        if parsed.countries:
+            written += write_score_batches(
+                iter_country_score_objects(parsed, municipality_ids, criteria_obj.id, country_ids, options['batch_size']),
+                options['batch_size'],
+                overlay=True,
+            )
+        refresh_final_scores(criteria_obj.id, [country_id] if country else None)
+        if country is None:
+            # Điểm trung lập đã thay đổi ngoài import_scores: lần import_scores sau phải nhập lại tiêu chí này
+            ScoreImportLedger.objects.filter(criteria=criteria_obj).delete()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Đã ghi {written} bản ghi điểm số cho tiêu chí "{criteria_name}" trong {elapsed:.2f}s '
+            f'({written / elapsed if elapsed else written:,.0f} bản ghi/giây).'))
+
+        invalidate_score_matrix()
         self.stdout.write(self.style.SUCCESS('Hoàn thành việc nhập và chuẩn hóa điểm từ file.'))
\ No newline at end of file
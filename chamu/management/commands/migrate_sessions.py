@@ -0,0 +1,59 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+DELETE_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Copies unexpired database sessions into the configured cache session store (SESSION_MODE=cache).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true',
+                            help='Delete the copied rows from the database session table.')
+
+    def handle(self, *args, **options):
+        engine = settings.SESSION_ENGINE
+        if engine == 'django.contrib.sessions.backends.db':
+            self.stderr.write(self.style.ERROR('SESSION_ENGINE is still the database engine, nothing to migrate.'))
+            return
+        if engine.endswith('signed_cookies'):
+            # Dữ liệu nằm trong cookie của trình duyệt: chỉ có thể chuyển khi gặp lại (SESSION_LEGACY_DB_FALLBACK)
+            self.stderr.write(self.style.ERROR(
+                'Signed cookie sessions cannot be written server-side; '
+                'live sessions are adopted on their next request (SESSION_LEGACY_DB_FALLBACK).'
+            ))
+            return
+
+        store_class = import_module(engine).SessionStore
+        copied = skipped = 0
+        copied_keys = []
+        sessions = Session.objects.filter(expire_date__gt=timezone.now())
+        for session in sessions.iterator():
+            data = session.get_decoded()
+            if not data:
+                continue
+            store = store_class(session.session_key)
+            # Gán trực tiếp để save() không đọc lại (tránh fallback về database)
+            store._session_cache = data
+            try:
+                store.save(must_create=True)
+                copied += 1
+            except CreateError:
+                skipped += 1  # đã có trong cache (được chuyển khi gặp lại), bản trong cache mới hơn
+            copied_keys.append(session.session_key)
+
+        deleted = 0
+        if options['delete']:
+            for start in range(0, len(copied_keys), DELETE_BATCH_SIZE):
+                batch = copied_keys[start:start + DELETE_BATCH_SIZE]
+                deleted += Session.objects.filter(session_key__in=batch).delete()[0]
+
+        message = f'Copied {copied} sessions to {engine} ({skipped} already there)'
+        if options['delete']:
+            message += f', deleted {deleted} database rows'
+        self.stdout.write(self.style.SUCCESS(message + '.'))
@@ -0,0 +1,104 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from chamu.models import Country, Prefecture, EvaluationSurvey, MunicipalityBaseScore, MunicipalityScore
+from chamu.matching import DEFAULT_SCORE, blend_scores, invalidate_score_matrix
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds eval_count, eval_sum, avg_score and final_score for MunicipalityScore from EvaluationSurvey.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--country', type=str, default=None, help='(Optional) Only recompute scores for this country name.')
+        parser.add_argument('--prefecture', type=str, default=None, help='(Optional) Only recompute scores for this prefecture name.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per bulk_update batch.')
+        parser.add_argument('--dry-run', action='store_true', help='Compute and report changes without writing them.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        scores = MunicipalityScore.objects.all()
+        evaluations = EvaluationSurvey.objects.all()
+
+        if options['country']:
+            try:
+                country = Country.objects.get(name=options['country'])
+            except Country.DoesNotExist:
+                self.stderr.write(self.style.ERROR(f'Country "{options["country"]}" not found.'))
+                return
+            scores = scores.filter(country=country)
+            evaluations = evaluations.filter(country=country)
+
+        if options['prefecture']:
+            try:
+                prefecture = Prefecture.objects.get(name=options['prefecture'])
+            except Prefecture.DoesNotExist:
+                self.stderr.write(self.style.ERROR(f'Prefecture "{options["prefecture"]}" not found.'))
+                return
+            scores = scores.filter(municipality__prefecture=prefecture)
+            evaluations = evaluations.filter(municipality__prefecture=prefecture)
+
+        started = time.perf_counter()
+
+        # --- BƯỚC 1: MỘT TRUY VẤN GROUP BY CHO TOÀN BỘ ĐÁNH GIÁ ---
+        totals = {
+            (row['municipality_id'], row['criteria_id'], row['country_id']): (row['eval_count'], row['eval_sum'])
+            for row in evaluations.values('municipality_id', 'criteria_id', 'country_id').annotate(
+                eval_count=Count('id'), eval_sum=Sum('score')
+            )
+        }
+
+        # Điểm trung lập cho các overlay không có base_score riêng
+        neutral = {
+            (municipality_id, criteria_id): base_score
+            for municipality_id, criteria_id, base_score in MunicipalityBaseScore.objects.values_list(
+                'municipality_id', 'criteria_id', 'base_score'
+            )
+        }
+
+        # --- BƯỚC 2: TÍNH LẠI VÀ GHI THEO TỪNG LÔ ---
+        fields = ['eval_count', 'eval_sum', 'avg_score', 'final_score']
+        processed = 0
+        changed = 0
+        batch = []
+
+        with transaction.atomic():
+            for score_obj in scores.only(
+                'id', 'municipality_id', 'criteria_id', 'country_id', 'base_score', *fields
+            ).iterator(chunk_size=batch_size):
+                processed += 1
+                eval_count, eval_sum = totals.get(
+                    (score_obj.municipality_id, score_obj.criteria_id, score_obj.country_id), (0, 0.0)
+                )
+                base_score = score_obj.base_score
+                if base_score is None:
+                    base_score = neutral.get((score_obj.municipality_id, score_obj.criteria_id), DEFAULT_SCORE)
+                avg_score, final_score = blend_scores(base_score, eval_count, eval_sum)
+                new_values = (eval_count, eval_sum, avg_score, final_score)
+                if new_values == tuple(getattr(score_obj, field) for field in fields):
+                    continue
+
+                changed += 1
+                score_obj.eval_count, score_obj.eval_sum, score_obj.avg_score, score_obj.final_score = new_values
+                batch.append(score_obj)
+                if len(batch) >= batch_size:
+                    if not dry_run:
+                        MunicipalityScore.objects.bulk_update(batch, fields)
+                    batch = []
+
+            if batch and not dry_run:
+                MunicipalityScore.objects.bulk_update(batch, fields)
+
+        elapsed = time.perf_counter() - started
+        rate = processed / elapsed if elapsed > 0 else processed
+
+        if not dry_run and changed:
+            invalidate_score_matrix()
+
+        prefix = '[dry-run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Processed {processed} rows ({changed} changed) from {len(totals)} evaluation groups '
+            f'in {elapsed:.2f}s ({rate:,.0f} rows/sec).'
+        ))
@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from chamu.models import Municipality
+from chamu.models import Municipality, Prefecture
 from geopy.geocoders import Nominatim
 import time
 
@@ -38,4 +38,6 @@ class Command(BaseCommand):
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f"Error processing {muni.name}: {e}"))
 
+        # Cập nhật tâm và khung bao của các prefecture
+        Prefecture.refresh_centroids()
         self.stdout.write(self.style.SUCCESS("Coordinate update complete."))
\ No newline at end of file
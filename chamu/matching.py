@@ -0,0 +1,458 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Criteria, Municipality, MunicipalityBaseScore, MunicipalityScore
+from .versions import bump_version, get_versions
+
+# Điểm mặc định khi không có dữ liệu cho (municipality, criteria)
+DEFAULT_SCORE = 3.0
+
+# Bộ đếm phiên bản của toàn bộ dữ liệu điểm (xem chamu/versions.py): tăng khi import
+# hoặc khi xuất bản thế hệ mới của score store. Ghi điểm của một quốc gia chỉ tăng
+# bộ đếm của quốc gia đó (country_scores_version).
+SCORES_VERSION = 'scores'
+
+
+def country_scores_version(country_id):
+    """Name of the scores counter of one country (bumped by invalidate_score_matrix(country_id))."""
+    return f'{SCORES_VERSION}:{country_id}'
+
+
+def score_versions(country_id):
+    """(SCORES_VERSION, country counter) values: the score data of one country's results."""
+    names = [SCORES_VERSION, country_scores_version(country_id)]
+    versions = get_versions(names)
+    return versions[names[0]], versions[names[1]]
+
+
+def blend_scores(base_score, eval_count, eval_sum):
+    """
+    Blend a base score with the crowd average (Python version of views.score_expressions).
+    Returns (avg_score, final_score).
+    """
+    avg_score = eval_sum / eval_count if eval_count > 0 else DEFAULT_SCORE
+    return avg_score, base_score * 0.6 + avg_score * 0.4
+
+
+def effective_base_expression():
+    """
+    SQL expression for the base score of a MunicipalityScore overlay:
+    its own base_score, else the neutral MunicipalityBaseScore, else DEFAULT_SCORE.
+    """
+    neutral_base = MunicipalityBaseScore.objects.filter(
+        municipality_id=OuterRef('municipality_id'),
+        criteria_id=OuterRef('criteria_id'),
+    ).values('base_score')[:1]
+    return Coalesce(F('base_score'), Subquery(neutral_base), Value(DEFAULT_SCORE))
+
+
+def effective_score(overlay, neutral_base):
+    """
+    Score of one (municipality, criteria) as seen by one country.
+    overlay is (final_score, base_score) of the country's MunicipalityScore row, or None;
+    neutral_base is the MunicipalityBaseScore value, or None.
+    """
+    if overlay is not None:
+        final_score, base_score = overlay
+        if base_score is None:
+            base_score = neutral_base
+        return final_score or (base_score if base_score is not None else DEFAULT_SCORE)
+    if neutral_base is not None:
+        # Không có overlay: điểm trung lập với điểm trung bình mặc định
+        return blend_scores(neutral_base, 0, 0)[1]
+    return DEFAULT_SCORE
+
+
+def get_effective_scores(municipality_id, country_id):
+    """{criteria_id: effective score} for one municipality and one country (two queries)."""
+    neutral = dict(MunicipalityBaseScore.objects.filter(
+        municipality_id=municipality_id
+    ).values_list('criteria_id', 'base_score'))
+    overlays = {
+        criteria_id: (final_score, base_score)
+        for criteria_id, final_score, base_score in MunicipalityScore.objects.filter(
+            municipality_id=municipality_id, country_id=country_id
+        ).values_list('criteria_id', 'final_score', 'base_score')
+    }
+    return merge_effective_scores(neutral, overlays)
+
+
+async def aget_effective_scores(municipality_id, country_id):
+    """get_effective_scores through the async ORM."""
+    neutral = {
+        criteria_id: base_score
+        async for criteria_id, base_score in MunicipalityBaseScore.objects.filter(
+            municipality_id=municipality_id
+        ).values_list('criteria_id', 'base_score')
+    }
+    overlays = {
+        criteria_id: (final_score, base_score)
+        async for criteria_id, final_score, base_score in MunicipalityScore.objects.filter(
+            municipality_id=municipality_id, country_id=country_id
+        ).values_list('criteria_id', 'final_score', 'base_score')
+    }
+    return merge_effective_scores(neutral, overlays)
+
+
+def merge_effective_scores(neutral, overlays):
+    return {
+        criteria_id: effective_score(overlays.get(criteria_id), neutral.get(criteria_id))
+        for criteria_id in set(neutral) | set(overlays)
+    }
+
+
+class ScoreMatrix:
+    """
+    Dense municipality × criteria score matrix for one country.
+
+    Rows follow municipality name order, columns follow criteria id order.
+    Each cell holds the effective score (see effective_score): the country's
+    overlay when it exists, the neutral base score otherwise, then DEFAULT_SCORE.
+    version is the score_versions() value the matrix was built at (set by get_score_matrix).
+    """
+
+    def __init__(self, country_id, municipality_ids, prefecture_ids, criteria_ids, scores, version=None):
+        self.version = version
+        self.country_id = country_id
+        self.municipality_ids = municipality_ids
+        self.prefecture_ids = prefecture_ids
+        self.criteria_ids = criteria_ids
+        self.scores = scores
+        self.criteria_index = {cid: col for col, cid in enumerate(criteria_ids.tolist())}
+        self.municipality_index = {mid: row for row, mid in enumerate(municipality_ids.tolist())}
+
+    @classmethod
+    def build(cls, country_id):
+        return cls.build_many([country_id])[country_id]
+
+    @classmethod
+    def build_many(cls, country_ids):
+        """
+        Build the matrices of several countries at once: the neutral scores are
+        read and placed once, the overlays of all countries come from one query.
+        Returns {country_id: ScoreMatrix}.
+        """
+        municipalities = list(
+            Municipality.objects.order_by('name').values_list('id', 'prefecture_id')
+        )
+        municipality_ids = np.array([m[0] for m in municipalities], dtype=np.int64)
+        prefecture_ids = np.array([m[1] for m in municipalities], dtype=np.int64)
+        criteria_ids = np.array(
+            list(Criteria.objects.order_by('id').values_list('id', flat=True)), dtype=np.int64
+        )
+
+        template = cls(None, municipality_ids, prefecture_ids, criteria_ids,
+                       np.full((len(municipality_ids), len(criteria_ids)), DEFAULT_SCORE))
+
+        # 1. Điểm trung lập cho mọi quốc gia
+        neutral = {}
+        for municipality_id, criteria_id, base_score in MunicipalityBaseScore.objects.values_list(
+            'municipality_id', 'criteria_id', 'base_score'
+        ):
+            neutral[(municipality_id, criteria_id)] = base_score
+            row = template.municipality_index.get(municipality_id)
+            col = template.criteria_index.get(criteria_id)
+            if row is not None and col is not None:
+                template.scores[row, col] = effective_score(None, base_score)
+
+        matrices = {}
+        for country_id in country_ids:
+            matrix = cls.__new__(cls)
+            matrix.__dict__.update(template.__dict__)
+            matrix.country_id = country_id
+            matrix.scores = template.scores.copy()
+            matrices[country_id] = matrix
+
+        # 2. Overlay riêng của từng quốc gia
+        rows = MunicipalityScore.objects.filter(country_id__in=list(country_ids)).values_list(
+            'country_id', 'municipality_id', 'criteria_id', 'final_score', 'base_score'
+        )
+        for country_id, municipality_id, criteria_id, final_score, base_score in rows:
+            row = template.municipality_index.get(municipality_id)
+            col = template.criteria_index.get(criteria_id)
+            if row is not None and col is not None:
+                matrices[country_id].scores[row, col] = effective_score(
+                    (final_score, base_score), neutral.get((municipality_id, criteria_id))
+                )
+        return matrices
+
+    def weight_vector(self, user_preferences):
+        """
+        Turn { rank: criteria_id } into a weight per criteria column.
+        The rank itself is the weight, as in the original loop.
+        """
+        weights = np.zeros(len(self.criteria_ids))
+        for rank_str, criteria_id in user_preferences.items():
+            col = self.criteria_index.get(int(criteria_id))
+            if col is not None:
+                weights[col] += int(rank_str)
+        return weights
+
+    def rows_for_prefecture(self, prefecture_id):
+        if prefecture_id is None:
+            return np.arange(len(self.municipality_ids))
+        return np.flatnonzero(self.prefecture_ids == int(prefecture_id))
+
+    def matching_scores(self, weights, rows):
+        """Weighted average score for the given rows (one matrix-vector product)."""
+        total_weight = weights.sum()
+        if total_weight <= 0:
+            return np.zeros(len(rows))
+        return self.scores[rows] @ weights / total_weight
+
+    def rank(self, user_preferences, prefecture_id=None):
+        """
+        Return (rows, scores) sorted by matching score rounded to 2 decimals, best first.
+        Ties keep municipality name order, like sorted() on the rounded score did.
+        """
+        rows = self.rows_for_prefecture(prefecture_id)
+        scores = self.matching_scores(self.weight_vector(user_preferences), rows)
+        order = np.argsort(np.round(scores, 2), kind='stable')
+        return rows[order], scores[order]
+
+    def top_k(self, user_preferences, k, prefecture_id=None):
+        """
+        Like rank(), but only the best k rows are selected (partition on the rounded
+        score) and sorted, instead of sorting every municipality. Returns the first
+        k rows of rank().
+        """
+        rows = self.rows_for_prefecture(prefecture_id)
+        if k <= 0:
+            return rows[:0], np.zeros(0)
+        scores = self.matching_scores(self.weight_vector(user_preferences), rows)
+        rounded = np.round(scores, 2)
+        if k < len(rows):
+            # Giữ cả nhóm hòa điểm ở biên: thứ tự tên trong nhóm quyết định ai vào top k
+            boundary = np.partition(rounded, k - 1)[k - 1]
+            selected = np.flatnonzero(rounded <= boundary)
+        else:
+            selected = np.arange(len(rows))
+        # Sắp xếp phần đã chọn theo điểm làm tròn, hòa thì theo thứ tự tên
+        order = selected[np.lexsort((selected, rounded[selected]))][:k]
+        return rows[order], scores[order]
+
+
+# Cache ma trận theo quốc gia trong process hiện tại
+_matrices = {}
+_matrices_lock = threading.Lock()
+
+
+def get_score_matrix(country_id):
+    """
+    Matrix of one country for this process, rebuilt when the global or the country's
+    scores version changes (score writes of any process, e.g. a Celery worker or an
+    import command). Writes for other countries leave it in place.
+
+    With a shared score store (SCORE_STORE_DIR) the matrix is a view of the
+    published generation while it matches the score versions, re-attached when a
+    newer one is published. Otherwise the first build comes from the score snapshot
+    when one is configured and still current (no query at all). Scores written since
+    the generation or snapshot are read from the database.
+    """
+    from .score_store import get_score_store
+    from .snapshot import snapshot_matrix
+
+    store = get_score_store()
+    if store is not None and store.refresh():
+        # Thế hệ mới: bỏ ma trận và kết quả xếp hạng của thế hệ cũ
+        with _matrices_lock:
+            _matrices.clear()
+        ranking_cache.invalidate()
+
+    # Đọc phiên bản trước khi xây: điểm ghi trong lúc xây sẽ làm ma trận được xây lại lần sau
+    version = score_versions(country_id)
+    matrix = _matrices.get(country_id)
+    if matrix is None or matrix.version != version:
+        with _matrices_lock:
+            matrix = _matrices.get(country_id)
+            if matrix is None or matrix.version != version:
+                matrix = (
+                    (store.matrix(country_id, version) if store is not None else snapshot_matrix(country_id, version))
+                    or ScoreMatrix.build(country_id)
+                )
+                matrix.version = version
+                _matrices[country_id] = matrix
+    return matrix
+
+
+def invalidate_score_matrix(country_id=None):
+    """
+    Drop the cached matrix of one country, or of every country when country_id is None.
+    The country's scores counter (or the global SCORES_VERSION) is bumped, so the matrices,
+    rankings and results fragments of other processes move on too; other countries keep theirs.
+    A new generation of the shared score store is scheduled when one is configured.
+    """
+    from .tasks import schedule_score_store_publish
+
+    with _matrices_lock:
+        if country_id is None:
+            _matrices.clear()
+        else:
+            _matrices.pop(country_id, None)
+    ranking_cache.invalidate(country_id)
+    # Snapshot đã xuất không còn khớp với dữ liệu điểm (của quốc gia này)
+    bump_version(SCORES_VERSION if country_id is None else country_scores_version(country_id))
+    # Xuất bản sau khi transaction hiện tại commit, để thế hệ mới thấy dữ liệu đã ghi
+    transaction.on_commit(schedule_score_store_publish)
+
+
+# ----------------- SHAREABLE RESULTS TOKEN -----------------
+# Phiên bản định dạng token; tăng khi đổi cách mã hóa
+RESULTS_TOKEN_FORMAT = 1
+# Id lớn nhất trong token: giới hạn của cột integer 64-bit trong database
+MAX_TOKEN_ID = 2 ** 63 - 1
+
+
+def pack_varints(values):
+    """Unsigned LEB128: 7 bits per byte, the high bit marks a continuation byte."""
+    data = bytearray()
+    for value in values:
+        value = int(value)
+        if value < 0:
+            raise ValueError(f'Cannot pack negative value {value}')
+        while value > 0x7F:
+            data.append((value & 0x7F) | 0x80)
+            value >>= 7
+        data.append(value)
+    return bytes(data)
+
+
+def unpack_varints(data):
+    values, value, shift = [], 0, 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value, shift = 0, 0
+    if shift:
+        raise ValueError('Truncated varint')
+    return values
+
+
+def encode_results_token(country_id, prefecture_id, user_preferences):
+    """
+    Compact, canonical token of a results page: format, country, prefecture (0 = nationwide)
+    and the (rank, criteria_id) pairs sorted by rank, packed as varints and base64url encoded
+    without padding. Equal profiles give byte-identical tokens, whatever the key types.
+    """
+    pairs = sorted((int(rank), int(cid)) for rank, cid in user_preferences.items())
+    values = [RESULTS_TOKEN_FORMAT, country_id or 0, prefecture_id or 0]
+    for rank, cid in pairs:
+        values += [rank, cid]
+    return base64.urlsafe_b64encode(pack_varints(values)).rstrip(b'=').decode('ascii')
+
+
+def decode_results_token(token, criteria_count):
+    """
+    Inverse of encode_results_token: (country_id, prefecture_id, {rank: criteria_id}),
+    with None for a 0 country or prefecture. criteria_count is the number of criteria:
+    ranks run from 1 to it. Raises ValueError for a malformed token, a rank out of range,
+    an id past the database integer range, or duplicate / too many pairs.
+    """
+    try:
+        data = base64.urlsafe_b64decode(token.encode('ascii') + b'=' * (-len(token) % 4))
+    except UnicodeEncodeError:
+        raise ValueError('Token is not ASCII')
+    values = unpack_varints(data)
+    if len(values) < 3 or values[0] != RESULTS_TOKEN_FORMAT or len(values) % 2 == 0:
+        raise ValueError('Malformed results token')
+    if (len(values) - 3) // 2 > criteria_count or any(value > MAX_TOKEN_ID for value in values):
+        raise ValueError('Results token out of range')
+    _, country_id, prefecture_id = values[:3]
+    user_preferences = {}
+    for rank, cid in zip(values[3::2], values[4::2]):
+        if not 1 <= rank <= criteria_count or rank in user_preferences or cid in user_preferences.values():
+            raise ValueError('Malformed results token')
+        user_preferences[rank] = cid
+    return country_id or None, prefecture_id or None, user_preferences
+
+
+# ----------------- RANKING CACHE -----------------
+def preferences_hash(user_preferences):
+    """
+    Canonical hash of a { rank: criteria_id } dict.
+    Rank keys may be int or str (after the session JSON round trip), both hash the same.
+    """
+    canonical = sorted((int(rank), int(cid)) for rank, cid in user_preferences.items())
+    return hashlib.sha1(json.dumps(canonical).encode('utf-8')).hexdigest()
+
+
+class RankingCache:
+    """
+    LRU cache with a TTL for finished rankings, keyed by (country, preference hash, scope)
+    and the country's score_versions(): score writes of any process for that country (or an
+    import) make older entries unreachable, and the LRU drops them.
+    """
+
+    def __init__(self, max_size=256, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, country_id, user_preferences, scope, compute):
+        key = (country_id, preferences_hash(user_preferences), scope, score_versions(country_id))
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, country_id=None):
+        with self._lock:
+            if country_id is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == country_id]:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+            }
+
+
+ranking_cache = RankingCache(
+    max_size=getattr(settings, 'RANKING_CACHE_SIZE', 256),
+    ttl=getattr(settings, 'RANKING_CACHE_TTL', 600),
+)
@@ -0,0 +1,27 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .versions import request_versions
+
+
+class DataVersionMiddleware:
+    """
+    Each request reads a data version counter at most once (see chamu/versions.py),
+    so the caches it consults agree with each other and the counters cost one query each.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with request_versions():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with request_versions():
+            return await self.get_response(request)
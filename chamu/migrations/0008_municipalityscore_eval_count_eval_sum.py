@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:41
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_eval_aggregates(apps, schema_editor):
+    MunicipalityScore = apps.get_model('chamu', 'MunicipalityScore')
+    EvaluationSurvey = apps.get_model('chamu', 'EvaluationSurvey')
+
+    totals = EvaluationSurvey.objects.values(
+        'municipality_id', 'criteria_id', 'user__country_id'
+    ).annotate(eval_count=Count('id'), eval_sum=Sum('score'))
+
+    for row in totals:
+        MunicipalityScore.objects.filter(
+            municipality_id=row['municipality_id'],
+            criteria_id=row['criteria_id'],
+            country_id=row['user__country_id'],
+        ).update(eval_count=row['eval_count'], eval_sum=row['eval_sum'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamu', '0007_alter_criteria_left_label_alter_criteria_right_label_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='municipalityscore',
+            name='eval_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='municipalityscore',
+            name='eval_sum',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(backfill_eval_aggregates, migrations.RunPython.noop),
+    ]
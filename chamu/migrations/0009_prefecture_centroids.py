@@ -0,0 +1,64 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:44
+
+from django.db import migrations, models
+from django.db.models import Avg, Max, Min
+
+
+def fill_prefecture_centroids(apps, schema_editor):
+    Prefecture = apps.get_model('chamu', 'Prefecture')
+    Municipality = apps.get_model('chamu', 'Municipality')
+
+    rows = Municipality.objects.filter(latitude__isnull=False, longitude__isnull=False).values(
+        'prefecture_id'
+    ).annotate(
+        avg_lat=Avg('latitude'), avg_lng=Avg('longitude'),
+        min_lat=Min('latitude'), max_lat=Max('latitude'),
+        min_lng=Min('longitude'), max_lng=Max('longitude'),
+    )
+    for row in rows:
+        Prefecture.objects.filter(id=row['prefecture_id']).update(
+            latitude=float(row['avg_lat']), longitude=float(row['avg_lng']),
+            min_latitude=float(row['min_lat']), max_latitude=float(row['max_lat']),
+            min_longitude=float(row['min_lng']), max_longitude=float(row['max_lng']),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamu', '0008_municipalityscore_eval_count_eval_sum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prefecture',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='prefecture',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='prefecture',
+            name='max_latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='prefecture',
+            name='max_longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='prefecture',
+            name='min_latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='prefecture',
+            name='min_longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_prefecture_centroids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamu', '0009_prefecture_centroids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MunicipalityProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.TextField(blank=True)),
+                ('image_url', models.URLField(blank=True, max_length=500)),
+                ('wiki_url', models.URLField(blank=True, max_length=500, null=True)),
+                ('status', models.CharField(choices=[('ok', 'OK'), ('not_found', 'Not found'), ('disambiguation', 'Disambiguation'), ('error', 'Error')], default='ok', max_length=20)),
+                ('fetched_at', models.DateTimeField()),
+                ('municipality', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to='chamu.municipality')),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamu', '0010_municipalityprofile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='municipalityscore',
+            name='base_score',
+            field=models.FloatField(blank=True, default=None, null=True),
+        ),
+        migrations.CreateModel(
+            name='MunicipalityBaseScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_score', models.FloatField(default=3.0)),
+                ('criteria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chamu.criteria')),
+                ('municipality', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chamu.municipality')),
+            ],
+            options={
+                'unique_together': {('municipality', 'criteria')},
+            },
+        ),
+    ]
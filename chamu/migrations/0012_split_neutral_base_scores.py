@@ -0,0 +1,71 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:12
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def neutral_base_subquery(MunicipalityBaseScore):
+    return Subquery(MunicipalityBaseScore.objects.filter(
+        municipality_id=OuterRef('municipality_id'),
+        criteria_id=OuterRef('criteria_id'),
+    ).values('base_score')[:1])
+
+
+def split_neutral_base_scores(apps, schema_editor):
+    MunicipalityScore = apps.get_model('chamu', 'MunicipalityScore')
+    MunicipalityBaseScore = apps.get_model('chamu', 'MunicipalityBaseScore')
+
+    # Giá trị base_score phổ biến nhất qua các quốc gia được coi là điểm trung lập
+    neutral = {}
+    counts = MunicipalityScore.objects.filter(base_score__isnull=False).values(
+        'municipality_id', 'criteria_id', 'base_score'
+    ).annotate(n=Count('id')).order_by()
+    for row in counts.iterator():
+        key = (row['municipality_id'], row['criteria_id'])
+        if key not in neutral or row['n'] > neutral[key][1]:
+            neutral[key] = (row['base_score'], row['n'])
+
+    MunicipalityBaseScore.objects.bulk_create([
+        MunicipalityBaseScore(municipality_id=m, criteria_id=c, base_score=base)
+        for (m, c), (base, _) in neutral.items()
+    ], batch_size=5000)
+
+    # Bản sao thuần (không có đánh giá) bị xóa, các bản còn lại dùng điểm trung lập (base_score = NULL)
+    same_as_neutral = MunicipalityScore.objects.filter(base_score=neutral_base_subquery(MunicipalityBaseScore))
+    same_as_neutral.filter(eval_count=0).delete()
+    same_as_neutral.update(base_score=None)
+
+
+def restore_overlay_base_scores(apps, schema_editor):
+    Country = apps.get_model('chamu', 'Country')
+    MunicipalityScore = apps.get_model('chamu', 'MunicipalityScore')
+    MunicipalityBaseScore = apps.get_model('chamu', 'MunicipalityBaseScore')
+
+    # Tạo lại bản sao theo từng quốc gia như trước khi tách (một câu INSERT ... SELECT)
+    score_table = MunicipalityScore._meta.db_table
+    schema_editor.execute(
+        f'INSERT INTO {score_table} '
+        '(municipality_id, country_id, criteria_id, base_score, avg_score, final_score, eval_count, eval_sum) '
+        'SELECT b.municipality_id, c.id, b.criteria_id, b.base_score, 3.0, b.base_score * 0.6 + 1.2, 0, 0.0 '
+        f'FROM {MunicipalityBaseScore._meta.db_table} b CROSS JOIN {Country._meta.db_table} c '
+        f'WHERE NOT EXISTS (SELECT 1 FROM {score_table} s WHERE s.municipality_id = b.municipality_id '
+        'AND s.country_id = c.id AND s.criteria_id = b.criteria_id)'
+    )
+
+    MunicipalityScore.objects.filter(base_score__isnull=True).update(
+        base_score=Coalesce(neutral_base_subquery(MunicipalityBaseScore), Value(3.0))
+    )
+
+
+# Tách khỏi 0011: unique index của MunicipalityBaseScore chỉ được tạo khi migration trước kết thúc,
+# thiếu index thì các subquery tương quan phía trên phải quét toàn bảng cho mỗi dòng.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamu', '0011_municipalitybasescore_overlays'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_neutral_base_scores, restore_overlay_base_scores),
+    ]
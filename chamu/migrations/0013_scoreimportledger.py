@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamu', '0012_split_neutral_base_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreImportLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=255, unique=True)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('min_value', models.FloatField(blank=True, null=True)),
+                ('max_value', models.FloatField(blank=True, null=True)),
+                ('is_reverse', models.BooleanField(default=False)),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('imported_at', models.DateTimeField(auto_now=True)),
+                ('criteria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chamu.criteria')),
+            ],
+        ),
+    ]
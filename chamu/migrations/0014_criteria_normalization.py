@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamu', '0013_scoreimportledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='criteria',
+            name='normalization',
+            field=models.CharField(choices=[('minmax', 'Min-max'), ('rank', 'Rank / percentile'), ('zscore', 'Z-score (clipped)'), ('robust', 'Robust (median / IQR)')], default='minmax', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='scoreimportledger',
+            name='normalization',
+            field=models.CharField(default='minmax', max_length=20),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_evaluation_country(apps, schema_editor):
+    EvaluationSurvey = apps.get_model('chamu', 'EvaluationSurvey')
+    UserInfo = apps.get_model('chamu', 'UserInfo')
+    # Đánh giá cũ được cộng vào overlay của quốc gia hiện tại của người dùng (không có lịch sử nào tốt hơn)
+    EvaluationSurvey.objects.update(
+        country_id=Subquery(UserInfo.objects.filter(id=OuterRef('user_id')).values('country_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chamu', '0015_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evaluationsurvey',
+            name='country',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='chamu.country'),
+        ),
+        migrations.RunPython(backfill_evaluation_country, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,8 @@
 from django.conf import settings
 from django.db import models
+from django.db.models import Avg, Max, Min
+
+from .normalization import MINMAX, STRATEGY_CHOICES
 
 User = settings.AUTH_USER_MODEL
 
@@ -11,6 +14,8 @@ class Criteria(models.Model):
     right_label = models.CharField(max_length=100, help_text="High index")
 
     is_reverse = models.BooleanField(default=False)
+    # Cách chuẩn hóa điểm thô về thang 1-5 khi nhập file điểm (xem chamu/normalization.py)
+    normalization = models.CharField(max_length=20, choices=STRATEGY_CHOICES, default=MINMAX)
 
     def __str__(self):
         return self.name
@@ -20,9 +25,53 @@ class Criteria(models.Model):
 # -----------------
 class Prefecture(models.Model):
     name = models.CharField(max_length=100, unique=True)
+    # Tâm và khung bao tính từ tọa độ các municipality (xem refresh_centroids)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    min_latitude = models.FloatField(null=True, blank=True)
+    max_latitude = models.FloatField(null=True, blank=True)
+    min_longitude = models.FloatField(null=True, blank=True)
+    max_longitude = models.FloatField(null=True, blank=True)
+
+    CENTROID_FIELDS = ['latitude', 'longitude', 'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude']
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def refresh_centroids(cls):
+        """
+        Recompute centroid and bounding box of every prefecture
+        with one grouped query over municipality coordinates.
+        """
+        stats = {
+            row['prefecture_id']: row
+            for row in Municipality.objects.filter(
+                latitude__isnull=False,
+                longitude__isnull=False
+            ).values('prefecture_id').annotate(
+                avg_lat=Avg('latitude'),
+                avg_lng=Avg('longitude'),
+                min_lat=Min('latitude'),
+                max_lat=Max('latitude'),
+                min_lng=Min('longitude'),
+                max_lng=Max('longitude'),
+            )
+        }
+        columns = dict(zip(cls.CENTROID_FIELDS, ['avg_lat', 'avg_lng', 'min_lat', 'max_lat', 'min_lng', 'max_lng']))
+
+        prefectures = list(cls.objects.all())
+        for prefecture in prefectures:
+            row = stats.get(prefecture.id, {})
+            for field, column in columns.items():
+                value = row.get(column)
+                setattr(prefecture, field, float(value) if value is not None else None)
+        cls.objects.bulk_update(prefectures, cls.CENTROID_FIELDS)
+
+        # bulk_update không gửi signal: tọa độ trong cache reference data phải được đọc lại
+        from .reference_cache import invalidate_reference_data
+        invalidate_reference_data()
+
 class Municipality(models.Model):
     name = models.CharField(max_length=100, unique=True)
     prefecture = models.ForeignKey(Prefecture, on_delete=models.CASCADE)
@@ -31,6 +80,29 @@ class Municipality(models.Model):
     def __str__(self):
         return f'{self.name} ({self.prefecture.name})'
 
+class MunicipalityProfile(models.Model):
+    """Mô tả, ảnh và link Wikipedia đã lưu của một municipality."""
+    STATUS_OK = 'ok'
+    STATUS_NOT_FOUND = 'not_found'
+    STATUS_DISAMBIGUATION = 'disambiguation'
+    STATUS_ERROR = 'error'
+    STATUS_CHOICES = [
+        (STATUS_OK, 'OK'),
+        (STATUS_NOT_FOUND, 'Not found'),
+        (STATUS_DISAMBIGUATION, 'Disambiguation'),
+        (STATUS_ERROR, 'Error'),
+    ]
+
+    municipality = models.OneToOneField(Municipality, on_delete=models.CASCADE, related_name='profile')
+    description = models.TextField(blank=True)
+    image_url = models.URLField(max_length=500, blank=True)
+    wiki_url = models.URLField(max_length=500, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_OK)
+    fetched_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.municipality.name} ({self.status})'
+
 class Country(models.Model):
     name = models.CharField(max_length=100, unique=True)
     def __str__(self):
@@ -48,23 +120,69 @@ class UserInfo(models.Model):
 # -----------------
 # Score Models
 # -----------------
+class MunicipalityBaseScore(models.Model):
+    """Điểm cơ sở không phụ thuộc quốc gia, lưu một lần cho mỗi (municipality, criteria)."""
+    municipality = models.ForeignKey(Municipality, on_delete=models.CASCADE)
+    criteria = models.ForeignKey(Criteria, on_delete=models.CASCADE)
+    base_score = models.FloatField(default=3.0)
+
+    class Meta:
+        unique_together = ('municipality', 'criteria')
+
+    def __str__(self):
+        return f'{self.municipality.name} - {self.criteria.name} (Base)'
+
 class MunicipalityScore(models.Model):
+    """
+    Per-country overlay: only exists where a country-specific base score
+    or crowd evaluations exist. base_score is null when the country uses
+    the neutral MunicipalityBaseScore.
+    """
     municipality = models.ForeignKey(Municipality, on_delete=models.CASCADE)
     country = models.ForeignKey(Country, on_delete=models.CASCADE)
     criteria = models.ForeignKey(Criteria, on_delete=models.CASCADE)
-    base_score = models.FloatField(default=3.0)
+    base_score = models.FloatField(null=True, blank=True, default=None)
     avg_score = models.FloatField(default=3.0)
     final_score = models.FloatField(default=3.0)
+    # Tổng hợp EvaluationSurvey đang chạy, để tính avg_score mà không cần aggregate lại
+    eval_count = models.PositiveIntegerField(default=0)
+    eval_sum = models.FloatField(default=0.0)
 
     class Meta:
         unique_together = ('municipality', 'country', 'criteria')
 
     def __str__(self):
-        return f'{self.municipality.name} - {self.criteria.name} (Base)'
+        return f'{self.municipality.name} - {self.criteria.name} ({self.country.name})'
+
+class ScoreImportLedger(models.Model):
+    """Lần nhập gần nhất của một file điểm: hash nội dung và tham số chuẩn hóa."""
+    file_name = models.CharField(max_length=255, unique=True)
+    criteria = models.ForeignKey(Criteria, on_delete=models.CASCADE)
+    content_hash = models.CharField(max_length=64)
+    min_value = models.FloatField(null=True, blank=True)
+    max_value = models.FloatField(null=True, blank=True)
+    is_reverse = models.BooleanField(default=False)
+    normalization = models.CharField(max_length=20, default=MINMAX)
+    row_count = models.PositiveIntegerField(default=0)
+    imported_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.file_name} ({self.content_hash[:12]})'
+
+class DataVersion(models.Model):
+    """Bộ đếm phiên bản dữ liệu, dùng chung cho mọi process (xem chamu/versions.py)."""
+    name = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField()
+
+    def __str__(self):
+        return f'{self.name}={self.version}'
 
 class EvaluationSurvey(models.Model):
     user = models.ForeignKey(UserInfo, on_delete=models.CASCADE)
     municipality = models.ForeignKey(Municipality, on_delete=models.CASCADE)
     criteria = models.ForeignKey(Criteria, on_delete=models.CASCADE)
+    # Quốc gia có overlay MunicipalityScore đã cộng đánh giá này (user.country lúc gửi);
+    # người dùng có thể đổi quốc gia sau đó, khi gửi lại phải trừ đúng overlay cũ
+    country = models.ForeignKey(Country, on_delete=models.SET_NULL, null=True, blank=True)
     score = models.FloatField(default=3.0)
     created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
@@ -0,0 +1,86 @@
+import numpy as np
+
+# Tên các chiến lược chuẩn hóa (giá trị của Criteria.normalization)
+MINMAX = 'minmax'
+RANK = 'rank'
+ZSCORE = 'zscore'
+ROBUST = 'robust'
+
+# z-score / độ lệch IQR được cắt tại mức này rồi mới đưa về thang 1-5
+ZSCORE_CLIP = 2.0
+ROBUST_CLIP = 1.0
+
+MIN_SCORE = 1.0
+MAX_SCORE = 5.0
+MID_SCORE = 3.0
+
+
+def minmax(raw_scores):
+    """Linear scaling of [min, max] to [1, 5]. One outlier compresses every other value."""
+    min_value, max_value = raw_scores.min(), raw_scores.max()
+    if max_value == min_value:
+        return np.full(raw_scores.shape, MID_SCORE)
+    return (raw_scores - min_value) / (max_value - min_value) * 4 + 1
+
+
+def rank(raw_scores):
+    """Percentile rank scaled to [1, 5]; equal raw scores share their average rank."""
+    if raw_scores.size == 1:
+        return np.full(raw_scores.shape, MID_SCORE)
+    values, inverse, counts = np.unique(raw_scores, return_inverse=True, return_counts=True)
+    first_rank = np.cumsum(counts) - counts
+    average_rank = first_rank + (counts - 1) / 2
+    return average_rank[inverse] / (raw_scores.size - 1) * 4 + 1
+
+
+def zscore(raw_scores):
+    """Standard score clipped to ±ZSCORE_CLIP, then scaled to [1, 5] around 3."""
+    std = raw_scores.std()
+    if std == 0:
+        return np.full(raw_scores.shape, MID_SCORE)
+    z = np.clip((raw_scores - raw_scores.mean()) / std, -ZSCORE_CLIP, ZSCORE_CLIP)
+    return MID_SCORE + z / ZSCORE_CLIP * 2
+
+
+def robust(raw_scores):
+    """
+    Distance from the median in units of the interquartile range, clipped to ±ROBUST_CLIP.
+    Falls back to min-max when the IQR is 0 (more than half of the values are equal).
+    """
+    q25, median, q75 = np.percentile(raw_scores, [25, 50, 75])
+    iqr = q75 - q25
+    if iqr == 0:
+        return minmax(raw_scores)
+    r = np.clip((raw_scores - median) / iqr, -ROBUST_CLIP, ROBUST_CLIP)
+    return MID_SCORE + r / ROBUST_CLIP * 2
+
+
+STRATEGIES = {
+    MINMAX: minmax,
+    RANK: rank,
+    ZSCORE: zscore,
+    ROBUST: robust,
+}
+
+STRATEGY_CHOICES = [
+    (MINMAX, 'Min-max'),
+    (RANK, 'Rank / percentile'),
+    (ZSCORE, 'Z-score (clipped)'),
+    (ROBUST, 'Robust (median / IQR)'),
+]
+
+
+def normalize(raw_scores, strategy=MINMAX, is_reverse=False):
+    """
+    Normalize a whole criteria column to 1-5 with the given strategy (vectorized).
+    is_reverse flips the scale (6 - score); results are rounded to 2 decimals.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f'Unknown normalization strategy: {strategy}')
+    raw_scores = np.asarray(raw_scores, dtype=np.float64)
+    if raw_scores.size == 0:
+        return raw_scores
+    scores = STRATEGIES[strategy](raw_scores)
+    if is_reverse:
+        scores = 6 - scores
+    return np.clip(np.round(scores, 2), MIN_SCORE, MAX_SCORE)
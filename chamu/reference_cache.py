@@ -0,0 +1,79 @@
+import threading
+
+from django.db import transaction
+
+from .models import Country, Criteria, Prefecture
+from .versions import bump_version, get_version
+
+# Bộ đếm phiên bản của các bảng tham chiếu (Criteria, Country, Prefecture)
+REFERENCE_VERSION = 'reference'
+
+
+class ReferenceData:
+    """
+    Rows of the small reference tables, read once per version with three queries.
+    The lists and dicts are shared by every request of the process: treat them as read-only.
+    """
+
+    def __init__(self, criteria, countries, prefectures, version=None):
+        self.version = version
+        # Criteria theo id (thứ tự cột của ScoreMatrix), Country/Prefecture theo tên như các form
+        self.criteria = criteria
+        self.criteria_by_name = sorted(criteria, key=lambda c: c.name)
+        self.countries = countries
+        self.prefectures = prefectures
+        self.criteria_map = {c.id: c for c in criteria}
+        self.country_map = {c.id: c for c in countries}
+        self.prefecture_map = {p.id: p for p in prefectures}
+
+    @classmethod
+    def build(cls, version=None):
+        return cls(
+            list(Criteria.objects.order_by('id')),
+            list(Country.objects.order_by('name')),
+            list(Prefecture.objects.order_by('name')),
+            version=version,
+        )
+
+
+_reference = None
+_reference_lock = threading.Lock()
+
+
+def get_reference_data():
+    """Reference data of this process, re-read when the reference version changes."""
+    global _reference
+    version = get_version(REFERENCE_VERSION)
+    reference = _reference
+    if reference is None or reference.version != version:
+        with _reference_lock:
+            if _reference is None or _reference.version != version:
+                _reference = ReferenceData.build(version=version)
+            reference = _reference
+    return reference
+
+
+def get_criteria_map(criteria_ids=None):
+    """{criteria_id: Criteria}, optionally limited to criteria_ids (ints or numeric strings)."""
+    criteria_map = get_reference_data().criteria_map
+    if criteria_ids is None:
+        return criteria_map
+    ids = {int(cid) for cid in criteria_ids}
+    return {cid: criteria for cid, criteria in criteria_map.items() if cid in ids}
+
+
+def get_prefecture(prefecture_id):
+    """Cached Prefecture by id, or None (invalid or unknown id)."""
+    try:
+        return get_reference_data().prefecture_map.get(int(prefecture_id))
+    except (ValueError, TypeError):
+        return None
+
+
+def invalidate_reference_data():
+    """
+    Make every process re-read the reference tables. The version is bumped now,
+    and again after commit so data cached from an uncommitted read is dropped too.
+    """
+    bump_version(REFERENCE_VERSION)
+    transaction.on_commit(lambda: bump_version(REFERENCE_VERSION))
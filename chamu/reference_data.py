@@ -0,0 +1,92 @@
+import csv
+
+from django.db import transaction
+
+from .reference_cache import invalidate_reference_data
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def read_reference_csv(file_path, min_columns, warn=None):
+    """
+    Read a reference CSV once: the header row is skipped, blank rows are ignored
+    and rows with fewer than min_columns columns are reported through warn.
+    Returns a list of rows with stripped values.
+    """
+    rows = []
+    with open(file_path, 'r', encoding='utf-8-sig') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        for row in reader:
+            if not any(value.strip() for value in row):
+                continue
+            if len(row) < min_columns:
+                if warn:
+                    warn(f'Hàng bị thiếu dữ liệu: {row}')
+                continue
+            rows.append([value.strip() for value in row])
+    return rows
+
+
+class LoadResult:
+    """Counts of one bulk_load() call."""
+
+    def __init__(self, model, added=0, changed=0, unchanged=0):
+        self.model = model
+        self.added = added
+        self.changed = changed
+        self.unchanged = unchanged
+
+    @property
+    def has_changes(self):
+        return bool(self.added or self.changed)
+
+    def __str__(self):
+        return (f'{self.model.__name__}: {self.added} thêm mới, '
+                f'{self.changed} cập nhật, {self.unchanged} không đổi')
+
+
+def bulk_load(model, key_field, records, update_fields=(), verify=False, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Insert or update reference rows in batches.
+
+    records maps the unique key value to the field values of that row (later CSV rows
+    simply overwrite earlier ones). Existing rows are read with one query; only
+    update_fields are compared and updated, other values are used when creating.
+    With verify=True nothing is written, only the counts are returned.
+    bulk_create/bulk_update send no signals, so the reference cache is invalidated here.
+    """
+    update_fields = list(update_fields)
+    existing = {
+        getattr(obj, key_field): obj
+        for obj in model.objects.only('pk', key_field, *update_fields)
+    }
+
+    to_create = []
+    to_update = []
+    result = LoadResult(model)
+    for key, values in records.items():
+        obj = existing.get(key)
+        if obj is None:
+            to_create.append(model(**{key_field: key}, **values))
+            continue
+        changed = False
+        for field in update_fields:
+            if getattr(obj, field) != values[field]:
+                setattr(obj, field, values[field])
+                changed = True
+        if changed:
+            to_update.append(obj)
+        else:
+            result.unchanged += 1
+
+    result.added = len(to_create)
+    result.changed = len(to_update)
+    if not verify:
+        with transaction.atomic():
+            model.objects.bulk_create(to_create, batch_size=batch_size)
+            if to_update:
+                model.objects.bulk_update(to_update, update_fields, batch_size=batch_size)
+        if result.has_changes:
+            invalidate_reference_data()
+    return result
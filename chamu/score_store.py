@@ -0,0 +1,163 @@
+import os
+import shutil
+import threading
+import time
+
+from django.conf import settings
+
+from .matching import SCORES_VERSION
+from .snapshot import ScoreSnapshot, load_score_snapshot
+from .versions import bump_version, read_versions
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có khóa file, chỉ nên có một writer
+    fcntl = None
+
+# File con trỏ tới thế hệ hiện tại, được thay bằng os.replace (nguyên tử)
+CURRENT_FILE = 'CURRENT'
+LOCK_FILE = '.lock'
+GENERATION_PREFIX = 'gen-'
+
+# Số thế hệ cũ được giữ lại cho các process chưa kịp chuyển sang thế hệ mới
+SCORE_STORE_KEEP_GENERATIONS = getattr(settings, 'SCORE_STORE_KEEP_GENERATIONS', 3)
+
+
+class ScoreStore:
+    """
+    Score snapshots shared by every process of the deployment through memory-mapped files.
+
+    A writer publishes a new generation directory (see ScoreSnapshot.save), bumps
+    SCORES_VERSION, so cached rankings and results fragments of every process move to new
+    keys, then swaps the CURRENT pointer file. The pointer holds the generation and that
+    SCORES_VERSION together: a matrix of the generation is only used while the global and
+    the country's counters still match it (see matrix), otherwise get_score_matrix reads
+    the database. Readers call refresh() from get_score_matrix: a stat of CURRENT, and a
+    re-attach only when it points to another generation. All processes map the same files,
+    so the page cache holds a single copy of the scores.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.fspath(directory)
+        self.generation = None
+        self.snapshot = None
+        self._pointer_stat = None
+        self._lock = threading.Lock()
+
+    @property
+    def current_path(self):
+        return os.path.join(self.directory, CURRENT_FILE)
+
+    def read_current(self):
+        """Name of the published generation, or None before the first publish."""
+        return self.read_pointer()[0]
+
+    def read_pointer(self):
+        """(generation, SCORES_VERSION it was published at) from CURRENT, (None, None) before the first publish."""
+        try:
+            with open(self.current_path, 'r', encoding='utf-8') as file:
+                lines = file.read().split()
+        except FileNotFoundError:
+            return None, None
+        generation = lines[0] if lines else None
+        # Con trỏ cũ chỉ có tên thế hệ: không khớp phiên bản nào, đọc database cho tới lần xuất bản sau
+        version = int(lines[1]) if len(lines) > 1 else None
+        return generation, version
+
+    def refresh(self):
+        """Attach to the published generation if it changed. Returns True when it did."""
+        try:
+            stat = os.stat(self.current_path)
+            pointer_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            pointer_stat = None
+        if pointer_stat == self._pointer_stat:
+            return False
+
+        with self._lock:
+            if pointer_stat == self._pointer_stat:
+                return False
+            generation, version = self.read_pointer()
+            changed = generation != self.generation
+            if changed:
+                snapshot = load_score_snapshot(os.path.join(self.directory, generation)) if generation else None
+                if snapshot is not None:
+                    # Thế hệ này là dữ liệu điểm của phiên bản toàn cục ghi trong con trỏ
+                    snapshot.scores_version = version
+                self.snapshot = snapshot
+                self.generation = generation
+            self._pointer_stat = pointer_stat
+            return changed
+
+    def matrix(self, country_id, versions):
+        """
+        ScoreMatrix of the attached generation when it matches versions (score_versions() of
+        the country), or None: no generation yet, unknown country, or scores written since.
+        """
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.versions(country_id) != versions:
+            return None
+        return snapshot.matrix(country_id)
+
+    def publish(self):
+        """Build a new generation from the database and make it current. Returns its name."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_FILE), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                generation = f'{GENERATION_PREFIX}{time.time_ns()}'
+                ScoreSnapshot.build().save(os.path.join(self.directory, generation))
+
+                # Kết quả đã cache (ranking, fragment) được tính từ thế hệ cũ. Phiên bản mới được
+                # ghi cùng tên thế hệ: reader không bao giờ gắn phiên bản mới cho thế hệ cũ
+                bump_version(SCORES_VERSION)
+                version = read_versions([SCORES_VERSION])[SCORES_VERSION]
+                tmp_current = f'{self.current_path}.tmp-{os.getpid()}'
+                with open(tmp_current, 'w', encoding='utf-8') as file:
+                    file.write(f'{generation}\n{version}\n')
+                os.replace(tmp_current, self.current_path)
+
+                self.prune(keep=generation)
+                return generation
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def prune(self, keep):
+        """
+        Delete old generations beyond SCORE_STORE_KEEP_GENERATIONS. Processes still
+        mapping a deleted generation keep working (POSIX) until they switch over.
+        """
+        generations = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(GENERATION_PREFIX) and name != keep
+            and os.path.isdir(os.path.join(self.directory, name))
+        )
+        for name in generations[:max(len(generations) - (SCORE_STORE_KEEP_GENERATIONS - 1), 0)]:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_score_store():
+    """The shared store of settings.SCORE_STORE_DIR for this process, or None when it is not configured."""
+    global _store
+    directory = getattr(settings, 'SCORE_STORE_DIR', None)
+    if not directory:
+        return None
+    if _store is None or _store.directory != os.fspath(directory):
+        with _store_lock:
+            if _store is None or _store.directory != os.fspath(directory):
+                _store = ScoreStore(directory)
+    return _store
+
+
+def publish_score_store():
+    """Publish a new generation of the configured store. Returns its name, or None without a store."""
+    store = get_score_store()
+    if store is None:
+        return None
+    return store.publish()
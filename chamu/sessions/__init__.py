@@ -0,0 +1,41 @@
+"""
+Session engines without database writes (settings.SESSION_MODE).
+
+Both stores read a session they do not know from the database session table
+(the previous engine) and adopt it, so live sessions survive the switch.
+Turn SESSION_LEGACY_DB_FALLBACK off once the old sessions have expired,
+or copy them ahead of time with `manage.py migrate_sessions`.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DatabaseSessionStore
+
+
+def load_legacy_session(session_key):
+    """Data of an unexpired database session, or {} (one read query, no write)."""
+    if not session_key or not getattr(settings, 'SESSION_LEGACY_DB_FALLBACK', False):
+        return {}
+    return DatabaseSessionStore(session_key).load()
+
+
+class LegacyDatabaseFallbackMixin:
+    """Adopt the database session of an unknown key; it is written to the new store on save."""
+
+    def load(self):
+        session_key = self.session_key
+        data = super().load()
+        if data:
+            return data
+        legacy = load_legacy_session(session_key)
+        if legacy:
+            self.adopt_legacy_key(session_key)
+            # SessionMiddleware lưu lại phiên này vào store mới ở cuối request
+            self.modified = True
+        return legacy
+
+    async def aload(self):
+        # Luôn đi qua load() để async view cũng nhận phiên cũ từ database
+        return await sync_to_async(self.load)()
+
+    def adopt_legacy_key(self, session_key):
+        pass
@@ -0,0 +1,24 @@
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.cache import SessionStore as CacheSessionStore
+
+from . import LegacyDatabaseFallbackMixin
+
+
+class SessionStore(LegacyDatabaseFallbackMixin, CacheSessionStore):
+    """Sessions in settings.SESSION_CACHE_ALIAS (Redis in production)."""
+    _adopting = False
+
+    def adopt_legacy_key(self, session_key):
+        # Giữ nguyên khóa: cookie của trình duyệt vẫn hợp lệ
+        self._session_key = session_key
+        self._adopting = True
+
+    def save(self, must_create=False):
+        if self._adopting and not must_create:
+            # Phiên vừa lấy từ database chưa có trong cache: lần lưu đầu tiên là tạo mới
+            self._adopting = False
+            try:
+                return super().save(must_create=True)
+            except CreateError:
+                pass  # một request song song vừa chuyển phiên này
+        return super().save(must_create=must_create)
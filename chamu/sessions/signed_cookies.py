@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends.signed_cookies import SessionStore as SignedCookieSessionStore
+
+from . import LegacyDatabaseFallbackMixin
+
+
+class SessionStore(LegacyDatabaseFallbackMixin, SignedCookieSessionStore):
+    """Sessions in the signed (not encrypted) session cookie itself: small survey state only."""
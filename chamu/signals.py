@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Country, Criteria, Municipality, MunicipalityProfile, Prefecture
+from .reference_cache import invalidate_reference_data
+from .spatial import COORDINATES_VERSION
+from .versions import bump_version
+from .wiki import profile_version
+
+
+@receiver([post_save, post_delete], sender=Municipality)
+def municipality_coordinates_changed(sender, **kwargs):
+    """Tọa độ có thể đã thay đổi: các spatial index sẽ được xây lại."""
+    bump_version(COORDINATES_VERSION)
+
+
+@receiver([post_save, post_delete], sender=Criteria)
+@receiver([post_save, post_delete], sender=Country)
+@receiver([post_save, post_delete], sender=Prefecture)
+def reference_data_changed(sender, **kwargs):
+    """Bảng tham chiếu thay đổi: cache reference data của mọi process sẽ được đọc lại."""
+    invalidate_reference_data()
+
+
+@receiver([post_save, post_delete], sender=MunicipalityProfile)
+def municipality_profile_changed(sender, instance, **kwargs):
+    """Profile Wikipedia vừa được làm mới: fragment profile đã cache của municipality này hết hiệu lực."""
+    bump_version(profile_version(instance.municipality_id))
@@ -0,0 +1,173 @@
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .matching import SCORES_VERSION, ScoreMatrix, country_scores_version, score_versions
+from .models import Country
+from .versions import get_versions
+
+# Phiên bản định dạng file snapshot; tăng khi đổi cấu trúc
+SNAPSHOT_FORMAT = 2
+
+SCORES_FILE = 'scores.npy'
+INDEX_FILE = 'index.npz'
+
+
+class ScoreSnapshot:
+    """
+    Effective score tensor (country × municipality × criteria) with its id index arrays.
+    Axes follow ScoreMatrix: municipalities by name, criteria by id.
+    scores is usually a read-only memory map, so opening a snapshot costs almost nothing.
+    scores_version and country_versions (one per country) are the counters read before the export.
+    """
+
+    def __init__(self, scores, country_ids, municipality_ids, prefecture_ids, criteria_ids,
+                 scores_version=None, country_versions=None, generated_at=None, path=None):
+        self.scores = scores
+        self.country_ids = country_ids
+        self.municipality_ids = municipality_ids
+        self.prefecture_ids = prefecture_ids
+        self.criteria_ids = criteria_ids
+        self.scores_version = scores_version
+        self.country_versions = (
+            country_versions if country_versions is not None else np.full(len(country_ids), -1, dtype=np.int64)
+        )
+        self.generated_at = generated_at
+        self.path = path
+        self.country_index = {cid: i for i, cid in enumerate(country_ids.tolist())}
+
+    @classmethod
+    def build(cls):
+        """Read the effective scores of every country from the database."""
+        country_ids = list(Country.objects.order_by('id').values_list('id', flat=True))
+        # Phiên bản đọc trước dữ liệu: điểm ghi trong lúc xuất làm snapshot bị coi là cũ
+        versions = get_versions([SCORES_VERSION] + [country_scores_version(cid) for cid in country_ids])
+        matrices = ScoreMatrix.build_many(country_ids)
+        if matrices:
+            first = matrices[country_ids[0]]
+            scores = np.stack([matrices[cid].scores for cid in country_ids])
+            index = (first.municipality_ids, first.prefecture_ids, first.criteria_ids)
+        else:
+            template = ScoreMatrix.build_many([None])[None]
+            scores = np.empty((0,) + template.scores.shape)
+            index = (template.municipality_ids, template.prefecture_ids, template.criteria_ids)
+        return cls(
+            scores, np.array(country_ids, dtype=np.int64), *index,
+            scores_version=versions[SCORES_VERSION],
+            country_versions=np.array([versions[country_scores_version(cid)] for cid in country_ids], dtype=np.int64),
+            generated_at=time.time(),
+        )
+
+    def matrix(self, country_id):
+        """ScoreMatrix of one country backed by the snapshot (no copy, no query), or None."""
+        index = self.country_index.get(country_id)
+        if index is None:
+            return None
+        return ScoreMatrix(country_id, self.municipality_ids, self.prefecture_ids, self.criteria_ids,
+                           self.scores[index])
+
+    def versions(self, country_id):
+        """score_versions() of one country at export time, or None for a country not in the snapshot."""
+        index = self.country_index.get(country_id)
+        if index is None or self.scores_version is None:
+            return None
+        return self.scores_version, int(self.country_versions[index])
+
+    def save(self, path):
+        """
+        Write the snapshot to the directory `path`: scores.npy (memory-mappable)
+        and index.npz. Files are written next to it first, then swapped in.
+        """
+        path = os.fspath(path)
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, SCORES_FILE), np.ascontiguousarray(self.scores, dtype=np.float64))
+        np.savez(
+            os.path.join(tmp_path, INDEX_FILE),
+            format=np.array(SNAPSHOT_FORMAT),
+            country_ids=self.country_ids,
+            municipality_ids=self.municipality_ids,
+            prefecture_ids=self.prefecture_ids,
+            criteria_ids=self.criteria_ids,
+            scores_version=np.array(self.scores_version if self.scores_version is not None else -1),
+            country_versions=np.asarray(self.country_versions, dtype=np.int64),
+            generated_at=np.array(self.generated_at or time.time()),
+        )
+
+        old_path = f'{path}.old-{os.getpid()}'
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        self.path = path
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        path = os.fspath(path)
+        with np.load(os.path.join(path, INDEX_FILE)) as index:
+            if int(index['format']) != SNAPSHOT_FORMAT:
+                raise ValueError(f'Unsupported score snapshot format {int(index["format"])} in {path}')
+            arrays = {name: index[name] for name in index.files}
+        scores = np.load(os.path.join(path, SCORES_FILE), mmap_mode='r' if mmap else None)
+        scores_version = int(arrays['scores_version'])
+        return cls(
+            scores, arrays['country_ids'], arrays['municipality_ids'], arrays['prefecture_ids'],
+            arrays['criteria_ids'],
+            scores_version=scores_version if scores_version >= 0 else None,
+            country_versions=arrays['country_versions'],
+            generated_at=float(arrays['generated_at']),
+            path=path,
+        )
+
+
+def export_score_snapshot(path):
+    snapshot = ScoreSnapshot.build()
+    snapshot.save(path)
+    return snapshot
+
+
+def load_score_snapshot(path, mmap=True):
+    return ScoreSnapshot.load(path, mmap=mmap)
+
+
+# Snapshot đã mở trong process hiện tại (settings.SCORE_SNAPSHOT_PATH)
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_score_snapshot():
+    """
+    The configured snapshot, memory-mapped once per process, or None when
+    SCORE_SNAPSHOT_PATH is not set or the file does not exist.
+    """
+    global _snapshot
+    path = getattr(settings, 'SCORE_SNAPSHOT_PATH', None)
+    if not path:
+        return None
+    if _snapshot is None or _snapshot.path != os.fspath(path):
+        with _snapshot_lock:
+            if _snapshot is None or _snapshot.path != os.fspath(path):
+                try:
+                    _snapshot = load_score_snapshot(path)
+                except (OSError, ValueError, KeyError):
+                    return None
+    return _snapshot
+
+
+def snapshot_matrix(country_id, versions=None):
+    """
+    ScoreMatrix from the snapshot when it still matches the score data of the country
+    (same score_versions() as when it was exported), else None.
+    versions is the current score_versions(country_id) when the caller has already read it.
+    """
+    snapshot = get_score_snapshot()
+    if versions is None:
+        versions = score_versions(country_id)
+    if snapshot is None or snapshot.versions(country_id) != versions:
+        return None
+    return snapshot.matrix(country_id)
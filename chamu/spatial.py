@@ -0,0 +1,122 @@
+import math
+import threading
+
+import numpy as np
+
+from .models import Municipality
+from .versions import get_version
+
+COORDINATES_VERSION = 'coordinates'
+
+
+def to_unit_vectors(latitudes, longitudes):
+    """Lat/lng in degrees -> points on the unit sphere (n × 3)."""
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lng = np.radians(np.asarray(longitudes, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)))
+
+
+class KDTree:
+    """
+    Small KD-tree over 3D points, stored implicitly in one array:
+    the node of the range [lo, hi) is the median at (lo + hi) // 2.
+    Chord distance on the unit sphere is monotonic in great-circle distance,
+    so the nearest point by chord is the nearest municipality.
+    """
+
+    def __init__(self, points):
+        self.order = np.arange(len(points))
+        self.points = np.array(points, dtype=float)
+        self.axes = np.zeros(len(points), dtype=np.int8)
+        self._build(0, len(points))
+        self.points_list = self.points.tolist()
+        self.axes_list = self.axes.tolist()
+
+    def _build(self, lo, hi):
+        if hi - lo <= 1:
+            return
+        # Chia theo trục có độ trải rộng lớn nhất
+        segment = self.points[lo:hi]
+        axis = int(np.argmax(segment.max(axis=0) - segment.min(axis=0)))
+        mid = (lo + hi) // 2
+        partition = np.argpartition(segment[:, axis], mid - lo)
+        self.points[lo:hi] = segment[partition]
+        self.order[lo:hi] = self.order[lo:hi][partition]
+        self.axes[mid] = axis
+        self._build(lo, mid)
+        self._build(mid + 1, hi)
+
+    def nearest(self, point):
+        """Return the index (into the original points) of the nearest point, or None."""
+        if not self.points_list:
+            return None
+        best = [math.inf, -1]
+        self._search(0, len(self.points_list), list(point), best)
+        return int(self.order[best[1]])
+
+    def _search(self, lo, hi, point, best):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        node = self.points_list[mid]
+        distance = (node[0] - point[0]) ** 2 + (node[1] - point[1]) ** 2 + (node[2] - point[2]) ** 2
+        if distance < best[0]:
+            best[0], best[1] = distance, mid
+
+        diff = point[self.axes_list[mid]] - node[self.axes_list[mid]]
+        near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+        self._search(near[0], near[1], point, best)
+        if diff * diff < best[0]:
+            self._search(far[0], far[1], point, best)
+
+
+class MunicipalityIndex:
+    """Nearest-municipality lookup over Municipality.latitude/longitude."""
+
+    def __init__(self, municipality_ids, latitudes, longitudes, version=None):
+        self.municipality_ids = list(municipality_ids)
+        self.latitudes = list(latitudes)
+        self.longitudes = list(longitudes)
+        self.version = version
+        self.tree = KDTree(to_unit_vectors(self.latitudes, self.longitudes).reshape(-1, 3))
+
+    @classmethod
+    def build(cls, version=None):
+        rows = list(Municipality.objects.filter(
+            latitude__isnull=False,
+            longitude__isnull=False
+        ).values_list('id', 'latitude', 'longitude'))
+        return cls(
+            [r[0] for r in rows],
+            [float(r[1]) for r in rows],
+            [float(r[2]) for r in rows],
+            version=version,
+        )
+
+    def __len__(self):
+        return len(self.municipality_ids)
+
+    def nearest(self, lat, lng):
+        """Return (municipality_id, latitude, longitude) of the nearest municipality, or None."""
+        index = self.tree.nearest(to_unit_vectors([lat], [lng])[0])
+        if index is None:
+            return None
+        return self.municipality_ids[index], self.latitudes[index], self.longitudes[index]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_municipality_index():
+    """Shared index for this process, rebuilt when the coordinates version changes."""
+    global _index
+    version = get_version(COORDINATES_VERSION)
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = MunicipalityIndex.build(version=version)
+            index = _index
+    return index
@@ -1,10 +1,114 @@
 from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
-from chamu.models import UserInfo
+from chamu.models import UserInfo, Municipality, Country
+
+# Cửa sổ gộp (giây): mọi đánh giá cho cùng (municipality, country) trong cửa sổ này chỉ tính lại điểm một lần
+SCORE_RECOMPUTE_DEBOUNCE = getattr(settings, 'SCORE_RECOMPUTE_DEBOUNCE', 10)
+# Cửa sổ gộp (giây) cho việc xuất bản thế hệ mới của score store dùng chung
+SCORE_STORE_PUBLISH_DEBOUNCE = getattr(settings, 'SCORE_STORE_PUBLISH_DEBOUNCE', 2)
+SCORE_STORE_PUBLISH_KEY = 'chamu:score-store-publish'
+
 
 @shared_task
 def delete_stale_user_info():
     """Tác vụ để xóa các UserInfo không có User liên kết."""
     existing_user_ids = User.objects.values_list('id', flat=True)
     stale_user_info_count, _ = UserInfo.objects.exclude(user_id__in=existing_user_ids).delete()
-    print(f'Successfully deleted {stale_user_info_count} stale UserInfo records.')
\ No newline at end of file
+    print(f'Successfully deleted {stale_user_info_count} stale UserInfo records.')
+
+
+def score_recompute_key(municipality_id, country_id):
+    return f'chamu:score-recompute:{municipality_id}:{country_id}'
+
+
+def schedule_score_recompute(municipality, country):
+    """
+    Schedule update_municipality_score for (municipality, country), debounced and coalesced:
+    while a recompute is pending, further calls are no-ops.
+    Without a broker (CELERY_BROKER_URL unset) the recompute runs synchronously.
+
+    The pending flag lives in the default cache: calls are coalesced across web processes
+    only when it is shared (REDIS_URL). With the per-process LocMem cache each process
+    schedules its own recompute; the task is idempotent, so this only costs duplicate runs.
+    """
+    from chamu.views import update_municipality_score
+
+    if not getattr(settings, 'CELERY_BROKER_URL', None):
+        update_municipality_score(municipality, country)
+        return
+
+    key = score_recompute_key(municipality.id, country.id if country else None)
+    # cache.add chỉ thành công với yêu cầu đầu tiên trong cửa sổ
+    if not cache.add(key, True, timeout=SCORE_RECOMPUTE_DEBOUNCE * 6):
+        return
+
+    try:
+        recompute_municipality_score.apply_async(
+            args=(municipality.id, country.id if country else None),
+            countdown=SCORE_RECOMPUTE_DEBOUNCE,
+        )
+    except Exception as e:
+        # Broker không truy cập được: tính lại ngay
+        print(f'Could not schedule score recompute, running inline: {e}')
+        cache.delete(key)
+        update_municipality_score(municipality, country)
+
+
+@shared_task
+def recompute_municipality_score(municipality_id, country_id):
+    """Tác vụ tính lại avg_score/final_score cho một (municipality, country)."""
+    from chamu.views import update_municipality_score
+
+    # Xóa khóa trước khi tính, để đánh giá đến trong lúc tính sẽ lên lịch lần tiếp theo
+    cache.delete(score_recompute_key(municipality_id, country_id))
+
+    municipality = Municipality.objects.filter(id=municipality_id).first()
+    if municipality is None:
+        return
+    country = Country.objects.filter(id=country_id).first() if country_id else None
+    update_municipality_score(municipality, country)
+
+
+@shared_task
+def refresh_municipality_profile_task(municipality_id):
+    """Tác vụ làm mới profile Wikipedia của một municipality."""
+    from chamu.wiki import run_profile_refresh
+
+    run_profile_refresh(municipality_id)
+
+
+def schedule_score_store_publish():
+    """
+    Publish a new generation of the shared score store (chamu.score_store), debounced:
+    every score write inside the window ends up in the same generation.
+    No-op without SCORE_STORE_DIR; without a broker the publish runs synchronously.
+    """
+    from chamu.score_store import get_score_store, publish_score_store
+
+    if get_score_store() is None:
+        return
+
+    if not getattr(settings, 'CELERY_BROKER_URL', None):
+        publish_score_store()
+        return
+
+    if not cache.add(SCORE_STORE_PUBLISH_KEY, True, timeout=SCORE_STORE_PUBLISH_DEBOUNCE * 6):
+        return
+
+    try:
+        publish_score_store_task.apply_async(countdown=SCORE_STORE_PUBLISH_DEBOUNCE)
+    except Exception as e:
+        print(f'Could not schedule score store publish, running inline: {e}')
+        cache.delete(SCORE_STORE_PUBLISH_KEY)
+        publish_score_store()
+
+
+@shared_task
+def publish_score_store_task():
+    """Tác vụ xuất bản thế hệ mới của score store dùng chung."""
+    from chamu.score_store import publish_score_store
+
+    cache.delete(SCORE_STORE_PUBLISH_KEY)
+    publish_score_store()
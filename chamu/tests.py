@@ -1,3 +1,1331 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import os
+import random
+import shutil
+import threading
+import tempfile
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+import numpy as np
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DatabaseSessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db.models import Avg, F
+from django.utils import timezone
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .matching import (
+    SCORES_VERSION, ScoreMatrix, country_scores_version, decode_results_token, encode_results_token,
+    get_effective_scores, get_score_matrix, invalidate_score_matrix, preferences_hash, ranking_cache,
+)
+from .forms import MatchInfoForm
+from .reference_cache import REFERENCE_VERSION, get_reference_data
+from .reference_data import bulk_load
+from .sessions.cache import SessionStore as CacheSessionStore
+from .score_store import ScoreStore, publish_score_store
+from .snapshot import export_score_snapshot, load_score_snapshot
+from .spatial import COORDINATES_VERSION, KDTree, to_unit_vectors
+from .versions import get_version, request_versions
+from .tasks import recompute_municipality_score, schedule_score_recompute
+from . import matching, normalization, snapshot, wiki
+from .models import (
+    Country, Criteria, DataVersion, EvaluationSurvey, Municipality, MunicipalityBaseScore, MunicipalityProfile, MunicipalityScore,
+    Prefecture, ScoreImportLedger, UserInfo,
+)
+from .management.commands.import_scores import normalize_array, normalize_score, parse_score_files
+from .views import (
+    apply_evaluation_deltas, calculate_matching_percentage, calculate_municipality_matching_scores,
+    calculate_nationwide_top_matches, update_municipality_score,
+)
+
+
+def loop_matching_scores(user_preferences, country, target_prefecture_id):
+    """Reference implementation: the original per-municipality Python loop."""
+    criteria_ids = user_preferences.values()
+    criteria_map = {c.id: c for c in Criteria.objects.filter(id__in=criteria_ids)}
+    prefecture_municipalities = Municipality.objects.filter(prefecture_id=target_prefecture_id)
+    scores_map = {
+        (s.municipality_id, s.criteria_id): s
+        for s in MunicipalityScore.objects.filter(
+            criteria__id__in=criteria_ids, municipality__in=prefecture_municipalities, country=country
+        )
+    }
+
+    results = []
+    for municipality in prefecture_municipalities.order_by('name'):
+        total_weighted_score = 0
+        total_weight = 0
+        criteria_details = []
+        for rank_str, criteria_id in user_preferences.items():
+            rank = int(rank_str)
+            criteria = criteria_map.get(criteria_id)
+            if not criteria:
+                continue
+            score_obj = scores_map.get((municipality.id, criteria.id))
+            municipality_score = (score_obj.final_score or score_obj.base_score) if score_obj else 3.0
+            total_weighted_score += municipality_score * rank
+            total_weight += rank
+            criteria_details.append({
+                'criteria_name': criteria.name,
+                'priority': rank,
+                'municipality_score': municipality_score,
+                'weighted_score': municipality_score * rank
+            })
+        matching_score = total_weighted_score / total_weight if total_weight > 0 else 0
+        results.append({
+            'municipality': municipality,
+            'score': round(matching_score, 2),
+            'percentage': calculate_matching_percentage(matching_score),
+            'criteria_details': criteria_details
+        })
+    return sorted(results, key=lambda x: x['score'])
+
+
+class ScoreFixtureMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.country = Country.objects.create(name='Vietnam')
+        cls.other_country = Country.objects.create(name='France')
+        cls.hokkaido = Prefecture.objects.create(name='北海道')
+        cls.tokyo = Prefecture.objects.create(name='東京都')
+        cls.criteria = [
+            Criteria.objects.create(name=name, slug=slug, left_label='Low', right_label='High')
+            for name, slug in [('Cost of Living', 'cost'), ('Crime Index', 'crime'), ('Temperature', 'temp')]
+        ]
+
+        municipalities = []
+        for i, name in enumerate(['札幌市', '函館市', '小樽市', '旭川市', '室蘭市', '釧路市']):
+            municipalities.append(Municipality.objects.create(name=name, prefecture=cls.hokkaido))
+        for name in ['新宿区', '渋谷区']:
+            municipalities.append(Municipality.objects.create(name=name, prefecture=cls.tokyo))
+        cls.municipalities = municipalities
+
+        scores = []
+        for i, municipality in enumerate(municipalities):
+            for j, criteria in enumerate(cls.criteria):
+                scores.append(MunicipalityScore(
+                    municipality=municipality, country=cls.other_country, criteria=criteria,
+                    base_score=5.0, avg_score=3.0, final_score=5.0,
+                ))
+                if (i + j) % 5 == 4:
+                    continue  # thiếu dữ liệu -> điểm mặc định 3.0
+                base = 1 + ((i * 7 + j * 3) % 9) / 2
+                final = 0 if (i + j) % 3 == 0 else base * 0.6 + (1 + (i + j) % 5) * 0.4
+                scores.append(MunicipalityScore(
+                    municipality=municipality, country=cls.country, criteria=criteria,
+                    base_score=base, avg_score=3.0, final_score=final,
+                ))
+        MunicipalityScore.objects.bulk_create(scores)
+
+    def setUp(self):
+        invalidate_score_matrix()
+
+
+class MatchingEngineTests(ScoreFixtureMixin, TestCase):
+    def preferences(self):
+        # Giống dữ liệu session sau khi serialize JSON: key là chuỗi
+        return {str(rank): c.id for rank, c in enumerate(reversed(self.criteria), start=1)}
+
+    def test_matches_loop_scores_and_order(self):
+        for prefecture in (self.hokkaido, self.tokyo):
+            expected = loop_matching_scores(self.preferences(), self.country, prefecture.id)
+            actual = calculate_municipality_matching_scores(self.preferences(), self.country, prefecture.id)
+            self.assertEqual(
+                [(r['municipality'].id, r['score'], r['percentage']) for r in actual],
+                [(r['municipality'].id, r['score'], r['percentage']) for r in expected],
+            )
+            self.assertEqual(
+                [r['criteria_details'] for r in actual],
+                [r['criteria_details'] for r in expected],
+            )
+
+    def test_partial_preferences_and_unknown_criteria(self):
+        preferences = {'1': self.criteria[1].id, '2': 999999}
+        expected = loop_matching_scores(preferences, self.country, self.hokkaido.id)
+        actual = calculate_municipality_matching_scores(preferences, self.country, self.hokkaido.id)
+        self.assertEqual(
+            [(r['municipality'].id, r['score']) for r in actual],
+            [(r['municipality'].id, r['score']) for r in expected],
+        )
+
+    def test_scores_are_per_country(self):
+        actual = calculate_municipality_matching_scores(self.preferences(), self.other_country, self.tokyo.id)
+        self.assertTrue(all(r['score'] == 5.0 for r in actual))
+
+
+class NationwideTopKTests(ScoreFixtureMixin, TestCase):
+    def preferences(self):
+        return {str(rank): c.id for rank, c in enumerate(self.criteria, start=1)}
+
+    def full_ranking(self):
+        results = []
+        for prefecture in (self.hokkaido, self.tokyo):
+            results += loop_matching_scores(self.preferences(), self.country, prefecture.id)
+        return sorted(results, key=lambda r: (r['score'], r['municipality'].name))
+
+    def test_top_k_is_head_of_full_ranking(self):
+        expected = self.full_ranking()
+        for k in (1, 3, len(expected), len(expected) + 5):
+            actual = calculate_nationwide_top_matches(self.preferences(), self.country, k)
+            self.assertEqual(
+                [(r['municipality'].id, r['score']) for r in actual],
+                [(r['municipality'].id, r['score']) for r in expected[:k]],
+            )
+
+    def test_top_k_ties_on_the_rounded_score(self):
+        # Cùng điểm làm tròn (2.00): hàng đứng trước theo tên thắng, dù điểm thô cao hơn
+        matrix = ScoreMatrix(
+            None, np.array([10, 11, 12]), np.array([1, 1, 1]), np.array([7]),
+            np.array([[2.004], [3.0], [2.001]]),
+        )
+        self.assertEqual(matrix.rank({'1': 7})[0].tolist(), [0, 2, 1])
+        self.assertEqual(matrix.top_k({'1': 7}, 1)[0].tolist(), [0])
+
+        rng = np.random.default_rng(3)
+        matrix.municipality_ids = np.arange(200)
+        matrix.prefecture_ids = np.ones(200, dtype=np.int64)
+        matrix.scores = rng.integers(100, 110, size=(200, 1)) / 50 + rng.uniform(0, 0.004, size=(200, 1))
+        ranked = matrix.rank({'1': 7})[0].tolist()
+        for k in (1, 5, 17, 199, 250):
+            self.assertEqual(matrix.top_k({'1': 7}, k)[0].tolist(), ranked[:k])
+
+    def test_nationwide_view(self):
+        user_info = UserInfo.objects.create(name='An', country=self.country)
+        session = self.client.session
+        session[f'preferences_{user_info.id}'] = self.preferences()
+        session.save()
+
+        response = self.client.get(
+            reverse('matching_results_nationwide', kwargs={'user_info_id': user_info.id}), {'k': 3}, follow=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['matching_results']), 3)
+        self.assertTrue(response.context['nationwide'])
+
+
+class RankingCacheTests(ScoreFixtureMixin, TestCase):
+    def test_preferences_hash_is_canonical(self):
+        self.assertEqual(preferences_hash({1: 3, 2: 5}), preferences_hash({'2': 5, '1': 3}))
+        self.assertNotEqual(preferences_hash({1: 3, 2: 5}), preferences_hash({1: 5, 2: 3}))
+
+    def test_hit_miss_and_invalidation(self):
+        preferences = {'1': self.criteria[0].id, '2': self.criteria[1].id}
+        before = ranking_cache.stats()
+
+        first = calculate_municipality_matching_scores(preferences, self.country, self.hokkaido.id)
+        # Chỉ đọc bộ đếm 'scores' và bộ đếm điểm của quốc gia (một truy vấn)
+        with self.assertNumQueries(1):
+            second = calculate_municipality_matching_scores(preferences, self.country, self.hokkaido.id)
+        self.assertIs(first, second)
+
+        stats = ranking_cache.stats()
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+
+        # Ghi điểm của quốc gia khác không đụng tới kết quả của quốc gia này
+        update_municipality_score(self.municipalities[0], self.other_country)
+        self.assertIs(calculate_municipality_matching_scores(preferences, self.country, self.hokkaido.id), first)
+        other = calculate_municipality_matching_scores(preferences, self.other_country, self.hokkaido.id)
+
+        # Ghi điểm của chính quốc gia này: kết quả được tính lại
+        update_municipality_score(self.municipalities[0], self.country)
+        second = calculate_municipality_matching_scores(preferences, self.country, self.hokkaido.id)
+        self.assertIsNot(second, first)
+        self.assertIs(calculate_municipality_matching_scores(preferences, self.country, self.hokkaido.id), second)
+        self.assertIs(calculate_municipality_matching_scores(preferences, self.other_country, self.hokkaido.id), other)
+
+    def test_writes_from_another_process_reach_cached_rankings(self):
+        preferences = {'1': self.criteria[0].id}
+        first = calculate_municipality_matching_scores(preferences, self.country, self.hokkaido.id)
+        municipality = first[0]['municipality']
+        self.assertLess(first[0]['score'], 5.0)
+
+        # Lệnh import / Celery worker: ghi điểm và tăng bộ đếm, không đụng tới cache của process này
+        MunicipalityScore.objects.update_or_create(
+            municipality=municipality, country=self.country, criteria=self.criteria[0],
+            defaults={'base_score': 5.0, 'final_score': 5.0},
+        )
+        DataVersion.objects.filter(name=country_scores_version(self.country.id)).update(version=F('version') + 1)
+
+        ranking = calculate_municipality_matching_scores(preferences, self.country, self.hokkaido.id)
+        scores = {result['municipality'].id: result['score'] for result in ranking}
+        self.assertEqual(scores[municipality.id], 5.0)
+        self.assertNotEqual(ranking[0]['municipality'].id, municipality.id)
+
+
+class IncrementalScoreAggregationTests(ScoreFixtureMixin, TestCase):
+    def submit(self, user_info, scores):
+        data = {'form-TOTAL_FORMS': len(scores), 'form-INITIAL_FORMS': 0}
+        for i, score in enumerate(scores):
+            data[f'form-{i}-score'] = score
+        url = reverse('evaluation_survey', kwargs={'user_info_id': user_info.id})
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+
+    def assert_scores_match_history(self, municipality, country=None):
+        country = country or self.country
+        for score_obj in MunicipalityScore.objects.filter(municipality=municipality, country=country):
+            history = EvaluationSurvey.objects.filter(
+                municipality=municipality, criteria=score_obj.criteria, country=country
+            )
+            expected_avg = history.aggregate(Avg('score'))['score__avg'] or 3.0
+            self.assertEqual(score_obj.eval_count, history.count())
+            self.assertAlmostEqual(score_obj.avg_score, expected_avg)
+            self.assertAlmostEqual(score_obj.final_score, score_obj.base_score * 0.6 + expected_avg * 0.4)
+
+    def test_submissions_and_resubmission(self):
+        municipality = self.municipalities[1]
+        alice = UserInfo.objects.create(name='Alice', country=self.country, municipality=municipality)
+        bob = UserInfo.objects.create(name='Bob', country=self.country, municipality=municipality)
+
+        self.submit(alice, [5, 4, 1])
+        self.submit(bob, [1, 2, 3])
+        self.assert_scores_match_history(municipality)
+
+        # Gửi lại: đánh giá cũ của Alice phải được trừ ra
+        self.submit(alice, [2, 2, 2])
+        self.assertEqual(EvaluationSurvey.objects.filter(user=alice).count(), 3)
+        self.assert_scores_match_history(municipality)
+
+    def test_resubmission_after_changing_country(self):
+        municipality = self.municipalities[1]
+        alice = UserInfo.objects.create(name='Alice', country=self.country, municipality=municipality)
+        self.submit(alice, [5, 4, 1])
+
+        # Đổi quốc gia (MatchInfoForm / EvaluateInfoForm) rồi gửi lại
+        alice.country = self.other_country
+        alice.save()
+        self.submit(alice, [2, 2, 2])
+
+        old_overlays = MunicipalityScore.objects.filter(municipality=municipality, country=self.country)
+        self.assertEqual(list(old_overlays.values_list('eval_count', 'eval_sum').distinct()), [(0, 0.0)])
+        self.assert_scores_match_history(municipality)
+        self.assert_scores_match_history(municipality, self.other_country)
+        self.assertEqual(
+            sorted(MunicipalityScore.objects.filter(municipality=municipality, country=self.other_country)
+                   .values_list('eval_count', flat=True)),
+            [1, 1, 1],
+        )
+
+    def test_counters_never_go_negative(self):
+        municipality = self.municipalities[1]
+        apply_evaluation_deltas(municipality, self.country.id, {self.criteria[0].id: (-1, -4.0)})
+        score_obj = MunicipalityScore.objects.get(municipality=municipality, country=self.country, criteria=self.criteria[0])
+        self.assertEqual((score_obj.eval_count, score_obj.eval_sum), (0, 0.0))
+
+    def test_update_does_not_aggregate_history(self):
+        # Một UPDATE điểm và một lần tăng bộ đếm điểm của quốc gia
+        get_version(country_scores_version(self.country.id))
+        with self.assertNumQueries(2):
+            update_municipality_score(self.municipalities[0], self.country)
+
+
+class ScoreRecomputeTaskTests(ScoreFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_without_broker_runs_synchronously(self):
+        MunicipalityScore.objects.filter(municipality=self.municipalities[0]).update(eval_count=1, eval_sum=5.0)
+        with mock.patch.object(recompute_municipality_score, 'apply_async') as apply_async:
+            schedule_score_recompute(self.municipalities[0], self.country)
+        apply_async.assert_not_called()
+        score_obj = MunicipalityScore.objects.filter(municipality=self.municipalities[0], country=self.country).first()
+        self.assertEqual(score_obj.avg_score, 5.0)
+
+    @override_settings(CELERY_BROKER_URL='memory://')
+    def test_recomputes_are_coalesced_per_municipality_and_country(self):
+        with mock.patch.object(recompute_municipality_score, 'apply_async') as apply_async:
+            for _ in range(10):
+                schedule_score_recompute(self.municipalities[0], self.country)
+            schedule_score_recompute(self.municipalities[0], self.other_country)
+            self.assertEqual(apply_async.call_count, 2)
+
+            # Sau khi tác vụ chạy, lần đánh giá tiếp theo lại được lên lịch
+            recompute_municipality_score(self.municipalities[0].id, self.country.id)
+            schedule_score_recompute(self.municipalities[0], self.country)
+            self.assertEqual(apply_async.call_count, 3)
+
+    def test_worker_writes_reach_the_web_process_matrix(self):
+        municipality = self.municipalities[0]
+        matrix = get_score_matrix(self.country.id)
+        row = matrix.municipality_index[municipality.id]
+        col = matrix.criteria_index[self.criteria[1].id]
+
+        # Ghi của Celery worker (process khác): chỉ có điểm và bộ đếm trong database
+        MunicipalityScore.objects.filter(
+            municipality=municipality, country=self.country, criteria=self.criteria[1]
+        ).update(final_score=4.75)
+        DataVersion.objects.filter(name=country_scores_version(self.country.id)).update(version=F('version') + 1)
+
+        rebuilt = get_score_matrix(self.country.id)
+        self.assertIsNot(rebuilt, matrix)
+        self.assertEqual(rebuilt.scores[row, col], 4.75)
+        self.assertIs(get_score_matrix(self.country.id), rebuilt)
+
+
+class RecomputeScoresCommandTests(ScoreFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = UserInfo.objects.create(name='An', country=self.country, municipality=self.municipalities[0])
+        EvaluationSurvey.objects.bulk_create([
+            EvaluationSurvey(user=self.user, municipality=self.municipalities[0], criteria=self.criteria[0],
+                             country=self.country, score=5),
+            EvaluationSurvey(user=self.user, municipality=self.municipalities[6], criteria=self.criteria[0],
+                             country=self.country, score=1),
+        ])
+
+    def score_obj(self, municipality):
+        return MunicipalityScore.objects.get(municipality=municipality, country=self.country, criteria=self.criteria[0])
+
+    def test_dry_run_does_not_write(self):
+        out = StringIO()
+        call_command('recompute_scores', '--dry-run', stdout=out)
+        self.assertIn('[dry-run] Processed 44 rows', out.getvalue())
+        self.assertEqual(self.score_obj(self.municipalities[0]).eval_count, 0)
+
+    def test_rebuilds_aggregates_with_filters(self):
+        call_command('recompute_scores', '--prefecture', self.hokkaido.name, '--batch-size', 1, stdout=StringIO())
+        score_obj = self.score_obj(self.municipalities[0])
+        self.assertEqual((score_obj.eval_count, score_obj.eval_sum, score_obj.avg_score), (1, 5.0, 5.0))
+        self.assertAlmostEqual(score_obj.final_score, score_obj.base_score * 0.6 + 2.0)
+        # Tokyo không thuộc phạm vi --prefecture
+        self.assertEqual(self.score_obj(self.municipalities[6]).eval_count, 0)
+
+        call_command('recompute_scores', '--country', self.country.name, stdout=StringIO())
+        self.assertEqual(self.score_obj(self.municipalities[6]).avg_score, 1.0)
+
+
+class SpatialIndexTests(TestCase):
+    def test_kdtree_matches_brute_force(self):
+        rng = random.Random(7)
+        latitudes = [rng.uniform(24, 46) for _ in range(500)]
+        longitudes = [rng.uniform(122, 154) for _ in range(500)]
+        points = to_unit_vectors(latitudes, longitudes)
+        tree = KDTree(points)
+        for _ in range(200):
+            query = to_unit_vectors([rng.uniform(20, 50)], [rng.uniform(120, 156)])[0]
+            brute_force = int(((points - query) ** 2).sum(axis=1).argmin())
+            self.assertEqual(tree.nearest(query), brute_force)
+
+    def test_location_by_coords_follows_coordinate_updates(self):
+        prefecture = Prefecture.objects.create(name='東京都')
+        shinjuku = Municipality.objects.create(name='新宿区', prefecture=prefecture, latitude=35.6938, longitude=139.7034)
+        Municipality.objects.create(name='八王子市', prefecture=prefecture, latitude=35.6664, longitude=139.3160)
+        Municipality.objects.create(name='檜原村', prefecture=prefecture)
+
+        response = self.client.get('/api/location_by_coords/', {'lat': 35.70, 'lng': 139.70})
+        self.assertEqual(response.json()['municipality_id'], shinjuku.id)
+        self.assertLess(response.json()['distance_km'], 1)
+
+        shinjuku.latitude, shinjuku.longitude = 43.0, 141.3
+        shinjuku.save()
+        response = self.client.get('/api/location_by_coords/', {'lat': 35.70, 'lng': 139.70})
+        self.assertEqual(response.json()['municipality_name'], '八王子市')
+
+    def test_coordinate_updates_from_another_process(self):
+        prefecture = Prefecture.objects.create(name='東京都')
+        shinjuku = Municipality.objects.create(name='新宿区', prefecture=prefecture, latitude=35.6938, longitude=139.7034)
+        Municipality.objects.create(name='八王子市', prefecture=prefecture, latitude=35.6664, longitude=139.3160)
+        response = self.client.get('/api/location_by_coords/', {'lat': 35.70, 'lng': 139.70})
+        self.assertEqual(response.json()['municipality_id'], shinjuku.id)
+
+        # Như update_coordinates chạy trong process khác: không có signal ở process này,
+        # chỉ có bộ đếm trong database
+        Municipality.objects.filter(id=shinjuku.id).update(latitude=43.0, longitude=141.3)
+        DataVersion.objects.filter(name=COORDINATES_VERSION).update(version=F('version') + 1)
+        response = self.client.get('/api/location_by_coords/', {'lat': 35.70, 'lng': 139.70})
+        self.assertEqual(response.json()['municipality_name'], '八王子市')
+
+
+class PrefectureCentroidTests(TestCase):
+    def setUp(self):
+        self.tokyo = Prefecture.objects.create(name='東京都')
+        self.empty = Prefecture.objects.create(name='沖縄県')
+        Municipality.objects.create(name='新宿区', prefecture=self.tokyo, latitude=35.0, longitude=139.0)
+        Municipality.objects.create(name='八王子市', prefecture=self.tokyo, latitude=36.0, longitude=140.0)
+        Municipality.objects.create(name='檜原村', prefecture=self.tokyo)
+        Prefecture.refresh_centroids()
+
+    def test_refresh_centroids(self):
+        self.tokyo.refresh_from_db()
+        self.assertEqual((self.tokyo.latitude, self.tokyo.longitude), (35.5, 139.5))
+        self.assertEqual((self.tokyo.min_latitude, self.tokyo.max_longitude), (35.0, 140.0))
+
+    def test_endpoints_read_stored_centroids(self):
+        # Lần đầu đọc bộ đếm phiên bản và cả ba bảng tham chiếu, sau đó chỉ còn bộ đếm
+        with self.assertNumQueries(4):
+            data = self.client.get('/api/prefectures/').json()
+        self.assertEqual(data[0]['latitude'], 35.5)
+        self.assertIsNone(data[1]['latitude'])
+
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/prefecture_coords/', {'prefecture_id': self.tokyo.id}).json()
+        self.assertEqual(data['bounds'], [[35.0, 139.0], [36.0, 140.0]])
+
+        response = self.client.get('/api/prefecture_coords/', {'prefecture_id': self.empty.id})
+        self.assertEqual(response.status_code, 404)
+
+
+class WikiProfileStoreTests(TestCase):
+    def setUp(self):
+        self.municipality = Municipality.objects.create(
+            name='札幌市', prefecture=Prefecture.objects.create(name='北海道')
+        )
+
+    async def test_first_fetch_is_stored_and_reused(self):
+        fetched = ('Sapporo', 'https://img/sapporo.jpg', 'https://ja.wikipedia.org/wiki/札幌市', 'ok')
+        with mock.patch.object(wiki, 'afetch_wiki_profile', new=mock.AsyncMock(return_value=fetched)) as fetch:
+            self.assertEqual((await wiki.aget_municipality_profile(self.municipality))[:3], fetched[:3])
+            self.assertEqual((await wiki.aget_municipality_profile(self.municipality))[:3], fetched[:3])
+        fetch.assert_awaited_once_with('札幌市', '北海道')
+
+    async def test_stale_profile_is_served_while_refreshing(self):
+        await MunicipalityProfile.objects.acreate(
+            municipality=self.municipality, description='old', image_url='', wiki_url=None,
+            status=MunicipalityProfile.STATUS_OK, fetched_at=timezone.now() - timedelta(days=30),
+        )
+        with mock.patch.object(wiki, 'schedule_profile_refresh') as schedule, \
+                mock.patch.object(wiki, 'afetch_wiki_profile', new=mock.AsyncMock()) as fetch:
+            description, image_url, _, _ = await wiki.aget_municipality_profile(self.municipality)
+        self.assertEqual((description, image_url), ('old', wiki.PLACEHOLDER_IMAGE_URL))
+        schedule.assert_called_once_with(self.municipality.id)
+        fetch.assert_not_awaited()
+
+    def test_background_refresh_uses_the_async_fetch(self):
+        fetched = ('Sapporo', 'https://img/sapporo.jpg', None, MunicipalityProfile.STATUS_OK)
+        with mock.patch.object(wiki, 'afetch_wiki_profile', new=mock.AsyncMock(return_value=fetched)) as fetch, \
+                mock.patch.object(wiki, 'close_old_connections'):
+            wiki.run_profile_refresh(self.municipality.id)
+        fetch.assert_awaited_once_with('札幌市', '北海道')
+        self.assertEqual(MunicipalityProfile.objects.get(municipality=self.municipality).description, 'Sapporo')
+
+    def test_negative_results_use_shorter_ttl(self):
+        fetched_at = timezone.now() - timedelta(days=1)
+        negative = MunicipalityProfile(status=MunicipalityProfile.STATUS_DISAMBIGUATION, fetched_at=fetched_at)
+        positive = MunicipalityProfile(status=MunicipalityProfile.STATUS_OK, fetched_at=fetched_at)
+        self.assertTrue(wiki.profile_is_stale(negative))
+        self.assertFalse(wiki.profile_is_stale(positive))
+
+    async def test_network_error_keeps_existing_profile(self):
+        profile = await MunicipalityProfile.objects.acreate(
+            municipality=self.municipality, description='old', status=MunicipalityProfile.STATUS_OK,
+            fetched_at=timezone.now() - timedelta(days=30),
+        )
+        with mock.patch.object(wiki, 'afetch_wiki_profile', new=mock.AsyncMock(side_effect=ConnectionError)):
+            self.assertEqual((await wiki.arefresh_municipality_profile(self.municipality)).description, 'old')
+        await profile.arefresh_from_db()
+        self.assertEqual(profile.description, 'old')
+
+
+class StubWikipediaHandler(BaseHTTPRequestHandler):
+    """Local stand-in for ja.wikipedia.org/w/api.php."""
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        time.sleep(0.1)
+        params = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+        if params['prop'] == 'pageimages':
+            pages = {'1': {'title': '札幌市', 'thumbnail': {'source': 'https://img/sapporo.jpg'}}}
+            query = {'pages': pages}
+        else:
+            query = {
+                'normalized': [],
+                'pages': {
+                    '-1': {'title': '札幌市 (北海道)', 'missing': ''},
+                    '1': {'title': '札幌市', 'extract': '札幌市は北海道の市。', 'fullurl': 'https://ja.wikipedia.org/wiki/札幌市'},
+                },
+            }
+        body = json.dumps({'query': query}).encode('utf-8')
+        with cls.lock:
+            cls.active -= 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class WikiHttpFetchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubWikipediaHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.api_url = f'http://127.0.0.1:{cls.server.server_port}/w/api.php'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    async def test_async_fetch_runs_lookups_together(self):
+        StubWikipediaHandler.max_active = 0
+        with self.settings(WIKIPEDIA_API_URL=self.api_url), \
+                mock.patch.object(wiki, 'async_http_client', wiki.AsyncHttpClient(max_per_host=4, timeout=2)):
+            fetched = await wiki.afetch_wiki_profile('札幌市', '北海道')
+        self.assertEqual(fetched, (
+            '札幌市は北海道の市。', 'https://img/sapporo.jpg', 'https://ja.wikipedia.org/wiki/札幌市',
+            MunicipalityProfile.STATUS_OK,
+        ))
+        self.assertEqual(StubWikipediaHandler.max_active, 2)
+
+    async def test_async_per_host_cap(self):
+        StubWikipediaHandler.max_active = 0
+        client = wiki.AsyncHttpClient(max_per_host=1, timeout=2)
+        await asyncio.gather(*(client.get_json(self.api_url, {'prop': 'pageimages'}) for _ in range(3)))
+        self.assertEqual(StubWikipediaHandler.max_active, 1)
+
+    async def test_async_image_lookup_survives_network_errors(self):
+        client = wiki.AsyncHttpClient(max_per_host=1, timeout=2)
+        with mock.patch.object(wiki, 'async_http_client', client), mock.patch('builtins.print'):
+            self.assertIsNone(await wiki.aget_municipality_image('http://127.0.0.1:1/w/api.php', '札幌市'))
+
+
+class ImportScoresCommandTests(TestCase):
+    def setUp(self):
+        self.countries = [Country.objects.create(name=name) for name in ('Vietnam', 'France', 'Brazil')]
+        self.criteria = Criteria.objects.create(name='価格', slug='price', left_label='低い', right_label='高い')
+        self.scores_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.scores_dir)
+
+    def write_scores(self, rows):
+        with open(os.path.join(self.scores_dir, '価格.csv'), 'w', encoding='utf-8-sig') as file:
+            file.write(',,,,rank\n')
+            for i, (prefecture, municipality, raw) in enumerate(rows, start=1):
+                file.write(f'{i},{prefecture},{municipality},{raw}\n')
+
+    def base_scores(self):
+        return dict(MunicipalityBaseScore.objects.values_list('municipality__name', 'base_score'))
+
+    def test_streams_batches_and_upserts_on_reimport(self):
+        self.write_scores([('北海道', '札幌市', 10), ('北海道', '函館市', 20), ('東京都', '新宿区', 30)])
+        call_command('import_scores', self.scores_dir, '--batch-size', 2, stdout=StringIO(), stderr=StringIO())
+        # Điểm trung lập được lưu một lần, không nhân bản theo quốc gia
+        self.assertEqual(MunicipalityBaseScore.objects.count(), 3)
+        self.assertEqual(MunicipalityScore.objects.count(), 0)
+        self.assertEqual(self.base_scores(), {'札幌市': 1.0, '函館市': 3.0, '新宿区': 5.0})
+        self.assertEqual(Municipality.objects.get(name='新宿区').prefecture.name, '東京都')
+
+        # Nhập lại với dữ liệu mới: base_score phải được cập nhật, không bị bỏ qua
+        self.write_scores([('北海道', '札幌市', 30), ('北海道', '函館市', 20), ('東京都', '新宿区', 10)])
+        call_command('import_scores', self.scores_dir, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(MunicipalityBaseScore.objects.count(), 3)
+        self.assertEqual(self.base_scores(), {'札幌市': 5.0, '函館市': 3.0, '新宿区': 1.0})
+
+    def test_skips_unchanged_files_unless_forced(self):
+        self.write_scores([('北海道', '札幌市', 10), ('北海道', '函館市', 20), ('東京都', '新宿区', 30)])
+        call_command('import_scores', self.scores_dir, stdout=StringIO(), stderr=StringIO())
+        ledger = ScoreImportLedger.objects.get(file_name='価格.csv')
+        self.assertEqual((ledger.min_value, ledger.max_value, ledger.row_count), (10, 30, 3))
+
+        # Giá trị bị sửa trực tiếp trong DB: file không đổi nên không bị ghi đè
+        MunicipalityBaseScore.objects.filter(municipality__name='札幌市').update(base_score=2.0)
+        stdout = StringIO()
+        call_command('import_scores', self.scores_dir, stdout=stdout, stderr=StringIO())
+        self.assertIn('bỏ qua 1 file không đổi', stdout.getvalue())
+        self.assertEqual(self.base_scores()['札幌市'], 2.0)
+
+        call_command('import_scores', self.scores_dir, '--force', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(self.base_scores()['札幌市'], 1.0)
+
+        # Chỉ dòng thay đổi được ghi lại (min/max giữ nguyên)
+        self.write_scores([('北海道', '札幌市', 10), ('北海道', '函館市', 25), ('東京都', '新宿区', 30)])
+        stdout = StringIO()
+        call_command('import_scores', self.scores_dir, stdout=stdout, stderr=StringIO())
+        self.assertIn('Đã ghi 1 bản ghi', stdout.getvalue())
+        self.assertEqual(self.base_scores(), {'札幌市': 1.0, '函館市': 4.0, '新宿区': 5.0})
+
+    def test_vectorized_normalization_matches_scalar(self):
+        raw_scores = [random.uniform(-50, 500) for _ in range(500)] + [0.0, 500.0]
+        for is_reverse in (False, True):
+            expected = [normalize_score(raw, min(raw_scores), max(raw_scores), is_reverse) for raw in raw_scores]
+            for value, expected_value in zip(normalize_array(raw_scores, is_reverse).tolist(), expected):
+                self.assertAlmostEqual(value, expected_value, places=9)
+        self.assertEqual(normalize_array([7.0, 7.0]).tolist(), [3.0, 3.0])
+
+    def test_criteria_strategy_is_used_and_tracked_by_the_ledger(self):
+        self.write_scores([('北海道', '札幌市', 1000), ('北海道', '函館市', 20), ('東京都', '新宿区', 10)])
+        call_command('import_scores', self.scores_dir, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(self.base_scores(), {'札幌市': 5.0, '函館市': 1.04, '新宿区': 1.0})
+
+        # Đổi chiến lược: file không đổi nhưng vẫn phải nhập lại
+        Criteria.objects.filter(pk=self.criteria.pk).update(normalization=normalization.RANK)
+        call_command('import_scores', self.scores_dir, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(self.base_scores(), {'札幌市': 5.0, '函館市': 3.0, '新宿区': 1.0})
+        self.assertEqual(ScoreImportLedger.objects.get(file_name='価格.csv').normalization, normalization.RANK)
+
+    def test_wide_file_imports_country_columns(self):
+        with open(os.path.join(self.scores_dir, '価格.csv'), 'w', encoding='utf-8-sig') as file:
+            file.write('Number,都道府県,市区町村,件数,URL,Vietnam,France,Japan\n')
+            file.write('1,北海道,札幌市,10,u,1,8,x\n')
+            file.write('2,北海道,函館市,20,u,3,,x\n')
+            file.write('3,東京都,新宿区,30,u,5,2\n')
+        stdout = StringIO()
+        call_command('import_scores', self.scores_dir, stdout=stdout, stderr=StringIO())
+        vietnam, france, brazil = self.countries
+
+        self.assertEqual(self.base_scores(), {'札幌市': 1.0, '函館市': 3.0, '新宿区': 5.0})
+        overlays = {
+            (name, country): base
+            for name, country, base in MunicipalityScore.objects.values_list(
+                'municipality__name', 'country__name', 'base_score'
+            )
+        }
+        self.assertEqual(overlays, {
+            ('札幌市', 'Vietnam'): 1.0, ('函館市', 'Vietnam'): 3.0, ('新宿区', 'Vietnam'): 5.0,
+            ('札幌市', 'France'): 5.0, ('新宿区', 'France'): 1.0,
+        })
+        # Ô trống: France dùng điểm trung lập cho 函館市
+        hakodate = Municipality.objects.get(name='函館市')
+        self.assertEqual(get_effective_scores(hakodate.id, france.id), {self.criteria.id: 3.0})
+        self.assertEqual(get_effective_scores(hakodate.id, brazil.id), {self.criteria.id: 3.0})
+        self.assertEqual(
+            get_effective_scores(Municipality.objects.get(name='新宿区').id, france.id),
+            {self.criteria.id: 1.0 * 0.6 + 3.0 * 0.4},
+        )
+        self.assertIn('5 điểm riêng cho 2 quốc gia', stdout.getvalue())
+
+    def test_country_column_without_numbers_is_skipped(self):
+        # Giống file 選択した国の飲食店.csv: cột 6 chỉ là danh sách tên quốc gia
+        with open(os.path.join(self.scores_dir, '価格.csv'), 'w', encoding='utf-8-sig') as file:
+            file.write('Number,都道府県,市区町村,件数,URL,,Vietnam\n')
+            file.write('1,北海道,札幌市,10,u,5,France\n2,北海道,函館市,20,u,1,Brazil\n')
+        stdout = StringIO()
+        call_command('import_scores', self.scores_dir, stdout=stdout, stderr=StringIO())
+        self.assertIn('Cột quốc gia "Vietnam" không có điểm hợp lệ', stdout.getvalue())
+        self.assertEqual(MunicipalityScore.objects.count(), 0)
+        self.assertEqual(self.base_scores(), {'札幌市': 1.0, '函館市': 5.0})
+
+    def test_parallel_parsing_matches_serial(self):
+        self.write_scores([('北海道', '札幌市', 10), ('北海道', '函館市', 20), ('東京都', '新宿区', 30)])
+        with open(os.path.join(self.scores_dir, '安全面.csv'), 'w', encoding='utf-8') as file:
+            file.write('1,北海道,札幌市,3\n2,北海道,函館市,abc\n3,東京都,新宿区,1\n')
+        jobs = [(os.path.join(self.scores_dir, name), True) for name in ('価格.csv', '安全面.csv')]
+
+        serial = list(parse_score_files(jobs, workers=1))
+        parallel = list(parse_score_files(jobs, workers=2))
+        for (_, expected, _), (_, parsed, error) in zip(serial, parallel):
+            self.assertIsNone(error)
+            self.assertEqual(parsed.rows, expected.rows)
+            self.assertEqual(parsed.normalized_scores.tolist(), expected.normalized_scores.tolist())
+        self.assertEqual(parallel[0][1].normalized_scores.tolist(), [5.0, 3.0, 1.0])
+        self.assertEqual(len(parallel[1][1]), 2)
+        self.assertEqual(len(parallel[1][1].warnings), 1)
+
+    def test_overlays_resolve_against_neutral_base(self):
+        self.write_scores([('北海道', '札幌市', 10), ('北海道', '函館市', 20), ('東京都', '新宿区', 30)])
+        call_command('import_scores', self.scores_dir, stdout=StringIO(), stderr=StringIO())
+        sapporo = Municipality.objects.get(name='札幌市')
+        vietnam, france, brazil = self.countries
+
+        # Overlay chỉ có đánh giá: base_score lấy từ điểm trung lập
+        MunicipalityScore.objects.create(
+            municipality=sapporo, country=vietnam, criteria=self.criteria, eval_count=1, eval_sum=5.0
+        )
+        update_municipality_score(sapporo, vietnam)
+        self.assertAlmostEqual(
+            MunicipalityScore.objects.get(municipality=sapporo, country=vietnam).final_score, 1.0 * 0.6 + 5.0 * 0.4
+        )
+
+        # Overlay có base_score riêng cho một quốc gia
+        with open(os.path.join(self.scores_dir, '価格.csv'), 'w', encoding='utf-8-sig') as file:
+            file.write('1,北海道,札幌市,30\n2,北海道,函館市,10\n')
+        call_command('import_single_score', os.path.join(self.scores_dir, '価格.csv'), '--country', 'France',
+                     stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(get_effective_scores(sapporo.id, vietnam.id), {self.criteria.id: 1.0 * 0.6 + 5.0 * 0.4})
+        self.assertEqual(get_effective_scores(sapporo.id, france.id), {self.criteria.id: 5.0 * 0.6 + 3.0 * 0.4})
+        self.assertEqual(get_effective_scores(sapporo.id, brazil.id), {self.criteria.id: 1.0 * 0.6 + 3.0 * 0.4})
+
+        matrix = get_score_matrix(brazil.id)
+        row = matrix.municipality_index[sapporo.id]
+        self.assertAlmostEqual(matrix.scores[row, matrix.criteria_index[self.criteria.id]], 1.0 * 0.6 + 3.0 * 0.4)
+
+
+class ReferenceDataImportTests(TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+
+    def write_csv(self, name, lines):
+        path = os.path.join(self.data_dir, name)
+        with open(path, 'w', encoding='utf-8-sig') as file:
+            file.write('\n'.join(lines) + '\n')
+        return path
+
+    def run_command(self, *args):
+        stdout = StringIO()
+        call_command(*args, stdout=stdout, stderr=StringIO())
+        return stdout.getvalue()
+
+    def test_location_verify_then_load(self):
+        path = self.write_csv('location.csv', [
+            'Number,Prefecture,Municipality', '1,北海道,札幌市', '2,北海道,函館市', '3,東京都,新宿区',
+        ])
+        self.run_command('import_location', path)
+        self.assertEqual(Municipality.objects.count(), 3)
+        self.assertEqual(Prefecture.objects.count(), 2)
+
+        path = self.write_csv('location.csv', [
+            'Number,Prefecture,Municipality', '1,北海道,札幌市', '2,青森県,函館市', '3,東京都,新宿区', '4,東京都,渋谷区',
+        ])
+        output = self.run_command('import_location', path, '--verify')
+        self.assertIn('[verify] Prefecture: 1 thêm mới, 0 cập nhật, 2 không đổi', output)
+        self.assertIn('[verify] Municipality: 1 thêm mới, 1 cập nhật, 2 không đổi', output)
+        self.assertEqual(Municipality.objects.count(), 3)
+
+        self.run_command('import_location', path)
+        self.assertEqual(Municipality.objects.count(), 4)
+        self.assertEqual(Municipality.objects.get(name='函館市').prefecture.name, '青森県')
+
+    def test_criteria_get_unique_slugs(self):
+        path = self.write_csv('criteria.csv', [
+            'name,left_label,right_label,is_reverse', '価格,低い,高い', '', '安全面,安全,危険,true',
+        ])
+        self.run_command('import_criteria', path)
+        self.run_command('import_criteria', path)
+        criteria = {c.name: c for c in Criteria.objects.all()}
+        self.assertEqual(set(criteria), {'価格', '安全面'})
+        self.assertNotEqual(criteria['価格'].slug, criteria['安全面'].slug)
+        self.assertTrue(criteria['安全面'].is_reverse)
+
+
+class ReferenceCacheTests(ScoreFixtureMixin, TestCase):
+    def test_pages_need_no_reference_queries(self):
+        user_info = UserInfo.objects.create(name='An', country=self.country)
+        get_reference_data()
+
+        # Trong một request, chỉ còn một truy vấn bộ đếm phiên bản
+        with self.assertNumQueries(1), request_versions():
+            html = MatchInfoForm().as_p()
+            country = MatchInfoForm.base_fields['country'].clean(str(self.country.id))
+        self.assertIn('東京都', html)
+        self.assertEqual(country, self.country)
+
+        # Bộ đếm phiên bản và UserInfo
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('matching_survey', args=[user_info.id, self.tokyo.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [c.name for c in response.context['criteria_list']], ['Cost of Living', 'Crime Index', 'Temperature']
+        )
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('get_prefecture_coords'), {'prefecture_id': self.tokyo.id})
+        self.assertEqual(response.status_code, 404)
+
+    def test_save_and_delete_invalidate(self):
+        get_reference_data()
+        self.country.name = 'Viet Nam'
+        self.country.save()
+        self.assertEqual(get_reference_data().country_map[self.country.id].name, 'Viet Nam')
+
+        field = MatchInfoForm.base_fields['country']
+        Country.objects.create(name='Brazil')
+        self.assertEqual([label for _, label in field.choices][1:], ['Brazil', 'France', 'Viet Nam'])
+
+        self.other_country.delete()
+        with self.assertRaises(ValidationError):
+            field.clean(str(self.other_country.pk))
+
+    def test_imports_from_another_process_are_seen(self):
+        field = MatchInfoForm.base_fields['country']
+        self.assertEqual(len(self.client.get('/api/prefectures/').json()), 2)
+        self.assertNotIn('Brazil', [label for _, label in field.choices])
+
+        # import_country / import_location chạy trong process khác: signal của chúng
+        # chỉ tăng bộ đếm trong database, cache của process này không bị đụng tới
+        Country.objects.bulk_create([Country(name='Brazil')])
+        Prefecture.objects.bulk_create([Prefecture(name='沖縄県')])
+        DataVersion.objects.filter(name=REFERENCE_VERSION).update(version=F('version') + 1)
+
+        self.assertIn('Brazil', [label for _, label in field.choices])
+        self.assertIn('沖縄県', [p['name'] for p in self.client.get('/api/prefectures/').json()])
+
+    def test_bulk_load_invalidates(self):
+        get_reference_data()
+        bulk_load(Prefecture, 'name', {'沖縄県': {}})
+        self.assertIn('沖縄県', [p.name for p in get_reference_data().prefectures])
+
+
+class SharedCacheTests(ScoreFixtureMixin, TestCase):
+    def test_api_responses_are_cached_until_data_changes(self):
+        url = reverse('get_municipalities')
+        get_reference_data()
+        # Bộ đếm phiên bản (một truy vấn mỗi request) và danh sách municipality
+        with self.assertNumQueries(2):
+            first = self.client.get(url, {'prefecture_id': self.tokyo.id}).json()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, {'prefecture_id': self.tokyo.id}).json(), first)
+
+        Municipality.objects.create(name='港区', prefecture=self.tokyo)
+        names = [m['name'] for m in self.client.get(url, {'prefecture_id': self.tokyo.id}).json()]
+        self.assertIn('港区', names)
+
+    def test_results_table_is_rendered_once_per_score_version(self):
+        user_info = UserInfo.objects.create(name='An', country=self.country)
+        session = self.client.session
+        session[f'preferences_{user_info.id}'] = {'1': self.criteria[0].id, '2': self.criteria[2].id}
+        session.save()
+        url = reverse('matching_results_nationwide', kwargs={'user_info_id': user_info.id})
+
+        with mock.patch('chamu.views.calculate_nationwide_top_matches', return_value=[]) as compute:
+            self.client.get(url, {'k': 3}, follow=True)
+            self.client.get(url, {'k': 3}, follow=True)
+            self.assertEqual(compute.call_count, 1)
+
+            # Điểm của quốc gia khác thay đổi: fragment vẫn dùng được
+            invalidate_score_matrix(self.other_country.id)
+            self.client.get(url, {'k': 3}, follow=True)
+            self.assertEqual(compute.call_count, 1)
+
+            invalidate_score_matrix(self.country.id)
+            self.client.get(url, {'k': 3}, follow=True)
+            self.assertEqual(compute.call_count, 2)
+
+    def test_profile_fragment_follows_profile_writes(self):
+        municipality = self.municipalities[0]
+        profile = MunicipalityProfile.objects.create(
+            municipality=municipality, description='Sapporo', image_url='https://img/sapporo.jpg',
+            status=MunicipalityProfile.STATUS_OK, fetched_at=timezone.now(),
+        )
+        user_info = UserInfo.objects.create(name='An', country=self.country)
+        url = reverse('municipality_details', kwargs={'municipality_id': municipality.id})
+        session = self.client.session
+        session['user_info_id'] = user_info.id
+        session.save()
+
+        self.assertContains(self.client.get(url), 'Sapporo')
+        profile.description = 'Sapporo, Hokkaido'
+        profile.save()
+        self.assertContains(self.client.get(url), 'Sapporo, Hokkaido')
+
+
+class ConditionalApiTests(ScoreFixtureMixin, TestCase):
+    def test_etag_revalidation_reads_only_versions(self):
+        url = reverse('get_municipalities')
+        response = self.client.get(url, {'prefecture_id': self.hokkaido.id})
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertIn('max-age=60', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+
+        # Chỉ đọc bộ đếm phiên bản (từ database khi cache không dùng chung)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'prefecture_id': self.hokkaido.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        # Tham số khác -> ETag khác
+        other = self.client.get(url, {'prefecture_id': self.tokyo.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(other.status_code, 200)
+
+    @override_settings(REDIS_URL='redis://localhost:6379/1')
+    def test_revalidation_with_shared_cache_skips_the_database(self):
+        # LocMem đóng vai Redis: bộ đếm được sao vào cache dùng chung
+        cache.clear()
+        self.addCleanup(cache.clear)
+        url = reverse('get_municipalities')
+        etag = self.client.get(url, {'prefecture_id': self.hokkaido.id})['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'prefecture_id': self.hokkaido.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # bump_version sao giá trị mới vào cache khi transaction commit
+        with self.captureOnCommitCallbacks(execute=True):
+            Municipality.objects.create(name='北斗市', prefecture=self.hokkaido)
+        response = self.client.get(url, {'prefecture_id': self.hokkaido.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('北斗市', [m['name'] for m in response.json()])
+
+    def test_etag_changes_with_data_version(self):
+        url = reverse('get_prefectures')
+        etag = self.client.get(url)['ETag']
+        Prefecture.objects.create(name='沖縄県')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('沖縄県', [p['name'] for p in response.json()])
+
+
+class SharedResultsUrlTests(ScoreFixtureMixin, TestCase):
+    def preferences(self):
+        return {'1': self.criteria[2].id, '2': self.criteria[0].id, '3': self.criteria[1].id}
+
+    def test_token_is_canonical_and_compact(self):
+        token = encode_results_token(self.country.id, self.tokyo.id, self.preferences())
+        reordered = {3: self.criteria[1].id, 1: self.criteria[2].id, 2: self.criteria[0].id}
+        self.assertEqual(encode_results_token(self.country.id, self.tokyo.id, reordered), token)
+        self.assertLessEqual(len(token), 16)
+        self.assertRegex(token, r'^[A-Za-z0-9_-]+$')
+
+        country_id, prefecture_id, preferences = decode_results_token(token, len(self.criteria))
+        self.assertEqual((country_id, prefecture_id), (self.country.id, self.tokyo.id))
+        self.assertEqual(preferences, {int(rank): cid for rank, cid in self.preferences().items()})
+        self.assertIsNone(decode_results_token(encode_results_token(None, None, {1: 300}), 3)[1])
+
+        for bad in ('', '!!!', 'AQ', token + 'gA'):
+            with self.assertRaises(ValueError):
+                decode_results_token(bad, len(self.criteria))
+
+    def test_out_of_range_tokens_are_rejected(self):
+        cid = self.criteria[0].id
+        for preferences in (
+            {2 ** 1100: cid},                                # hạng quá lớn (OverflowError khi tính trọng số)
+            {10 ** 6: cid},                                  # hạng lớn hơn số tiêu chí
+            {1: 2 ** 70},                                    # id ngoài phạm vi int64
+            {1: cid, 2: cid},                                # tiêu chí lặp lại
+            {rank: cid + rank for rank in range(1, 5)},      # nhiều cặp hơn số tiêu chí
+        ):
+            token = encode_results_token(self.country.id, None, preferences)
+            with self.assertRaises(ValueError):
+                decode_results_token(token, len(self.criteria))
+            self.assertEqual(self.client.get(reverse('shared_results', args=[token])).status_code, 404)
+
+        token = encode_results_token(2 ** 64, self.hokkaido.id, self.preferences())
+        self.assertEqual(self.client.get(reverse('shared_results', args=[token])).status_code, 404)
+
+    def test_session_route_redirects_to_shared_url(self):
+        user_info = UserInfo.objects.create(name='An', country=self.country)
+        session = self.client.session
+        session[f'preferences_{user_info.id}'] = self.preferences()
+        session.save()
+
+        response = self.client.get(reverse('matching_results', args=[user_info.id, self.hokkaido.id]))
+        token = encode_results_token(self.country.id, self.hokkaido.id, self.preferences())
+        self.assertRedirects(response, reverse('shared_results', args=[token]))
+
+    def test_shared_page_is_cacheable_without_session(self):
+        url = reverse('shared_results', args=[encode_results_token(self.country.id, self.hokkaido.id, self.preferences())])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [r['municipality'].id for r in response.context['matching_results']],
+            [r['municipality'].id for r in calculate_municipality_matching_scores(
+                self.preferences(), self.country, self.hokkaido.id)],
+        )
+        self.assertIn('public', response['Cache-Control'])
+        self.assertNotIn('sessionid', response.cookies)
+
+        with self.assertNumQueries(1):
+            revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_shared_page_varies_on_the_language_cookie(self):
+        url = reverse('shared_results', args=[encode_results_token(self.country.id, self.hokkaido.id, self.preferences())])
+        english = self.client.get(url)
+        self.assertIn('Cookie', english['Vary'])
+        self.assertIn('Accept-Language', english['Vary'])
+
+        self.client.cookies[settings.LANGUAGE_COOKIE_NAME] = 'ja'
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=english['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Language'], 'ja')
+        self.assertNotEqual(response['ETag'], english['ETag'])
+        self.assertIn('Cookie', self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])['Vary'])
+
+    def test_non_canonical_and_invalid_tokens(self):
+        token = encode_results_token(self.country.id, None, self.preferences())
+        # Cùng dữ liệu nhưng varint dài hơn cần thiết (0x81 0x00 = 1)
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        padded = base64.urlsafe_b64encode(b'\x81\x00' + data[1:]).rstrip(b'=').decode('ascii')
+        response = self.client.get(reverse('shared_results', args=[padded]))
+        self.assertRedirects(response, reverse('shared_results', args=[token]), status_code=301)
+
+        self.assertEqual(self.client.get(reverse('shared_results', args=['not-a-token'])).status_code, 404)
+
+
+@override_settings(SESSION_LEGACY_DB_FALLBACK=True)
+class SessionEngineTests(ScoreFixtureMixin, TestCase):
+    def legacy_session(self, data):
+        store = DatabaseSessionStore()
+        store.update(data)
+        store.save()
+        return store.session_key
+
+    def survey_post(self, user_info):
+        form = {f'rank_{rank}': c.id for rank, c in enumerate(self.criteria, start=1)}
+        with mock.patch('builtins.print'):
+            return self.client.post(reverse('matching_survey', args=[user_info.id, self.tokyo.id]), form)
+
+    @override_settings(SESSION_ENGINE='chamu.sessions.cache')
+    def test_cache_sessions_do_not_write_the_session_table(self):
+        user_info = UserInfo.objects.create(name='An', country=self.country)
+        self.assertEqual(self.survey_post(user_info).status_code, 302)
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertIn(f'preferences_{user_info.id}', self.client.session)
+
+    @override_settings(SESSION_ENGINE='chamu.sessions.cache')
+    def test_cache_store_adopts_live_database_session(self):
+        user_info = UserInfo.objects.create(name='An', country=self.country)
+        key = self.legacy_session({'user_info_id': user_info.id})
+        self.client.cookies['sessionid'] = key
+
+        self.survey_post(user_info)
+        adopted = CacheSessionStore(key).load()
+        self.assertEqual(adopted['user_info_id'], user_info.id)
+        self.assertIn(f'preferences_{user_info.id}', adopted)
+
+    @override_settings(SESSION_ENGINE='chamu.sessions.signed_cookies')
+    def test_signed_cookie_store_adopts_live_database_session(self):
+        user_info = UserInfo.objects.create(name='An', country=self.country)
+        self.client.cookies['sessionid'] = self.legacy_session({'user_info_id': user_info.id})
+
+        self.survey_post(user_info)
+        self.assertEqual(self.client.session['user_info_id'], user_info.id)
+        self.assertIn(f'preferences_{user_info.id}', self.client.session)
+
+    @override_settings(SESSION_ENGINE='chamu.sessions.cache', SESSION_LEGACY_DB_FALLBACK=False)
+    def test_migrate_sessions_command(self):
+        key = self.legacy_session({'user_info_id': 7})
+        stdout = StringIO()
+        call_command('migrate_sessions', '--delete', stdout=stdout)
+        self.assertIn('Copied 1 sessions', stdout.getvalue())
+        self.assertEqual(CacheSessionStore(key).load(), {'user_info_id': 7})
+        self.assertFalse(Session.objects.filter(session_key=key).exists())
+
+
+class NormalizationStrategyTests(TestCase):
+    def setUp(self):
+        # Một giá trị ngoại lai (như 札幌市 trong 混雑度) và các giá trị còn lại gần nhau
+        self.raw_scores = np.array([10.0, 12.0, 12.0, 14.0, 16.0, 18.0, 20.0, 1000.0])
+
+    def test_scores_stay_in_range(self):
+        for strategy in normalization.STRATEGIES:
+            for is_reverse in (False, True):
+                scores = normalization.normalize(self.raw_scores, strategy, is_reverse)
+                self.assertTrue(((scores >= 1.0) & (scores <= 5.0)).all(), strategy)
+                self.assertEqual(scores.tolist(), np.round(scores, 2).tolist())
+
+    def test_outlier_does_not_squash_other_values(self):
+        spread = {
+            strategy: np.ptp(normalization.normalize(self.raw_scores, strategy)[:-1])
+            for strategy in normalization.STRATEGIES
+        }
+        self.assertLess(spread[normalization.MINMAX], 0.1)
+        for strategy in (normalization.RANK, normalization.ROBUST):
+            self.assertGreater(spread[strategy], 2.0, strategy)
+
+    def test_rank_ties_and_reverse(self):
+        scores = normalization.normalize(self.raw_scores, normalization.RANK)
+        self.assertEqual(scores[1], scores[2])
+        self.assertEqual((scores[0], scores[-1]), (1.0, 5.0))
+        reverse = normalization.normalize(self.raw_scores, normalization.RANK, is_reverse=True)
+        self.assertTrue(np.allclose(reverse, 6 - scores))
+
+    def test_constant_column_and_unknown_strategy(self):
+        for strategy in normalization.STRATEGIES:
+            self.assertEqual(normalization.normalize([4.0, 4.0, 4.0], strategy).tolist(), [3.0, 3.0, 3.0])
+        with self.assertRaises(ValueError):
+            normalization.normalize(self.raw_scores, 'unknown')
+
+
+class ScoreSnapshotTests(ScoreFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.snapshot_dir)
+        self.path = os.path.join(self.snapshot_dir, 'scores')
+        # Một điểm trung lập cho ô mà Vietnam không có overlay
+        MunicipalityBaseScore.objects.create(
+            municipality=self.municipalities[4], criteria=self.criteria[0], base_score=4.5
+        )
+
+    def test_round_trip_matches_database_matrices(self):
+        export_score_snapshot(self.path)
+        snapshot = load_score_snapshot(self.path)
+        self.assertIsInstance(snapshot.scores, np.memmap)
+        self.assertEqual(snapshot.scores.shape, (2, len(self.municipalities), len(self.criteria)))
+        for country in (self.country, self.other_country):
+            expected = ScoreMatrix.build(country.id)
+            matrix = snapshot.matrix(country.id)
+            self.assertEqual(matrix.municipality_ids.tolist(), expected.municipality_ids.tolist())
+            self.assertEqual(matrix.criteria_ids.tolist(), expected.criteria_ids.tolist())
+            self.assertTrue(np.array_equal(matrix.scores, expected.scores))
+        self.assertIsNone(snapshot.matrix(-1))
+
+    def test_matching_bootstraps_from_snapshot_until_scores_change(self):
+        call_command('export_score_snapshot', '--output', self.path, stdout=StringIO())
+        with override_settings(SCORE_SNAPSHOT_PATH=self.path):
+            # Chỉ đọc bộ đếm 'scores' và bộ đếm của quốc gia để kiểm tra snapshot còn khớp
+            with self.assertNumQueries(1):
+                matrix = get_score_matrix(self.country.id)
+            self.assertIsInstance(matrix.scores, np.memmap)
+
+            # Sau khi điểm của quốc gia thay đổi, snapshot cũ không còn được dùng cho quốc gia đó
+            invalidate_score_matrix(self.country.id)
+            matrix = get_score_matrix(self.country.id)
+            self.assertNotIsInstance(matrix.scores, np.memmap)
+            self.assertIsInstance(get_score_matrix(self.other_country.id).scores, np.memmap)
+
+
+    def test_snapshot_exported_by_another_process_is_used(self):
+        export_score_snapshot(self.path)
+        # Process mới: cache và ma trận trong bộ nhớ đều trống, chỉ còn database và file snapshot
+        cache.clear()
+        self.addCleanup(invalidate_score_matrix)
+        with mock.patch.dict(matching._matrices, clear=True), mock.patch.object(snapshot, '_snapshot', None), \
+                override_settings(SCORE_SNAPSHOT_PATH=self.path):
+            self.assertIsInstance(get_score_matrix(self.country.id).scores, np.memmap)
+
+class ScoreStoreTests(ScoreFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.store_dir)
+        settings_override = override_settings(SCORE_STORE_DIR=self.store_dir, CELERY_BROKER_URL=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(invalidate_score_matrix)
+
+    def test_readers_attach_to_published_generation(self):
+        # Chưa xuất bản: đọc từ database
+        self.assertNotIsInstance(get_score_matrix(self.country.id).scores, np.memmap)
+
+        generation = publish_score_store()
+        matrix = get_score_matrix(self.country.id)
+        self.assertIsInstance(matrix.scores, np.memmap)
+        self.assertTrue(np.array_equal(matrix.scores, ScoreMatrix.build(self.country.id).scores))
+
+        # Một process khác gắn vào cùng thế hệ
+        other_process = ScoreStore(self.store_dir)
+        self.assertTrue(other_process.refresh())
+        self.assertEqual(other_process.generation, generation)
+        self.assertFalse(other_process.refresh())
+
+    def test_score_write_publishes_new_generation(self):
+        publish_score_store()
+        municipality = self.municipalities[0]
+        row = get_score_matrix(self.country.id).municipality_index[municipality.id]
+        MunicipalityScore.objects.filter(municipality=municipality, country=self.country).update(
+            eval_count=1, eval_sum=5.0
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            update_municipality_score(municipality, self.country)
+
+        matrix = get_score_matrix(self.country.id)
+        self.assertIsInstance(matrix.scores, np.memmap)
+        self.assertTrue(np.array_equal(matrix.scores[row], ScoreMatrix.build(self.country.id).scores[row]))
+
+    def test_publish_from_another_process_reaches_cached_rankings(self):
+        publish_score_store()
+        preferences = {'1': self.criteria[0].id}
+        first = calculate_municipality_matching_scores(preferences, self.country, self.hokkaido.id)
+        municipality = first[0]['municipality']
+
+        # Process khác ghi điểm rồi xuất bản thế hệ mới
+        MunicipalityScore.objects.update_or_create(
+            municipality=municipality, country=self.country, criteria=self.criteria[0],
+            defaults={'base_score': 5.0, 'final_score': 5.0},
+        )
+        ScoreStore(self.store_dir).publish()
+
+        ranking = calculate_municipality_matching_scores(preferences, self.country, self.hokkaido.id)
+        scores = {result['municipality'].id: result['score'] for result in ranking}
+        self.assertEqual(scores[municipality.id], 5.0)
+
+    def test_writes_before_the_next_publish_are_read_from_the_database(self):
+        publish_score_store()
+        self.assertEqual(ScoreStore(self.store_dir).read_pointer()[1], get_version(SCORES_VERSION))
+        municipality = self.municipalities[0]
+        matrix = get_score_matrix(self.country.id)
+        self.assertIsInstance(matrix.scores, np.memmap)
+        row = matrix.municipality_index[municipality.id]
+        col = matrix.criteria_index[self.criteria[1].id]
+
+        # Ghi của worker trong cửa sổ debounce: bộ đếm của quốc gia đã tăng, thế hệ mới chưa xuất bản
+        MunicipalityScore.objects.filter(
+            municipality=municipality, country=self.country, criteria=self.criteria[1]
+        ).update(final_score=4.75)
+        DataVersion.objects.filter(name=country_scores_version(self.country.id)).update(version=F('version') + 1)
+        matrix = get_score_matrix(self.country.id)
+        self.assertNotIsInstance(matrix.scores, np.memmap)
+        self.assertEqual(matrix.scores[row, col], 4.75)
+        self.assertIsInstance(get_score_matrix(self.other_country.id).scores, np.memmap)
+
+        publish_score_store()
+        matrix = get_score_matrix(self.country.id)
+        self.assertIsInstance(matrix.scores, np.memmap)
+        self.assertEqual(matrix.scores[row, col], 4.75)
+
+    def test_old_generations_are_pruned(self):
+        for _ in range(5):
+            publish_score_store()
+        generations = [name for name in os.listdir(self.store_dir) if name.startswith('gen-')]
+        self.assertEqual(len(generations), 3)
+        self.assertIn(ScoreStore(self.store_dir).read_current(), generations)
+
+
+class AsyncMunicipalityViewTests(ScoreFixtureMixin, TestCase):
+    def setUp(self):
+        self.municipality = self.municipalities[0]
+        self.user_info = UserInfo.objects.create(name='An', country=self.country, municipality=self.municipality)
+        EvaluationSurvey.objects.create(
+            user=self.user_info, municipality=self.municipality, criteria=self.criteria[0], score=4
+        )
+        session = self.client.session
+        session['user_info_id'] = self.user_info.id
+        session[f'preferences_{self.user_info.id}'] = {'1': self.criteria[0].id}
+        session.save()
+        self.fetched = ('Sapporo', 'https://img/sapporo.jpg', None, MunicipalityProfile.STATUS_OK)
+
+    def test_details_page_fetches_missing_profile_without_blocking_calls(self):
+        url = reverse('municipality_details', kwargs={'municipality_id': self.municipality.id})
+        with mock.patch.object(wiki, 'afetch_wiki_profile', new=mock.AsyncMock(return_value=self.fetched)) as fetch:
+            response = self.client.get(url)
+        self.assertContains(response, 'Sapporo')
+        self.assertContains(response, 'Cost of Living')
+        fetch.assert_awaited_once_with('札幌市', '北海道')
+        self.assertTrue(MunicipalityProfile.objects.filter(municipality=self.municipality).exists())
+
+    def test_thank_you_page_shares_the_profile_fragment(self):
+        with mock.patch.object(wiki, 'afetch_wiki_profile', new=mock.AsyncMock(return_value=self.fetched)) as fetch:
+            response = self.client.get(reverse('thank_you', kwargs={'user_info_id': self.user_info.id}))
+            self.client.get(reverse('municipality_details', kwargs={'municipality_id': self.municipality.id}))
+        self.assertContains(response, 'Sapporo')
+        self.assertEqual(response.context['score_details'][0]['user_score'], 4)
+        fetch.assert_awaited_once()
+
+    def test_cached_fragment_of_a_stale_profile_schedules_a_refresh(self):
+        url = reverse('municipality_details', kwargs={'municipality_id': self.municipality.id})
+        # TTL 0: profile vừa lấy đã quá hạn khi fragment của nó được đọc lại từ cache
+        with mock.patch.object(wiki, 'WIKI_PROFILE_TTL', timedelta(0)), \
+                mock.patch.object(wiki, 'afetch_wiki_profile', new=mock.AsyncMock(return_value=self.fetched)) as fetch, \
+                mock.patch.object(wiki, 'schedule_profile_refresh') as schedule:
+            self.client.get(url)
+            self.client.get(url)  # profile đã lưu (phiên bản mới): fragment được dựng lại và cache
+            schedule.reset_mock()
+            with mock.patch('chamu.views.aget_municipality_profile') as get_profile:
+                response = self.client.get(url)
+        self.assertContains(response, 'Sapporo')
+        get_profile.assert_not_called()
+        fetch.assert_awaited_once()
+        schedule.assert_called_once_with(self.municipality.id)
+
+    def test_unknown_municipality_is_404(self):
+        response = self.client.get(reverse('municipality_details', kwargs={'municipality_id': 0}))
+        self.assertEqual(response.status_code, 404)
@@ -9,6 +9,9 @@ urlpatterns = [
     path('survey/<int:user_info_id>/<int:target_prefecture_id>/match/', views.matching_survey_view, name='matching_survey'),
     path('survey/<int:user_info_id>/evaluate/', views.evaluation_survey_view, name='evaluation_survey'),
     path('survey/<int:user_info_id>/<int:target_prefecture_id>/match/result', views.matching_results_view, name='matching_results'),
+    path('survey/<int:user_info_id>/match/result/nationwide', views.matching_results_nationwide_view, name='matching_results_nationwide'),
+    # URL chia sẻ được: hồ sơ (quốc gia, tỉnh, tiêu chí theo thứ hạng) mã hóa trong đường dẫn
+    path('results/<str:token>/', views.shared_results_view, name='shared_results'),
     path('municipality/<int:municipality_id>/', views.municipality_details_view, name='municipality_details'),
     path('about/', views.about_view, name='about'),
     path('survey/<int:user_info_id>/evaluate/thank_you', views.thank_you_view, name='thank_you'),
@@ -0,0 +1,140 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import DataVersion
+
+# Bộ đếm phiên bản dữ liệu, lưu trong bảng DataVersion để mọi process (web, Celery,
+# lệnh import) thấy cùng một giá trị, kể cả khi cache chỉ là LocMem của từng process.
+# In-process caches compare their version with this counter to know when to rebuild.
+# Với Redis (REDIS_URL), giá trị được sao sang cache dùng chung: đọc bộ đếm không cần database.
+
+# Thời gian sống của bản sao trong cache: giới hạn thời gian một bản sao cũ (race giữa
+# hai lần tăng) còn được dùng
+VERSION_CACHE_TIMEOUT = getattr(settings, 'VERSION_CACHE_TIMEOUT', 300)
+
+# Bộ đếm đọc sẵn cùng các bộ đếm toàn cục trong một request: số dòng giới hạn bởi số quốc gia
+# (matching.country_scores_version), khác với bộ đếm theo đối tượng như 'profile:<id>'
+PREFETCHED_PREFIXES = ('scores:',)
+
+# Giá trị đã đọc trong request hiện tại (xem DataVersionMiddleware); None ngoài request
+_request_versions = ContextVar('chamu_request_versions', default=None)
+
+
+def initial_version():
+    """
+    Starting value of a counter: the current time in milliseconds. A counter lost with
+    a database reset then never repeats a value that shared cache entries were stored under.
+    """
+    return int(time.time() * 1000)
+
+
+@contextmanager
+def request_versions():
+    """Read each counter at most once inside the block: a request sees one consistent set of versions."""
+    token = _request_versions.set({})
+    try:
+        yield
+    finally:
+        _request_versions.reset(token)
+
+
+def versions_in_cache():
+    """True when the counters are mirrored into the default cache (shared between processes with Redis)."""
+    return bool(getattr(settings, 'REDIS_URL', None))
+
+
+def version_cache_key(name):
+    return f'chamu:version:{name}'
+
+
+def get_versions(names):
+    """
+    {name: version} of several counters, read from the shared cache when they are mirrored
+    there (see versions_in_cache), else with one query (missing counters are created).
+    """
+    memo = _request_versions.get()
+    versions = {name: memo[name] for name in names if memo is not None and name in memo}
+    missing = [name for name in names if name not in versions]
+    if missing and versions_in_cache():
+        cached = cache.get_many([version_cache_key(name) for name in missing])
+        for name in missing:
+            if version_cache_key(name) in cached:
+                versions[name] = cached[version_cache_key(name)]
+                if memo is not None:
+                    memo[name] = versions[name]
+        missing = [name for name in missing if name not in versions]
+        for name, version in read_versions(missing, memo).items():
+            versions[name] = version
+            # add: không ghi đè giá trị mới hơn mà bump_version vừa sao vào
+            cache.add(version_cache_key(name), version, VERSION_CACHE_TIMEOUT)
+    elif missing:
+        versions.update(read_versions(missing, memo))
+    return versions
+
+
+def read_versions(names, memo=None):
+    """{name: version} of the counters from the database, with one query (missing counters are created)."""
+    if not names:
+        return {}
+    query = Q(name__in=names)
+    if memo is not None:
+        # Trong request: đọc luôn mọi bộ đếm toàn cục (tên không có ':') và PREFETCHED_PREFIXES,
+        # để cả request chỉ tốn một truy vấn. Bộ đếm theo đối tượng ('profile:<id>') đọc khi cần.
+        query |= ~Q(name__contains=':')
+        for prefix in PREFETCHED_PREFIXES:
+            query |= Q(name__startswith=prefix)
+    rows = dict(DataVersion.objects.filter(query).values_list('name', 'version'))
+    versions = {name: rows[name] for name in names if name in rows}
+    for name in names:
+        if name not in versions:
+            # get_or_create: process khác có thể vừa tạo bộ đếm này
+            versions[name] = DataVersion.objects.get_or_create(
+                name=name, defaults={'version': initial_version()}
+            )[0].version
+    if memo is not None:
+        # Giá trị đã đọc trước đó trong request được giữ nguyên
+        for name, version in rows.items():
+            memo.setdefault(name, version)
+        memo.update(versions)
+    return versions
+
+
+def get_version(name):
+    return get_versions([name])[name]
+
+
+async def aget_versions(names):
+    """get_versions for async views."""
+    return await sync_to_async(get_versions)(names)
+
+
+async def aget_version(name):
+    return (await aget_versions([name]))[name]
+
+
+def bump_version(name):
+    """
+    Increment a counter. Other processes see the new value once the current transaction commits
+    (the shared cache copy is written at that point too).
+    """
+    if not DataVersion.objects.filter(name=name).update(version=F('version') + 1):
+        DataVersion.objects.get_or_create(name=name, defaults={'version': initial_version()})
+    memo = _request_versions.get()
+    if memo is not None:
+        memo.pop(name, None)
+    if versions_in_cache():
+        transaction.on_commit(lambda: mirror_version(name))
+
+
+def mirror_version(name):
+    """Copy the committed value of a counter into the shared cache."""
+    version = DataVersion.objects.filter(name=name).values_list('version', flat=True).first()
+    if version is not None:
+        cache.set(version_cache_key(name), version, VERSION_CACHE_TIMEOUT)
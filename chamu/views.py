@@ -1,19 +1,47 @@
-import requests
+from collections import defaultdict
+from asgiref.sync import sync_to_async
 from django import forms
-from django.db.models import Avg
+from django.db import transaction
+from django.db.models import Case, ExpressionWrapper, F, FloatField, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.db.models.lookups import GreaterThan
 from django.forms import formset_factory
-from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse
-import wikipedia, folium, geopy, geopy.distance, re
-from django.views.decorators.http import require_GET
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
+from django.http import Http404, HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import urlencode
+from django.utils.translation import get_language
+import folium, geopy, geopy.distance
+from django.views.decorators.cache import cache_control
+from django.views.decorators.vary import vary_on_cookie
+from django.views.decorators.http import condition, require_GET
+from django.contrib.admin.views.decorators import staff_member_required
 
 from .forms import (
     BaseUserInfoForm, MatchInfoForm, EvaluateInfoForm,
 )
 from .models import (
-    Criteria, UserInfo, Municipality,
-    MunicipalityScore, EvaluationSurvey, Prefecture
+    UserInfo, Municipality,
+    MunicipalityScore, EvaluationSurvey
 )
+from .matching import (
+    DEFAULT_SCORE, SCORES_VERSION, aget_effective_scores, country_scores_version, decode_results_token,
+    effective_base_expression, encode_results_token, get_score_matrix, invalidate_score_matrix, preferences_hash,
+    ranking_cache,
+)
+from .caching import (
+    FRAGMENT_CACHE_TIMEOUT, RESULTS_PAGE_MAX_AGE, aget_or_set, cached_json_response, conditional_api, parts_digest,
+    versions_tag,
+)
+from .reference_cache import REFERENCE_VERSION, get_criteria_map, get_prefecture, get_reference_data
+from .spatial import COORDINATES_VERSION, get_municipality_index
+from .tasks import schedule_score_recompute
+from .wiki import aget_municipality_profile, arefresh_if_stale, profile_version
+
+# Số thành phố hiển thị trong bảng xếp hạng toàn quốc
+NATIONWIDE_TOP_K = 20
+NATIONWIDE_MAX_K = 100
 
 # -----------------
 # Views
@@ -76,7 +104,7 @@ def match_info_view(request):
 
 def matching_survey_view(request, user_info_id, target_prefecture_id):
     user_info = get_object_or_404(UserInfo, id=user_info_id)
-    criteria_list = Criteria.objects.all().order_by('name')
+    criteria_list = get_reference_data().criteria_by_name
     ranks = range(1, len(criteria_list) + 1)
 
     if request.method == 'POST':
@@ -89,7 +117,7 @@ def matching_survey_view(request, user_info_id, target_prefecture_id):
         # Lưu kết quả vào session
         request.session[f'preferences_{user_info_id}'] = selected_criteria
         print(f"User info ID stored in session: {request.session.get('user_info_id')}")
-        return redirect('matching_results', user_info_id=user_info.id, target_prefecture_id=target_prefecture_id)
+        return redirect(shared_results_url(user_info.country_id, target_prefecture_id, selected_criteria))
 
     return render(request, 'matching_survey.html', {
         'criteria_list': criteria_list,
@@ -98,6 +126,7 @@ def matching_survey_view(request, user_info_id, target_prefecture_id):
 
 
 def matching_results_view(request, user_info_id, target_prefecture_id):
+    """Old session-based route: redirect to the shareable URL of the same results."""
     user_info = get_object_or_404(UserInfo, id=user_info_id)
 
     preferences_key = f'preferences_{user_info_id}'
@@ -106,93 +135,176 @@ def matching_results_view(request, user_info_id, target_prefecture_id):
     if not user_preferences:
         return redirect('matching_survey', user_info_id=user_info.id, target_prefecture_id=target_prefecture_id)
 
-    # Get all-criteria IDs from user preferences
-    criteria_ids = user_preferences.values()
-    criteria_map = {
-        c.id: c.name for c in Criteria.objects.filter(id__in=criteria_ids)
-    }
+    return redirect(shared_results_url(user_info.country_id, target_prefecture_id, user_preferences))
 
-    matching_results = calculate_municipality_matching_scores(user_preferences, user_info.country, target_prefecture_id)
-    matching_results = sorted(matching_results, key=lambda x: x['score'])
+def matching_results_nationwide_view(request, user_info_id):
+    """Old session-based route of the nationwide top-k: redirect to the shareable URL (k is kept)."""
+    user_info = get_object_or_404(UserInfo, id=user_info_id)
 
-    # Sort user preferences by rank (key) (make sure keys are integers)
-    sorted_user_preferences_items = sorted(user_preferences.items(), key=lambda item: int(item[0]))
+    preferences_key = f'preferences_{user_info_id}'
+    user_preferences = request.session.get(preferences_key)
 
-    # Create template for matching_results.html
-    user_preferences_for_template = []
-    for rank, cid in sorted_user_preferences_items:
-        user_preferences_for_template.append({
-            'priority': int(rank),
-            'criteria_id': int(cid),
-            # Get criteria name from the map
-            'criteria_name': criteria_map.get(int(cid), 'N/A')
-        })
+    if not user_preferences:
+        return redirect('match_info')
+
+    return redirect(shared_results_url(user_info.country_id, None, user_preferences, request.GET.get('k')))
+
+
+def shared_results_url(country_id, prefecture_id, user_preferences, k=None):
+    url = reverse('shared_results', args=[encode_results_token(country_id, prefecture_id, user_preferences)])
+    return f'{url}?{urlencode({"k": k})}' if k else url
 
-    target_prefecture = get_object_or_404(Prefecture, id=target_prefecture_id)
+
+def results_versions(country_id):
+    """Data versions a results page of one country depends on (its scores, not other countries')."""
+    return [SCORES_VERSION, country_scores_version(country_id), REFERENCE_VERSION, COORDINATES_VERSION]
+
+
+def shared_results_etag(request, token):
+    """The page only depends on the token, k, the language and the data versions."""
+    reference = get_reference_data()
+    try:
+        country_id = decode_results_token(token, len(reference.criteria))[0]
+    except ValueError:
+        country_id = None  # view trả về 404
+    if country_id not in reference.country_map:
+        country_id = None  # không tạo bộ đếm cho quốc gia không tồn tại
+    return 'results-{}-{}'.format(
+        versions_tag(results_versions(country_id)),
+        parts_digest([token, request.GET.get('k', ''), get_language()]),
+    )
+
+
+@require_GET
+@cache_control(public=True, max_age=RESULTS_PAGE_MAX_AGE)
+# Ngôn ngữ có thể đến từ cookie (LocaleMiddleware đã thêm Vary: Accept-Language)
+@vary_on_cookie
+@condition(etag_func=shared_results_etag)
+def shared_results_view(request, token):
+    """
+    Results page addressed only by its URL (see encode_results_token): no session and
+    no UserInfo are read, so identical profiles share one URL that a reverse proxy or
+    full-page cache can serve. Prefecture 0 in the token is the nationwide top-k.
+    The page is localized, so caches keep one copy per language (ETag and Vary).
+    """
+    reference = get_reference_data()
+    try:
+        country_id, prefecture_id, user_preferences = decode_results_token(token, len(reference.criteria))
+    except ValueError:
+        raise Http404('Invalid results token.')
+    if not user_preferences:
+        raise Http404('Invalid results token.')
+
+    # Một hồ sơ chỉ có một URL: token không chuẩn chuyển hướng về token chuẩn
+    canonical = encode_results_token(country_id, prefecture_id, user_preferences)
+    if canonical != token:
+        return redirect(shared_results_url(country_id, prefecture_id, user_preferences, request.GET.get('k')),
+                        permanent=True)
+
+    country = reference.country_map.get(country_id)
+    if country_id is not None and country is None:
+        raise Http404('No Country matches the given query.')
+
+    target_prefecture = None
+    if prefecture_id is not None:
+        target_prefecture = reference.prefecture_map.get(prefecture_id)
+        if target_prefecture is None:
+            raise Http404('No Prefecture matches the given query.')
+
+    if target_prefecture is not None:
+        scope = f'prefecture:{target_prefecture.id}'
+        # Chỉ tính khi fragment bảng kết quả không có trong cache
+        matching_results = SimpleLazyObject(
+            lambda: calculate_municipality_matching_scores(user_preferences, country, target_prefecture.id)
+        )
+    else:
+        try:
+            k = int(request.GET.get('k', NATIONWIDE_TOP_K))
+        except (ValueError, TypeError):
+            k = NATIONWIDE_TOP_K
+        k = max(1, min(NATIONWIDE_MAX_K, k))
+        scope = f'top{k}'
+        matching_results = SimpleLazyObject(
+            lambda: calculate_nationwide_top_matches(user_preferences, country, k)
+        )
+
+    criteria_map = get_criteria_map(user_preferences.values())
+    user_preferences_for_template = [
+        {
+            'priority': rank,
+            'criteria_id': cid,
+            'criteria_name': criteria_map[cid].name if cid in criteria_map else 'N/A'
+        }
+        for rank, cid in sorted(user_preferences.items())
+    ]
 
     return render(request, 'matching_results.html', {
-        'user_info': user_info,
+        'country': country,
         'matching_results': matching_results,
         'user_preferences': user_preferences_for_template,
         'target_prefecture': target_prefecture,
+        'nationwide': target_prefecture is None,
+        'nationwide_url': shared_results_url(country_id, None, user_preferences),
+        'results_cache_key': results_fragment_key(country_id, user_preferences, scope),
+        'results_cache_timeout': FRAGMENT_CACHE_TIMEOUT,
     })
 
-def municipality_details_view(request, municipality_id, user_info_id=None):
-    municipality = get_object_or_404(Municipality, id=municipality_id)
+
+def results_fragment_key(country_id, user_preferences, scope):
+    """
+    vary_on value of the cached results table: the same country, preferences and scope
+    render the same table until the country's scores, reference data or municipalities change.
+    """
+    return ':'.join([
+        str(country_id), preferences_hash(user_preferences), scope,
+        versions_tag(results_versions(country_id)),
+    ])
+
+async def municipality_details_view(request, municipality_id, user_info_id=None):
+    """
+    Async view: the Wikipedia lookup of a municipality without a stored profile
+    is awaited on the event loop instead of blocking a worker thread.
+    """
+    municipality = await aget_object_or_404(Municipality.objects.select_related('prefecture'), id=municipality_id)
     prefecture = municipality.prefecture
 
     # Handle the back button logic from the previous conversation
     # If user_info_id is passed, use it. Otherwise, try to get from session.
     if not user_info_id:
-        user_info_id = request.session.get('user_info_id')
+        user_info_id = await request.session.aget('user_info_id')
         if not user_info_id:
             return redirect('match_info')
 
     try:
-        user_info = UserInfo.objects.get(id=user_info_id)
-        country = user_info.country
+        user_info = await UserInfo.objects.aget(id=user_info_id)
     except UserInfo.DoesNotExist:
         return redirect('match_info')
 
     # Fetch user preferences from the session to calculate scores
     preferences_key = f'preferences_{user_info_id}'
-    user_preferences = request.session.get(preferences_key, {})
+    user_preferences = await request.session.aget(preferences_key, {})
 
     criteria_details = []
     if user_preferences:
         # Fetch scores for this municipality and the user's criteria
         criteria_ids = [int(cid) for cid in user_preferences.values()]
 
-        scores = MunicipalityScore.objects.filter(
-            municipality=municipality,
-            criteria__id__in=criteria_ids,
-            country=country
-        ).select_related('criteria')
+        # Điểm hiệu lực: overlay của quốc gia, nếu không có thì điểm trung lập
+        scores_map = await aget_effective_scores(municipality.id, user_info.country_id)
+        criteria_map = {cid: c.name for cid, c in (await sync_to_async(get_criteria_map)(criteria_ids)).items()}
 
         # Iterate through preferences to build the details list
-        scores_map = {s.criteria_id: s for s in scores}
-        criteria_map = {c.id: c.name for c in Criteria.objects.filter(id__in=criteria_ids)}
-
         for rank_str, criteria_id in user_preferences.items():
             rank = int(rank_str)
-            score_obj = scores_map.get(criteria_id)
-            if score_obj:
-                display_score = score_obj.final_score if score_obj.final_score and score_obj.final_score != 0 else score_obj.base_score
+            display_score = scores_map.get(int(criteria_id))
+            if display_score is not None:
                 criteria_details.append({
                     'criteria_name': criteria_map.get(criteria_id, 'N/A'),
                     'priority': rank,
                     'municipality_score': display_score,
                 })
 
-    description, image_url, wiki_url = get_municipality_info_from_wiki(municipality.name, prefecture.name)
-
-    # Create map by folium when there is coordinates
-    municipality_map = None
-    if municipality.latitude and municipality.longitude:
-        map_center = [float(municipality.latitude), float(municipality.longitude)]
-        m = folium.Map(location=map_center, zoom_start=12)
-        folium.Marker(map_center, tooltip=municipality.name).add_to(m)
-        municipality_map = m._repr_html_()
+    description, image_url, wiki_url, municipality_map = await aget_municipality_fragment(municipality)
 
     return render(request, 'municipality_details.html', {
         'municipality': municipality,
@@ -206,6 +318,43 @@ def municipality_details_view(request, municipality_id, user_info_id=None):
     })
 
 
+async def aget_municipality_fragment(municipality):
+    """
+    Cached profile fragment of a municipality: (description, image_url, wiki_url, folium map HTML).
+    municipality.prefecture must be loaded. A fragment whose profile has become stale is still
+    served, and the profile is refreshed in the background (the new profile changes the key).
+    """
+    built = False
+
+    async def build():
+        nonlocal built
+        built = True
+        description, image_url, wiki_url, stale_at = await aget_municipality_profile(municipality)
+        # folium tốn CPU: dựng trong thread để event loop tiếp tục phục vụ request khác
+        municipality_map = await sync_to_async(render_municipality_map, thread_sensitive=False)(municipality)
+        return description, image_url, wiki_url, municipality_map, stale_at
+
+    description, image_url, wiki_url, municipality_map, stale_at = await aget_or_set(
+        'municipality-fragment', [municipality.id],
+        [COORDINATES_VERSION, profile_version(municipality.id)],
+        build, timeout=FRAGMENT_CACHE_TIMEOUT,
+    )
+    if not built:
+        # Lấy từ cache: aget_municipality_profile không chạy nên kiểm tra hạn ở đây
+        await arefresh_if_stale(municipality.id, stale_at)
+    return description, image_url, wiki_url, municipality_map
+
+
+def render_municipality_map(municipality):
+    """Folium map HTML centred on the municipality, or None without coordinates."""
+    if not (municipality.latitude and municipality.longitude):
+        return None
+    map_center = [float(municipality.latitude), float(municipality.longitude)]
+    m = folium.Map(location=map_center, zoom_start=12)
+    folium.Marker(map_center, tooltip=municipality.name).add_to(m)
+    return m._repr_html_()
+
+
 # ----------------- LUỒNG 2: EVALUATION SURVEY -----------------
 def evaluate_info_view(request):
     user_info = None
@@ -240,7 +389,7 @@ def evaluate_info_view(request):
 
 def evaluation_survey_view(request, user_info_id):
     user_info = get_object_or_404(UserInfo, id=user_info_id)
-    criteria_list = Criteria.objects.all()
+    criteria_list = get_reference_data().criteria
 
     if not criteria_list:
         return HttpResponse("No criteria available for evaluation.")
@@ -268,10 +417,6 @@ def evaluation_survey_view(request, user_info_id):
         formset = evaluation_survey_form_set(request.POST)
 
         if formset.is_valid():
-            EvaluationSurvey.objects.filter(
-                user=user_info,
-                municipality=user_info.municipality
-            ).delete()
             # Use bulk_create for better performance
             evaluations = []
             for i, form in enumerate(formset):
@@ -281,13 +426,40 @@ def evaluation_survey_view(request, user_info_id):
                         user=user_info,
                         municipality=user_info.municipality,
                         criteria=criteria_list[i],
+                        country=user_info.country,
                         score=score,
                     ))
 
-            if evaluations:
-                EvaluationSurvey.objects.bulk_create(evaluations)
-                # Update municipality average score after new evaluations
-                update_municipality_score(user_info.municipality, user_info.country)
+            with transaction.atomic():
+                previous_evaluations = EvaluationSurvey.objects.filter(
+                    user=user_info,
+                    municipality=user_info.municipality
+                )
+                # Trừ các đánh giá cũ khỏi overlay của quốc gia đã cộng chúng (người dùng có thể
+                # đã đổi quốc gia), cộng các đánh giá mới vào quốc gia hiện tại
+                # deltas format: { country_id: { criteria_id: (count_delta, sum_delta) } }
+                deltas = defaultdict(lambda: defaultdict(lambda: (0, 0.0)))
+                for country_id, criteria_id, score in previous_evaluations.values_list(
+                    'country_id', 'criteria_id', 'score'
+                ):
+                    if country_id is None:
+                        continue  # quốc gia đã bị xóa cùng overlay của nó
+                    count, total = deltas[country_id][criteria_id]
+                    deltas[country_id][criteria_id] = (count - 1, total - score)
+                for evaluation in evaluations:
+                    count, total = deltas[user_info.country_id][evaluation.criteria.id]
+                    deltas[user_info.country_id][evaluation.criteria.id] = (count + 1, total + evaluation.score)
+
+                previous_evaluations.delete()
+                if evaluations:
+                    EvaluationSurvey.objects.bulk_create(evaluations)
+                for country_id, country_deltas in deltas.items():
+                    apply_evaluation_deltas(user_info.municipality, country_id, country_deltas)
+
+            country_map = get_reference_data().country_map
+            for country_id in deltas:
+                # Update municipality average score after new evaluations (Celery, coalesced)
+                schedule_score_recompute(user_info.municipality, country_map.get(country_id))
 
             return redirect('thank_you', user_info_id=user_info.id)
     else:
@@ -304,40 +476,29 @@ def evaluation_survey_view(request, user_info_id):
     })
 
 
-def thank_you_view(request, user_info_id):
-    """Trang cảm ơn sau khi làm khảo sát đánh giá."""
-    user_info = get_object_or_404(UserInfo, id=user_info_id)
+async def thank_you_view(request, user_info_id):
+    """Trang cảm ơn sau khi làm khảo sát đánh giá (async, như municipality_details_view)."""
+    user_info = await aget_object_or_404(
+        UserInfo.objects.select_related('country', 'municipality__prefecture'), id=user_info_id
+    )
     municipality = user_info.municipality
     prefecture = municipality.prefecture
 
     # Lấy điểm đánh giá của người dùng
-    user_evaluations = EvaluationSurvey.objects.filter(
-        user=user_info,
-        municipality=municipality
-    ).order_by('criteria__name').select_related('criteria')
+    user_evaluations = [
+        evaluation async for evaluation in EvaluationSurvey.objects.filter(
+            user=user_info,
+            municipality=municipality
+        ).order_by('criteria__name').select_related('criteria')
+    ]
 
-    # Lấy điểm cuối cùng hiện tại của thành phố
-    all_municipality_scores = MunicipalityScore.objects.filter(
-        municipality=municipality,
-        country=user_info.country
-    )
-    # Tạo một map chứa cả base_score và final_score
-    scores_map = {
-        score.criteria_id: {'final': score.final_score, 'base': score.base_score}
-        for score in all_municipality_scores
-    }
+    # Lấy điểm hiện tại (điểm hiệu lực) của thành phố cho quốc gia của người dùng
+    scores_map = await aget_effective_scores(municipality.id, user_info.country_id)
 
     # Kết hợp điểm người dùng và điểm cuối cùng để hiển thị
     score_details = []
     for evaluation in user_evaluations:
-        # Lấy bản ghi điểm tương ứng từ map
-        scores = scores_map.get(evaluation.criteria_id)
-
-        # Logic lấy điểm hiện tại
-        if scores:
-            current_score = scores['final'] if scores['final'] and scores['final'] != 0 else scores['base']
-        else:
-            current_score = 3.0
+        current_score = scores_map.get(evaluation.criteria_id, DEFAULT_SCORE)
 
         score_details.append({
             'criteria_name': evaluation.criteria.name,
@@ -345,16 +506,8 @@ def thank_you_view(request, user_info_id):
             'current_score': round(current_score, 2)
         })
 
-    # Lấy thông tin từ Wikipedia
-    description, image_url, wiki_url = get_municipality_info_from_wiki(municipality.name, prefecture.name)
-
-    # Tạo bản đồ Folium
-    municipality_map = None
-    if municipality.latitude and municipality.longitude:
-        map_center = [float(municipality.latitude), float(municipality.longitude)]
-        m = folium.Map(location=map_center, zoom_start=12)
-        folium.Marker(map_center, tooltip=municipality.name).add_to(m)
-        municipality_map = m._repr_html_()
+    # Lấy thông tin từ Wikipedia và bản đồ Folium (fragment dùng chung với trang chi tiết)
+    description, image_url, wiki_url, municipality_map = await aget_municipality_fragment(municipality)
 
     return render(request, 'thank_you.html', {
         'user_info': user_info,
@@ -371,99 +524,129 @@ def thank_you_view(request, user_info_id):
 # Functions
 # -----------------
 # ----------------- CALCULATING AND UPDATING SCORES -----------------
+def score_expressions(eval_count, eval_sum):
+    """
+    avg_score and final_score as SQL expressions of the running aggregates.
+    avg_score = eval_sum / eval_count (3.0 without evaluations)
+    final_score = base_score * 0.6 + avg_score * 0.4, where base_score falls back
+    to the country-neutral MunicipalityBaseScore
+    """
+    avg_score = Case(
+        When(GreaterThan(eval_count, 0), then=ExpressionWrapper(eval_sum / eval_count, output_field=FloatField())),
+        default=Value(3.0),
+        output_field=FloatField(),
+    )
+    final_score = effective_base_expression() * 0.6 + avg_score * 0.4
+    return avg_score, final_score
+
+def apply_evaluation_deltas(municipality, country_id, deltas):
+    """
+    Add evaluation deltas to the running eval_count/eval_sum of one country's overlay
+    with F() expressions. The counters never go below zero.
+    deltas format: { criteria_id: (count_delta, sum_delta) }
+    Must run in the same transaction as the EvaluationSurvey writes.
+    """
+    deltas = {cid: delta for cid, delta in deltas.items() if delta != (0, 0)}
+    if not deltas:
+        return
+
+    # Overlay của quốc gia được tạo khi có đánh giá đầu tiên (base_score NULL = dùng điểm trung lập)
+    MunicipalityScore.objects.bulk_create([
+        MunicipalityScore(municipality=municipality, country_id=country_id, criteria_id=cid)
+        for cid in deltas
+    ], ignore_conflicts=True)
+
+    count_delta = Case(
+        *[When(criteria_id=cid, then=Value(count)) for cid, (count, _) in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    sum_delta = Case(
+        *[When(criteria_id=cid, then=Value(float(total))) for cid, (_, total) in deltas.items()],
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    MunicipalityScore.objects.filter(
+        municipality=municipality,
+        country_id=country_id,
+        criteria_id__in=list(deltas),
+    ).update(
+        eval_count=Greatest(F('eval_count') + count_delta, Value(0)),
+        eval_sum=Greatest(F('eval_sum') + sum_delta, Value(0.0)),
+    )
+
 def update_municipality_score(municipality, country):
     """
     Update avg_score and final_score for a municipality.
+    Derived from the running eval_count/eval_sum in one UPDATE, without
+    re-aggregating EvaluationSurvey history.
     """
-    criteria_list = Criteria.objects.all()
+    avg_score, final_score = score_expressions(F('eval_count'), F('eval_sum'))
+    MunicipalityScore.objects.filter(
+        municipality=municipality,
+        country=country
+    ).update(avg_score=avg_score, final_score=final_score)
 
-    for criteria in criteria_list:
-        try:
-            # 1. Lấy bản ghi MunicipalityScore đã có
-            score_obj = MunicipalityScore.objects.get(
-                municipality=municipality,
-                criteria=criteria,
-                country=country
-            )
-
-            # 2. Tính avg_score từ EvaluationSurvey
-            avg_score_data = EvaluationSurvey.objects.filter(
-                municipality=municipality,
-                criteria=criteria,
-                user__country=country
-            ).aggregate(Avg('score'))
-            avg_score = avg_score_data['score__avg'] if avg_score_data['score__avg'] is not None else 3.0
-
-            # 3. Cập nhật avg_score
-            score_obj.avg_score = avg_score
-
-            # 4. Tính final_score dựa trên base_score và avg_score hiện tại
-            final_score = score_obj.base_score * 0.6 + avg_score * 0.4
-            score_obj.final_score = final_score
-
-            # 5. Lưu đối tượng
-            score_obj.save()
-
-        except MunicipalityScore.DoesNotExist:
-            print(f"Record for {municipality} - {criteria} does not exist. Skipping update.")
+    # Ma trận điểm của quốc gia này đã cũ
+    invalidate_score_matrix(country.id if country else None)
 
 def calculate_municipality_matching_scores(user_preferences, country, target_prefecture_id):
     """
     Calculate matching scores for municipalities based on user preferences.
-    Optimizes by reducing database queries and using in-memory calculations.
+    Scores come from the per-country ScoreMatrix: one weighted matrix-vector
+    product plus a stable sort, so the results are already ordered by score.
     """
+    country_id = country.id if country else None
 
-    # 1. Prepare input data and user preferences
-    # user_preferences format: { '1': 5, '2': 3, ... }
+    def compute():
+        matrix = get_score_matrix(country_id)
+        rows, scores = matrix.rank(user_preferences, target_prefecture_id)
+        return build_matching_results(matrix, rows, scores, user_preferences)
 
-    # Get all criteria and store them in a map for quick access
-    criteria_ids = user_preferences.values()
-    criteria_map = {c.id: c for c in Criteria.objects.filter(id__in=criteria_ids)}
+    return ranking_cache.get_or_compute(country_id, user_preferences, int(target_prefecture_id), compute)
 
-    prefecture_municipalities = Municipality.objects.filter(prefecture_id=target_prefecture_id)
-    # 2. Get scores from the database
-    municipality_scores_qs = MunicipalityScore.objects.filter(
-        criteria__id__in=criteria_ids,
-        municipality__in=prefecture_municipalities,
-        country=country
-    )
-    scores_map = {}
-    for score in municipality_scores_qs:
-        key = (score.municipality_id, score.criteria_id)
-        scores_map[key] = score
+def calculate_nationwide_top_matches(user_preferences, country, k=NATIONWIDE_TOP_K):
+    """
+    Top-k matching municipalities across all prefectures.
+    Only the k selected rows get their municipality and criteria_details loaded.
+    """
+    country_id = country.id if country else None
 
-    # 3. Get all municipalities and prefetch related data
-    municipalities = prefecture_municipalities.order_by('name')
+    def compute():
+        matrix = get_score_matrix(country_id)
+        rows, scores = matrix.top_k(user_preferences, k)
+        return build_matching_results(matrix, rows, scores, user_preferences)
+
+    return ranking_cache.get_or_compute(country_id, user_preferences, f'top{k}', compute)
+
+def build_matching_results(matrix, rows, scores, user_preferences):
+    """
+    Build the result dicts used by matching_results.html for already ranked rows.
+    """
+    # user_preferences format: { '1': 5, '2': 3, ... }
+    criteria_ids = [int(cid) for cid in user_preferences.values()]
+    criteria_map = get_criteria_map(criteria_ids)
+
+    municipalities = Municipality.objects.select_related('prefecture').in_bulk(
+        matrix.municipality_ids[rows].tolist()
+    )
 
-    # 4.Calculate matching scores
     matching_results = []
+    for row, matching_score in zip(rows.tolist(), scores.tolist()):
+        municipality = municipalities.get(int(matrix.municipality_ids[row]))
+        if municipality is None:
+            continue
 
-    for municipality in municipalities:
-        total_weighted_score = 0
-        total_weight = 0
+        # criteria_details read straight from the matrix
         criteria_details = []
-
-        # Loop through user preferences
         for rank_str, criteria_id in user_preferences.items():
             rank = int(rank_str)
-
-            criteria = criteria_map.get(criteria_id)
-            if not criteria:
+            criteria = criteria_map.get(int(criteria_id))
+            col = matrix.criteria_index.get(int(criteria_id))
+            if not criteria or col is None:
                 continue
 
-            # Calculate using final scores if available, otherwise use base scores
-            score_key = (municipality.id, criteria.id)
-            score_obj = scores_map.get(score_key)
-
-            # Lấy final_score, nếu không có thì lấy base_score
-            if score_obj:
-                municipality_score = score_obj.final_score or score_obj.base_score
-            else:
-                municipality_score = 3.0  # Điểm mặc định nếu không có dữ liệu
-
-            total_weighted_score += municipality_score * rank
-            total_weight += rank
-
+            municipality_score = float(matrix.scores[row, col])
             criteria_details.append({
                 'criteria_name': criteria.name,
                 'priority': rank,
@@ -471,14 +654,10 @@ def calculate_municipality_matching_scores(user_preferences, country, target_pre
                 'weighted_score': municipality_score * rank
             })
 
-        # Calculate mismatching score and percentage
-        matching_score = total_weighted_score / total_weight if total_weight > 0 else 0
-        matching_percentage = calculate_matching_percentage(matching_score)
-
         matching_results.append({
             'municipality': municipality,
             'score': round(matching_score, 2),
-            'percentage': matching_percentage,
+            'percentage': calculate_matching_percentage(matching_score),
             'criteria_details': criteria_details
         })
 
@@ -493,147 +672,79 @@ def calculate_matching_percentage(score):
     return round(percentage, 2)
 
 # ----------------- GET FUNCTIONS -----------------
-def get_municipality_info_from_wiki(municipality_name, prefecture_name):
-    """
-    Get description, image and link from Wikipedia using a more specific query.
-    """
-    wikipedia.set_lang("ja")
-
-    # Gọi hàm mới để lấy URL ảnh chính
-    image_url = get_municipality_info_via_api(municipality_name)
-    if not image_url:
-        image_url = "https://via.placeholder.com/600x400"  # Ảnh mặc định nếu API không tìm thấy
-
-    # Bắt đầu tìm kiếm thông tin trên Wikipedia
-    full_name_query = f"{municipality_name} ({prefecture_name})"
-    try:
-        page = wikipedia.page(full_name_query, auto_suggest=False, redirect=True)
-        description = page.summary
-        wiki_url = page.url
-
-        return description, image_url, wiki_url
-    except wikipedia.exceptions.PageError:
-        # Nếu không tìm thấy trang cụ thể, thử lại với tên chung hơn
-        try:
-            page = wikipedia.page(municipality_name, auto_suggest=True, redirect=True)
-            description = page.summary
-            wiki_url = page.url
-            # Dọn dẹp mô tả nếu cần
-            description = re.sub(r'\"(.+?)\" có thể đề cập đến:', '', description, flags=re.IGNORECASE).strip()
-
-            return description, image_url, wiki_url
-        except (wikipedia.exceptions.PageError, wikipedia.exceptions.DisambiguationError) as e:
-            print(f"Error trying to get information from Wikipedia for {municipality_name}: {e}")
-            return "Description is being updated", image_url, None
-    except wikipedia.exceptions.DisambiguationError as e:
-        print(f"Disambiguation error for {municipality_name}. Options: {e.options}")
-        return "Description is being updated due to multiple matches.", image_url, None
-
-
-def get_municipality_info_via_api(municipality_name):
-    """
-    Sử dụng API của Wikipedia để tìm ảnh chính của bài viết.
-    """
-    url = "https://ja.wikipedia.org/w/api.php"
-    params = {
-        "action": "query",
-        "format": "json",
-        "prop": "pageimages",
-        "titles": municipality_name,
-        "pithumbsize": 600,  # Kích thước hình ảnh thu nhỏ mong muốn
-        "redirects": 1
-    }
-
-    try:
-        response = requests.get(url, params=params)
-        data = response.json()
-        pages = data['query']['pages']
-        for page_id, page_data in pages.items():
-            if 'thumbnail' in page_data:
-                return page_data['thumbnail']['source']  # Trả về URL của ảnh chính
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching data from Wikipedia API: {e}")
-
-    return None  # Trả về None nếu không tìm thấy ảnh
-
 @require_GET
+@conditional_api('municipalities', [COORDINATES_VERSION], ['prefecture_id'])
 def get_municipalities(request):
     prefecture_id = request.GET.get('prefecture_id')
     if not prefecture_id:
         return JsonResponse([], safe=False)
 
-    try:
-        prefecture = get_object_or_404(Prefecture, id=prefecture_id)
-        municipalities = Municipality.objects.filter(prefecture=prefecture).values('id', 'name')
-        return JsonResponse(list(municipalities), safe=False)
-    except (ValueError, TypeError):
+    prefecture = get_prefecture(prefecture_id)
+    if prefecture is None:
         return JsonResponse([], safe=False)
 
+    def compute():
+        municipalities = Municipality.objects.filter(prefecture=prefecture).values('id', 'name')
+        return list(municipalities), 200
+
+    return cached_json_response('municipalities', [prefecture.id], [COORDINATES_VERSION], compute)
+
+@require_GET
+@staff_member_required
+def get_ranking_cache_stats(request):
+    """Hit/miss counters of the ranking cache in this worker process (for sizing)."""
+    return JsonResponse(ranking_cache.stats())
+
 # ------------- HÀM LẤY TỌA ĐỘ ĐỂ LÀM MAP INFO PAGE --------------
 # Các hàm mới theo cùng pattern
 @require_GET
+@conditional_api('prefectures', [REFERENCE_VERSION])
 def get_prefectures(request):
-    """Lấy danh sách tất cả prefectures với tọa độ trung bình từ municipalities"""
-    try:
-        prefectures_data = []
-        prefectures = Prefecture.objects.all()
-
-        for prefecture in prefectures:
-            # Tính tọa độ trung bình từ municipalities
-            avg_coords = Municipality.objects.filter(
-                prefecture=prefecture,
-                latitude__isnull=False,
-                longitude__isnull=False
-            ).aggregate(
-                avg_lat=Avg('latitude'),
-                avg_lng=Avg('longitude')
-            )
-
-            prefectures_data.append({
-                'id': prefecture.id,
-                'name': prefecture.name,
-                'latitude': avg_coords['avg_lat'],
-                'longitude': avg_coords['avg_lng']
-            })
+    """Lấy danh sách tất cả prefectures với tọa độ trung bình đã lưu sẵn (Prefecture.refresh_centroids)"""
+    def compute():
+        prefectures_data = [
+            {'id': p.id, 'name': p.name, 'latitude': p.latitude, 'longitude': p.longitude}
+            for p in get_reference_data().prefectures
+        ]
+        return prefectures_data, 200
 
-        return JsonResponse(prefectures_data, safe=False)
-    except Exception:
-        return JsonResponse([], safe=False)
+    return cached_json_response('prefectures', [], [REFERENCE_VERSION], compute)
 
 
 @require_GET
+@conditional_api('prefecture-coords', [REFERENCE_VERSION], ['prefecture_id'])
 def get_prefecture_coords(request):
-    """Lấy tọa độ trung bình của prefecture từ municipalities"""
+    """Lấy tọa độ trung bình và khung bao đã lưu sẵn của prefecture"""
     prefecture_id = request.GET.get('prefecture_id')
     if not prefecture_id:
         return JsonResponse({'error': 'Prefecture ID is required'}, status=400)
 
     try:
-        prefecture = get_object_or_404(Prefecture, id=prefecture_id)
-
-        # Tính tọa độ trung bình từ municipalities
-        avg_coords = Municipality.objects.filter(
-            prefecture=prefecture,
-            latitude__isnull=False,
-            longitude__isnull=False
-        ).aggregate(
-            avg_lat=Avg('latitude'),
-            avg_lng=Avg('longitude')
-        )
-
-        if avg_coords['avg_lat'] is None or avg_coords['avg_lng'] is None:
-            return JsonResponse({'error': 'No coordinate data available for this prefecture'}, status=404)
-
-        return JsonResponse({
-            'latitude': avg_coords['avg_lat'],
-            'longitude': avg_coords['avg_lng'],
-            'name': prefecture.name
-        })
+        prefecture = get_reference_data().prefecture_map.get(int(prefecture_id))
     except (ValueError, TypeError):
         return JsonResponse({'error': 'Invalid prefecture ID'}, status=400)
+    if prefecture is None:
+        raise Http404('No Prefecture matches the given query.')
+
+    def compute():
+        if prefecture.latitude is None or prefecture.longitude is None:
+            return {'error': 'No coordinate data available for this prefecture'}, 404
+
+        return {
+            'latitude': prefecture.latitude,
+            'longitude': prefecture.longitude,
+            'name': prefecture.name,
+            'bounds': [
+                [prefecture.min_latitude, prefecture.min_longitude],
+                [prefecture.max_latitude, prefecture.max_longitude],
+            ],
+        }, 200
+
+    return cached_json_response('prefecture-coords', [prefecture.id], [REFERENCE_VERSION], compute)
 
 
 @require_GET
+@conditional_api('municipality-coords', [COORDINATES_VERSION], ['municipality_id'])
 def get_municipality_coords(request):
     """Lấy tọa độ của municipality theo ID"""
     municipality_id = request.GET.get('municipality_id')
@@ -641,21 +752,29 @@ def get_municipality_coords(request):
         return JsonResponse({'error': 'Municipality ID is required'}, status=400)
 
     try:
-        municipality = get_object_or_404(Municipality, id=municipality_id)
+        municipality_id = int(municipality_id)
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'Invalid municipality ID'}, status=400)
+
+    def compute():
+        municipality = Municipality.objects.filter(id=municipality_id).first()
+        if municipality is None:
+            return {'error': 'Municipality not found'}, 404
 
         if not municipality.latitude or not municipality.longitude:
-            return JsonResponse({'error': 'No coordinate data available for this municipality'}, status=404)
+            return {'error': 'No coordinate data available for this municipality'}, 404
 
-        return JsonResponse({
+        return {
             'latitude': municipality.latitude,
             'longitude': municipality.longitude,
             'name': municipality.name
-        })
-    except (ValueError, TypeError):
-        return JsonResponse({'error': 'Invalid municipality ID'}, status=400)
+        }, 200
+
+    return cached_json_response('municipality-coords', [municipality_id], [COORDINATES_VERSION], compute)
 
 
 @require_GET
+@conditional_api('location-by-coords', [COORDINATES_VERSION, REFERENCE_VERSION], ['lat', 'lng'])
 def get_location_by_coords(request):
     """
     Tìm municipality gần nhất dựa trên tọa độ, prefecture sẽ được suy ra từ municipality
@@ -670,29 +789,18 @@ def get_location_by_coords(request):
         target_lat = float(lat_str)
         target_lng = float(lng_str)
 
-        municipalities = Municipality.objects.filter(
-            latitude__isnull=False,
-            longitude__isnull=False
-        ).select_related('prefecture')
-
-        if not municipalities.exists():
+        # KD-tree trong process: tìm ứng viên gần nhất, chỉ tính geodesic cho ứng viên đó
+        nearest = get_municipality_index().nearest(target_lat, target_lng)
+        if nearest is None:
             return JsonResponse({'error': 'No municipalities with coordinate data found'}, status=404)
 
-        closest_municipality = None
-        min_distance = float('inf')
-
-        for municipality in municipalities:
-            distance = geopy.distance.geodesic(
-                (municipality.latitude, municipality.longitude),
-                (target_lat, target_lng)
-            ).km
-            if distance < min_distance:
-                min_distance = distance
-                closest_municipality = municipality
-
+        municipality_id, latitude, longitude = nearest
+        closest_municipality = Municipality.objects.select_related('prefecture').filter(id=municipality_id).first()
         if not closest_municipality:
             return JsonResponse({'error': 'No municipality found'}, status=404)
 
+        min_distance = geopy.distance.geodesic((latitude, longitude), (target_lat, target_lng)).km
+
         return JsonResponse({
             'prefecture_id': closest_municipality.prefecture.id,
             'prefecture_name': closest_municipality.prefecture.name,
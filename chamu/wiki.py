@@ -0,0 +1,304 @@
+import asyncio
+import re
+import threading
+import weakref
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import httpx
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import Municipality, MunicipalityProfile
+
+PLACEHOLDER_IMAGE_URL = "https://via.placeholder.com/600x400"  # Ảnh mặc định nếu API không tìm thấy
+
+# Thời gian sống của profile: kết quả tốt lâu, kết quả âm (không tìm thấy, nhập nhằng, lỗi) ngắn
+WIKI_PROFILE_TTL = getattr(settings, 'WIKI_PROFILE_TTL', timedelta(days=7))
+WIKI_PROFILE_NEGATIVE_TTL = getattr(settings, 'WIKI_PROFILE_NEGATIVE_TTL', timedelta(hours=6))
+WIKI_PROFILE_REFRESH_LOCK_TIMEOUT = 300  # giây
+
+
+# ----------------- HTTP CLIENT -----------------
+DEFAULT_WIKIPEDIA_API_URL = "https://ja.wikipedia.org/w/api.php"
+
+
+USER_AGENT = 'chamu-web-app'
+
+
+def wikipedia_api_url():
+    return getattr(settings, 'WIKIPEDIA_API_URL', DEFAULT_WIKIPEDIA_API_URL)
+
+
+class AsyncHttpClient:
+    """
+    Client of the Wikipedia API: keep-alive connection pool, strict timeouts and a cap on
+    concurrent requests per host. No thread is held while a request is in flight.
+    One httpx.AsyncClient is used per event loop.
+    """
+
+    def __init__(self, max_per_host=4, timeout=(3.05, 5)):
+        self.max_per_host = max_per_host
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        # Client httpx và semaphore gắn với event loop đã tạo ra chúng
+        self._loops = weakref.WeakKeyDictionary()
+
+    def _loop_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            client = httpx.AsyncClient(
+                headers={'User-Agent': USER_AGENT},
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_per_host * 8,
+                                    max_keepalive_connections=self.max_per_host),
+            )
+            state = self._loops[loop] = (client, {})
+        return state
+
+    async def get_json(self, url, params):
+        client, host_slots = self._loop_state()
+        host = urlsplit(url).netloc
+        if host not in host_slots:
+            host_slots[host] = asyncio.Semaphore(self.max_per_host)
+        async with host_slots[host]:
+            response = await client.get(url, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self):
+        """Close the client of the running event loop (short-lived loops, see run_profile_refresh)."""
+        state = self._loops.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state[0].aclose()
+
+
+async_http_client = AsyncHttpClient(
+    max_per_host=getattr(settings, 'WIKI_MAX_CONNECTIONS_PER_HOST', 4),
+    timeout=getattr(settings, 'WIKI_HTTP_TIMEOUT', (3.05, 5)),
+)
+
+
+# ----------------- FETCH FROM WIKIPEDIA -----------------
+def summary_params(municipality_name, prefecture_name):
+    return {
+        "action": "query",
+        "format": "json",
+        "prop": "extracts|info|pageprops",
+        "exintro": 1,
+        "explaintext": 1,
+        "inprop": "url",
+        "ppprop": "disambiguation",
+        "redirects": 1,
+        "titles": f"{municipality_name} ({prefecture_name})|{municipality_name}",
+    }
+
+
+def parse_summary(data, municipality_name, prefecture_name):
+    """(description, wiki_url, status) from the API response of summary_params."""
+    full_name_query = f"{municipality_name} ({prefecture_name})"
+    query = data.get('query', {})
+
+    # Tên yêu cầu -> tên trang sau khi chuẩn hóa và chuyển hướng
+    renamed = {item['from']: item['to'] for item in query.get('normalized', []) + query.get('redirects', [])}
+    pages = {page.get('title'): page for page in query.get('pages', {}).values()}
+
+    def lookup(title):
+        seen = set()
+        while title in renamed and title not in seen:
+            seen.add(title)
+            title = renamed[title]
+        page = pages.get(title)
+        if page is None or 'missing' in page or 'invalid' in page:
+            return MunicipalityProfile.STATUS_NOT_FOUND, None
+        if 'disambiguation' in page.get('pageprops', {}):
+            return MunicipalityProfile.STATUS_DISAMBIGUATION, page
+        return MunicipalityProfile.STATUS_OK, page
+
+    status, page = lookup(full_name_query)
+    if status == MunicipalityProfile.STATUS_OK:
+        return page.get('extract', ''), page.get('fullurl'), status
+    if status == MunicipalityProfile.STATUS_DISAMBIGUATION:
+        print(f"Disambiguation error for {full_name_query}.")
+        return "Description is being updated due to multiple matches.", None, status
+
+    # Nếu không tìm thấy trang cụ thể, thử lại với tên chung hơn
+    status, page = lookup(municipality_name)
+    if status == MunicipalityProfile.STATUS_OK:
+        # Dọn dẹp mô tả nếu cần
+        description = re.sub(r'\"(.+?)\" có thể đề cập đến:', '', page.get('extract', ''), flags=re.IGNORECASE).strip()
+        return description, page.get('fullurl'), status
+
+    print(f"Error trying to get information from Wikipedia for {municipality_name}: {status}")
+    return "Description is being updated", None, status
+
+
+def image_params(municipality_name):
+    return {
+        "action": "query",
+        "format": "json",
+        "prop": "pageimages",
+        "titles": municipality_name,
+        "pithumbsize": 600,  # Kích thước hình ảnh thu nhỏ mong muốn
+        "redirects": 1
+    }
+
+
+def parse_image(data):
+    """URL of the main image from the API response of image_params, or None."""
+    pages = data['query']['pages']
+    for page_id, page_data in pages.items():
+        if 'thumbnail' in page_data:
+            return page_data['thumbnail']['source']  # Trả về URL của ảnh chính
+    return None
+
+
+async def afetch_wiki_profile(municipality_name, prefecture_name):
+    """
+    Get description, image and link from Wikipedia using a more specific query.
+    The image and summary lookups are in flight together on the event loop.
+    Returns (description, image_url, wiki_url, status), status is a MunicipalityProfile.STATUS_*.
+    """
+    api_url = wikipedia_api_url()
+    image_url, data = await asyncio.gather(
+        aget_municipality_image(api_url, municipality_name),
+        async_http_client.get_json(api_url, summary_params(municipality_name, prefecture_name)),
+    )
+    description, wiki_url, status = parse_summary(data, municipality_name, prefecture_name)
+    return description, image_url or PLACEHOLDER_IMAGE_URL, wiki_url, status
+
+
+async def aget_municipality_image(api_url, municipality_name):
+    """URL of the main image of the article, or None (errors are logged)."""
+    try:
+        return parse_image(await async_http_client.get_json(api_url, image_params(municipality_name)))
+    except (httpx.HTTPError, KeyError, ValueError) as e:
+        print(f"Error fetching data from Wikipedia API: {e}")
+    return None
+
+
+# ----------------- PROFILE STORE -----------------
+# Profile lưu khi không lấy được gì từ Wikipedia (thử lại sau WIKI_PROFILE_NEGATIVE_TTL)
+ERROR_PROFILE = ("Description is being updated", PLACEHOLDER_IMAGE_URL, None, MunicipalityProfile.STATUS_ERROR)
+
+
+def profile_stale_at(profile):
+    """When a stored profile becomes stale: WIKI_PROFILE_TTL, or the negative TTL for a failed lookup."""
+    ttl = WIKI_PROFILE_TTL if profile.status == MunicipalityProfile.STATUS_OK else WIKI_PROFILE_NEGATIVE_TTL
+    return profile.fetched_at + ttl
+
+
+def profile_is_stale(profile, now=None):
+    return profile_stale_at(profile) <= (now or timezone.now())
+
+
+async def arefresh_municipality_profile(municipality):
+    """
+    Fetch the profile from Wikipedia and store it (municipality.prefecture must be loaded).
+    On network errors an existing profile is kept; otherwise an 'error' profile
+    is stored so the next attempt waits for the negative TTL.
+    """
+    try:
+        description, image_url, wiki_url, status = await afetch_wiki_profile(
+            municipality.name, municipality.prefecture.name
+        )
+    except Exception as e:
+        print(f"Error refreshing Wikipedia profile for {municipality.name}: {e}")
+        existing = await MunicipalityProfile.objects.filter(municipality=municipality).afirst()
+        if existing is not None:
+            return existing
+        description, image_url, wiki_url, status = ERROR_PROFILE
+
+    profile, _ = await MunicipalityProfile.objects.aupdate_or_create(
+        municipality=municipality,
+        defaults=profile_defaults(description, image_url, wiki_url, status),
+    )
+    return profile
+
+
+def profile_defaults(description, image_url, wiki_url, status):
+    return {
+        'description': description,
+        'image_url': image_url or '',
+        'wiki_url': wiki_url,
+        'status': status,
+        'fetched_at': timezone.now(),
+    }
+
+
+def profile_version(municipality_id):
+    """Name of the version counter of one stored profile (bumped on save/delete, see signals.py)."""
+    return f'profile:{municipality_id}'
+
+
+def profile_refresh_key(municipality_id):
+    return f'chamu:wiki-profile-refresh:{municipality_id}'
+
+
+def schedule_profile_refresh(municipality_id):
+    """
+    Refresh a profile in the background, at most once at a time per municipality.
+    Uses Celery when a broker is configured, a daemon thread otherwise.
+    """
+    if not cache.add(profile_refresh_key(municipality_id), True, timeout=WIKI_PROFILE_REFRESH_LOCK_TIMEOUT):
+        return
+
+    if getattr(settings, 'CELERY_BROKER_URL', None):
+        from .tasks import refresh_municipality_profile_task
+        try:
+            refresh_municipality_profile_task.delay(municipality_id)
+            return
+        except Exception as e:
+            print(f'Could not schedule profile refresh, using a thread: {e}')
+
+    threading.Thread(target=run_profile_refresh, args=(municipality_id,), daemon=True).start()
+
+
+def run_profile_refresh(municipality_id):
+    """Background refresh (thread or Celery worker): the same async fetch as the views, on its own event loop."""
+    try:
+        municipality = Municipality.objects.select_related('prefecture').filter(id=municipality_id).first()
+        if municipality is not None:
+            async_to_sync(arefresh_in_background)(municipality)
+    finally:
+        cache.delete(profile_refresh_key(municipality_id))
+        close_old_connections()
+
+
+async def arefresh_in_background(municipality):
+    try:
+        return await arefresh_municipality_profile(municipality)
+    finally:
+        # Event loop chỉ sống trong lần làm mới này: đóng client httpx của nó
+        await async_http_client.aclose()
+
+
+async def aget_municipality_profile(municipality):
+    """
+    Return (description, image_url, wiki_url, stale_at) for the detail pages.
+    Stored profiles are served immediately; stale ones are refreshed in the background.
+    Only a municipality without any stored profile waits for Wikipedia, on the event loop,
+    so the worker keeps serving other requests meanwhile. stale_at is for callers that
+    keep the result (see arefresh_if_stale).
+    """
+    profile = await MunicipalityProfile.objects.filter(municipality=municipality).afirst()
+    if profile is None:
+        profile = await arefresh_municipality_profile(municipality)
+    elif profile_is_stale(profile):
+        await sync_to_async(schedule_profile_refresh)(municipality.id)
+
+    return (profile.description, profile.image_url or PLACEHOLDER_IMAGE_URL, profile.wiki_url,
+            profile_stale_at(profile))
+
+
+async def arefresh_if_stale(municipality_id, stale_at):
+    """
+    Schedule the background refresh of a profile served from a cache (e.g. a page fragment)
+    once it is stale, as aget_municipality_profile does for the stored profile.
+    """
+    if stale_at <= timezone.now():
+        await sync_to_async(schedule_profile_refresh)(municipality_id)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+from datetime import timedelta
 from pathlib import Path
 
 #from celery.schedules import crontab
@@ -48,6 +49,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'chamu.middleware.DataVersionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -84,6 +86,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # BEGIN IMMEDIATE: transaction giữ khóa ghi ngay từ đầu. Ở chế độ deferred, hai transaction
+        # đọc-rồi-ghi đồng thời (update_or_create profile, bump_version) lỗi "database is locked"
+        # ngay lập tức thay vì chờ busy timeout. Mọi atomic() của app đều ghi nên không mất gì.
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
     }
 }
 
@@ -137,6 +143,77 @@ LANGUAGES = [
     ('ja', 'Japanese'),
 ]
 
+# Cache dùng chung giữa các process (API, fragment trang). Bộ đếm phiên bản nằm trong database
+# (chamu/versions.py), với Redis thì được sao vào cache để revalidation không cần truy vấn.
+# Redis khi có REDIS_URL, nếu không thì bộ nhớ cục bộ (dev, test).
+REDIS_URL = os.environ.get('REDIS_URL')  # ví dụ: 'redis://localhost:6379/1'
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'map_web',
+        },
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'map_web_sessions',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'map_web',
+            'KEY_PREFIX': 'map_web',
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        },
+        # Tách riêng để việc cull của cache fragment không xóa mất session
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'map_web_sessions',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+    }
+
+API_CACHE_TIMEOUT = 3600  # giây
+FRAGMENT_CACHE_TIMEOUT = 3600  # giây
+API_CLIENT_MAX_AGE = 60  # giây, Cache-Control max-age của /api/*
+RESULTS_PAGE_MAX_AGE = 300  # giây, Cache-Control max-age của trang kết quả chia sẻ
+
+# Session: 'db' ghi vào SQLite ở mỗi bước của luồng survey; 'cache' (Redis) và
+# 'signed_cookies' không ghi database. Mặc định dùng Redis khi có REDIS_URL
+# (cache cục bộ không dùng chung được giữa các process).
+SESSION_MODE = os.environ.get('SESSION_MODE', 'cache' if REDIS_URL else 'db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cache': 'chamu.sessions.cache',
+    'signed_cookies': 'chamu.sessions.signed_cookies',
+}[SESSION_MODE]
+SESSION_CACHE_ALIAS = 'sessions'
+# Phiên cũ trong bảng django_session được đọc và chuyển sang store mới khi gặp lại
+SESSION_LEGACY_DB_FALLBACK = os.environ.get('SESSION_LEGACY_DB_FALLBACK', '1') == '1'
+
+# Cache kết quả xếp hạng (chamu.matching.ranking_cache)
+RANKING_CACHE_SIZE = 256
+RANKING_CACHE_TTL = 600  # giây
+
+# Snapshot ma trận điểm (manage.py export_score_snapshot). None = luôn đọc từ database
+SCORE_SNAPSHOT_PATH = os.environ.get('SCORE_SNAPSHOT_PATH')  # ví dụ: BASE_DIR / 'var' / 'score_snapshot'
+
+# Score store dùng chung giữa các worker (gunicorn/celery) qua file memory-mapped.
+# None = mỗi process tự giữ ma trận điểm của mình
+SCORE_STORE_DIR = os.environ.get('SCORE_STORE_DIR')  # ví dụ: BASE_DIR / 'var' / 'score_store'
+SCORE_STORE_KEEP_GENERATIONS = 3
+SCORE_STORE_PUBLISH_DEBOUNCE = 2  # giây
+
+# Thời gian sống của profile Wikipedia (chamu.wiki)
+WIKI_PROFILE_TTL = timedelta(days=7)
+WIKI_PROFILE_NEGATIVE_TTL = timedelta(hours=6)
+WIKIPEDIA_API_URL = 'https://ja.wikipedia.org/w/api.php'
+WIKI_HTTP_TIMEOUT = (3.05, 5)  # (connect, read) giây
+WIKI_MAX_CONNECTIONS_PER_HOST = 4
+
 CSRF_TRUSTED_ORIGINS = [
     'https://*.ngrok-free.app',
     'http://127.0.0.1',
@@ -144,7 +221,9 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 
 # Cấu hình Celery Broker và Backend
-# CELERY_BROKER_URL = 'redis://localhost:6379/0'
+# Không đặt CELERY_BROKER_URL thì việc tính lại điểm chạy đồng bộ (môi trường dev)
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')  # ví dụ: 'redis://localhost:6379/0'
+SCORE_RECOMPUTE_DEBOUNCE = 10  # giây
 # CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 # CELERY_ACCEPT_CONTENT = ['json']
 # CELERY_TASK_SERIALIZER = 'json'
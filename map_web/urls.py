@@ -9,6 +9,7 @@ urlpatterns = [
     path('api/prefecture_coords/', views.get_prefecture_coords, name='get_prefecture_coords'),
     path('api/municipality_coords/', views.get_municipality_coords, name='get_municipality_coords'),
     path('api/location_by_coords/', views.get_location_by_coords, name='get_location_by_coords'),
+    path('api/ranking_cache_stats/', views.get_ranking_cache_stats, name='get_ranking_cache_stats'),
     path('admin/', admin.site.urls),
     path('', include('chamu.urls')),
 ]
\ No newline at end of file